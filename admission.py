@@ -0,0 +1,197 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+from db_setup import DB_POOL_SIZE
+from server_timing import record_queue_wait
+
+# Requests allowed to wait for a free slot once all DB_POOL_SIZE slots are taken
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "50"))
+# Seconds a queued request waits before it gets a 503
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2.0"))
+# Value of the Retry-After header on rejected requests
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+# Paths that never touch the database and must keep working under load
+EXEMPT_PREFIXES = ("/admin", "/metrics", "/docs", "/redoc", "/openapi.json")
+# Long-poll routes wait without a connection, they only take a slot around their queries (see `admitted`)
+SELF_ADMITTED = re.compile(r"^/messages/\d+/\d+/since/\d+$")
+
+# Upper bounds (seconds) of the queue wait histogram
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class AdmissionController:
+    """
+    Caps how many requests do database work at the same time.
+
+    Up to `limit` requests run at once, the next `queue_size` requests wait
+    in FIFO order for at most `timeout` seconds, and everything beyond that
+    is turned away immediately. All state is only touched from the event
+    loop, so no locking is needed apart from the stats snapshot.
+    """
+
+    def __init__(self, limit, queue_size, timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.in_flight = 0
+        self._waiters = deque()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected_queue_full": 0,
+            "rejected_timeout": 0,
+            "max_queue_depth": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "wait_buckets": [0] * (len(WAIT_BUCKETS) + 1),
+        }
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _record_wait(self, seconds):
+        record_queue_wait(seconds)
+        with self._stats_lock:
+            self._stats["wait_seconds_total"] += seconds
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], seconds)
+            for i, bound in enumerate(WAIT_BUCKETS):
+                if seconds <= bound:
+                    self._stats["wait_buckets"][i] += 1
+                    break
+            else:
+                self._stats["wait_buckets"][-1] += 1
+
+    async def acquire(self):
+        """Wait for a slot. Returns False when the request should be rejected."""
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self._count("admitted")
+            return True
+
+        if len(self._waiters) >= self.queue_size:
+            self._count("rejected_queue_full")
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self._count("queued")
+        with self._stats_lock:
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], len(self._waiters))
+
+        started = time.perf_counter()
+        try:
+            # shield() so a timeout doesn't cancel a slot that was handed over at the same moment
+            await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if not future.done():
+                future.cancel()
+                self._waiters.remove(future)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self._record_wait(time.perf_counter() - started)
+                self._count("rejected_timeout")
+                return False
+            if isinstance(e, asyncio.CancelledError):
+                # We got the slot but the client went away, pass it on
+                self.release()
+                raise
+
+        self._record_wait(time.perf_counter() - started)
+        self._count("admitted")
+        return True
+
+    def release(self):
+        # Hand the slot straight to the oldest waiter, so in_flight stays the same
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+            snapshot["wait_buckets"] = {
+                **{str(bound): count for bound, count in zip(WAIT_BUCKETS, self._stats["wait_buckets"])},
+                "+Inf": self._stats["wait_buckets"][-1],
+            }
+        snapshot["limit"] = self.limit
+        snapshot["queue_size"] = self.queue_size
+        snapshot["queue_timeout"] = self.timeout
+        snapshot["in_flight"] = self.in_flight
+        snapshot["queue_depth"] = len(self._waiters)
+        return snapshot
+
+
+admission = AdmissionController(DB_POOL_SIZE, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT)
+
+
+@asynccontextmanager
+async def admitted():
+    """
+    Hold an admission slot for a block of DB work inside a route.
+
+    For routes listed in SELF_ADMITTED, which would otherwise hold a slot
+    for as long as they wait. Raises a 503 HTTPException when no slot frees
+    up in time.
+    """
+    if not await admission.acquire():
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please try again later",
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+        )
+    try:
+        yield
+    finally:
+        admission.release()
+
+
+def admission_stats():
+    """Current in-flight count, queue depth and queue wait times."""
+    return admission.stats()
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that puts every database-backed request through admission control.
+
+    Rejected requests get a 503 with a Retry-After header straight away
+    instead of piling up on the threadpool and opening yet another connection.
+    """
+
+    def __init__(self, app, controller=admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or path.startswith(EXEMPT_PREFIXES) or SELF_ADMITTED.match(path):
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.controller.acquire():
+            response = JSONResponse(
+                {"detail": "Server is busy, please try again later"},
+                status_code=503,
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
@@ -1,21 +1,59 @@
+import asyncio
+import hmac
 import os
+from contextlib import asynccontextmanager
 
 import psycopg2
 from db_setup import get_connection
-from fastapi import FastAPI, HTTPException
-
-app = FastAPI()
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+
+from admission import AdmissionMiddleware, admission_stats, admitted
+from coalesce import CoalesceMiddleware, coalescing_stats, single_flight
+from compression import CompressionMiddleware, compression_stats
+from conntrack import connection_stats
+from metrics import render_prometheus
+from negotiation import BULK_RESPONSES, JSON_TYPE, bulk_response, negotiate
+from profiler import ProfilerMiddleware
+from querylog import slow_query_stats
+from realtime import message_hub
+from server_timing import ServerTimingMiddleware, TimedJSONResponse
+
+@asynccontextmanager
+async def lifespan(app):
+    # One LISTEN connection per process pushes new messages to connected clients
+    await message_hub.start()
+    yield
+    await message_hub.stop()
+
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
+
+# Negotiated gzip/brotli for large responses (see compression.py for the settings)
+app.add_middleware(CompressionMiddleware)
+# Caps concurrent DB work and sheds excess load with a 503
+app.add_middleware(AdmissionMiddleware)
+# Outside admission, so requests collapsed into a running one don't take a slot
+app.add_middleware(CoalesceMiddleware, router=app.router)
+# Samples single requests on demand, see profiler.py
+app.add_middleware(ProfilerMiddleware)
+# Outermost, so the Server-Timing header also covers the admission queue
+app.add_middleware(ServerTimingMiddleware)
 
 # Importing db.py file structure for use in routes/endpoint
 from db import (
     create_user, 
     get_user_by_id, 
     get_all_users, 
+    ExtensionMissing,
+    search_users,
     update_user, 
     delete_user, 
     create_course, 
     get_course, 
     get_courses_by_teacher, 
+    get_course_stats,
+    get_course_stats_by_teacher,
     update_course, 
     delete_course,
     create_enrollment, 
@@ -29,12 +67,21 @@ from db import (
     delete_assignment,
     create_message, 
     get_messages_between_users,
+    create_course_broadcast,
+    get_messages_between_users_since,
+    get_conversations,
+    search_messages,
+    mark_conversation_read,
+    get_conversation_read,
+    get_unread_counts,
     create_submission, 
     get_submission, 
     get_submissions_by_assignment, 
     get_submissions_by_student,
     update_submission_grade, 
     delete_submission,
+    get_assignment_grade_stats,
+    get_course_grade_stats,
     create_lesson, 
     get_lesson, 
     get_lessons_by_course, 
@@ -52,6 +99,18 @@ from db import (
     get_attendance_by_student, 
     update_attendance, 
     delete_attendance,
+    get_student_attendance_rates,
+    get_course_attendance_rates,
+    stream_submissions_by_assignment,
+    stream_submissions_by_student,
+    SEARCH_SOURCES,
+    search_content,
+    get_course_submission_report,
+    get_assignment_submission_report,
+    stream_course_submission_report,
+    stream_assignment_submission_report,
+    stream_attendance_by_lesson,
+    stream_attendance_by_student,
 )
 # Importing Schemas data
 from schemas import (
@@ -59,10 +118,12 @@ from schemas import (
     UserGet,
     UserPatch,
     UserPut,
+    UserSearchGet,
     CourseGet,
     CourseCreate,
     CoursePatch,
     CoursePut,
+    CourseStatsGet,
     EnrollmentGet,
     EnrollmentCreate,
     AssignmentGet,
@@ -70,9 +131,19 @@ from schemas import (
     AssignmentUpdate,
     MessageGet,
     MessageCreate,
+    BroadcastCreate,
+    BroadcastGet,
+    ConversationGet,
+    MessageSearchGet,
+    ConversationReadGet,
+    UnreadCountsGet,
     SubmissionGet,
     SubmissionCreate,
     GradeUpdate,
+    AssignmentGradeStatsGet,
+    CourseGradeStatsGet,
+    SubmissionReportGet,
+    SearchResultGet,
     LessonGet,
     LessonCreate,
     LessonPut,
@@ -82,6 +153,8 @@ from schemas import (
     AttendanceGet,
     AttendanceCreate,
     AttendancePut,
+    StudentAttendanceRatesGet,
+    CourseAttendanceRatesGet,
 )
 
 # -------------------------
@@ -117,6 +190,46 @@ def create_user_route(user: UserCreate): # Adding schema UserCreate
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
+# Registered before /users/{user_id}, which would otherwise take "search" as an ID
+@app.get("/users/search", response_model=list[UserSearchGet])
+def search_users_route(
+    q: str = Query(..., min_length=3, max_length=100, description="Part of a username or email"),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """
+    Search users by partial username or email.
+
+    Returns users whose username or email contains `q`, or has a part
+    that closely resembles it (so small typos still match). They are
+    ranked by trigram word similarity. Both conditions are served by a
+    trigram index. For common terms only the first 200 matches are
+    ranked, so the order is best effort. At least 3 characters are
+    required, since shorter input has no trigrams to look up.
+
+    Parameters
+    ----------
+    q : str
+        The text to look for.
+    limit : int
+        The maximum number of users to return (1-100).
+
+    Returns
+    -------
+    list[UserSearchGet]
+        The matching users, best match first.
+
+    Raises
+    ------
+    HTTPException (503)
+        If the pg_trgm extension is not installed.
+    """
+    con = get_connection()
+    try:
+        users = search_users(con, q, limit)
+    except ExtensionMissing as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return users
+
 @app.get("/users/{user_id}", response_model=UserGet)
 def get_user_route(user_id: int):
     """
@@ -391,6 +504,58 @@ def get_courses_by_teacher_route(teacher_id: int):
     courses = get_courses_by_teacher(con, teacher_id)
     return courses
 
+@app.get("/courses/{course_id}/stats", response_model=CourseStatsGet)
+def get_course_stats_route(course_id: int):
+    """
+    Get the enrollment, lesson, assignment and resource counts of a course.
+
+    The counts are maintained by triggers, so this is a primary key lookup
+    instead of four list calls.
+
+    Parameters
+    ----------
+    course_id : int
+        The ID of the course.
+
+    Returns
+    -------
+    CourseStatsGet
+        The course's title and counts.
+
+    Raises
+    ------
+    HTTPException (404)
+        If the course does not exist.
+    """
+    con = get_connection()
+    stats = get_course_stats(con, course_id)
+    if not stats:
+        raise HTTPException(status_code=404, detail="Course not found")
+    return stats
+
+@app.get("/teachers/{teacher_id}/courses/stats", response_model=list[CourseStatsGet])
+def get_course_stats_by_teacher_route(teacher_id: int):
+    """
+    Get the counts of every course taught by a specific teacher.
+
+    Lists the teacher's courses with their enrollment, lesson, assignment
+    and resource counts. If the teacher has no courses, an empty list is
+    returned.
+
+    Parameters
+    ----------
+    teacher_id : int
+        The ID of the teacher whose courses should be listed.
+
+    Returns
+    -------
+    list[CourseStatsGet]
+        The teacher's courses with their counts.
+    """
+    con = get_connection()
+    stats = get_course_stats_by_teacher(con, teacher_id)
+    return stats
+
 @app.put("/courses/{course_id}", response_model=CourseGet)
 def update_course_put_route(course_id: int, course: CoursePut):
     """
@@ -695,6 +860,7 @@ def get_assignment_route(assignment_id: int):
     return assignment
 
 @app.get("/courses/{course_id}/assignments", response_model=list[AssignmentGet])
+@single_flight("assignments_by_course")
 def get_assignments_by_course_route(course_id: int):
     """
     Get all assignments for a specific course.
@@ -888,6 +1054,46 @@ def send_message_route(message: MessageCreate):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post("/courses/{course_id}/broadcast", status_code=201, response_model=BroadcastGet)
+def broadcast_message_route(course_id: int, broadcast: BroadcastCreate):
+    """
+    Send a message to everyone enrolled in a course.
+
+    This endpoint writes one message per enrolled user (except the sender)
+    with a single INSERT ... SELECT from enrollments, updates their unread
+    counters and pushes the messages to connected clients. If the course
+    does not exist, a 404 HTTPException is raised. Any other error results
+    in a 400 HTTPException.
+
+    Parameters
+    ----------
+    course_id : int
+        The ID of the course whose enrollees should get the message.
+    broadcast : BroadcastCreate
+        The sender ID and the message content.
+
+    Returns
+    -------
+    BroadcastGet
+        How many users got the message and the range of new message IDs.
+
+    Raises
+    ------
+    HTTPException (404)
+        If the course does not exist.
+    HTTPException (400)
+        If the broadcast cannot be sent due to invalid data or a database error.
+    """
+    con = get_connection()
+    if not get_course(con, course_id):
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    try:
+        result = create_course_broadcast(con, course_id, broadcast.sender_id, broadcast.content)
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/messages/{user1_id}/{user2_id}", response_model=list[MessageGet])
 def get_messages_route(user1_id: int, user2_id: int):
     """
@@ -925,6 +1131,268 @@ def get_messages_route(user1_id: int, user2_id: int):
     
     return messages
 
+@app.get("/users/{user_id}/conversations", response_model=list[ConversationGet])
+def get_conversations_route(
+    user_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Get a user's inbox.
+
+    This endpoint returns one entry per conversation partner of the given
+    `user_id`, holding the latest message exchanged with that partner and
+    when it was sent. The conversations are sorted by most recent message
+    first and paginated with `limit` and `offset`.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the user whose conversations should be retrieved.
+    limit : int
+        The maximum number of conversations to return (1-100).
+    offset : int
+        The number of conversations to skip.
+
+    Returns
+    -------
+    list[ConversationGet]
+        The user's conversations, most recent first.
+    """
+    con = get_connection()
+    conversations = get_conversations(con, user_id, limit, offset)
+    return conversations
+
+@app.get("/users/{user_id}/messages/search", response_model=list[MessageSearchGet])
+def search_messages_route(
+    user_id: int,
+    q: str = Query(..., min_length=1, max_length=200, description="Words to search for"),
+    partner_id: int | None = Query(None, description="Only the conversation with this user"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Search a user's messages.
+
+    Only messages the given `user_id` sent or received are searched,
+    optionally only those exchanged with `partner_id`. `q` supports
+    web-search syntax ("exact phrase", `or`, `-excluded`). Results are
+    sorted by rank, then newest first, and paginated with `limit` and
+    `offset`.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the user whose messages are searched.
+    q : str
+        The search text.
+    partner_id : int, optional
+        Restrict the search to the conversation with this user.
+    limit : int
+        The maximum number of messages to return (1-100).
+    offset : int
+        The number of messages to skip.
+
+    Returns
+    -------
+    list[MessageSearchGet]
+        The matching messages, best match first.
+    """
+    con = get_connection()
+    messages = search_messages(con, user_id, q, partner_id, limit, offset)
+    return messages
+
+@app.post("/users/{user_id}/conversations/{partner_id}/read", response_model=ConversationReadGet)
+def mark_conversation_read_route(user_id: int, partner_id: int):
+    """
+    Mark a conversation as read.
+
+    This endpoint marks every message `partner_id` has sent to `user_id`
+    as read: the unread counter is reset to 0 and the latest message ID is
+    stored as the last read message, which the partner can use as a read
+    receipt. Any database error results in a 400 HTTPException.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the user who read the conversation.
+    partner_id : int
+        The ID of the other user in the conversation.
+
+    Returns
+    -------
+    ConversationReadGet
+        The updated read state of the conversation.
+
+    Raises
+    ------
+    HTTPException (400)
+        If the users don't exist or the update fails.
+    """
+    con = get_connection()
+    try:
+        read_state = mark_conversation_read(con, user_id, partner_id)
+        return read_state
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/users/{user_id}/conversations/{partner_id}/read", response_model=ConversationReadGet)
+def get_conversation_read_route(user_id: int, partner_id: int):
+    """
+    Get the read state of a conversation.
+
+    This endpoint returns how many messages from `partner_id` the user
+    `user_id` hasn't read yet and the last message they have read. Swap the
+    IDs to get the read receipt for your own messages. A conversation that
+    has never had any messages is returned with zero unread messages.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the reading user.
+    partner_id : int
+        The ID of the other user in the conversation.
+
+    Returns
+    -------
+    ConversationReadGet
+        The read state of the conversation.
+    """
+    con = get_connection()
+    read_state = get_conversation_read(con, user_id, partner_id)
+    if not read_state:
+        return {"user_id": user_id, "partner_id": partner_id, "unread_count": 0}
+    return read_state
+
+@app.get("/users/{user_id}/unread", response_model=UnreadCountsGet)
+def get_unread_counts_route(user_id: int):
+    """
+    Get a user's unread message counters.
+
+    This endpoint returns the total number of unread messages and the
+    conversations that have any, read straight from the maintained
+    counters instead of counting messages.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the user whose unread counters should be retrieved.
+
+    Returns
+    -------
+    UnreadCountsGet
+        The total and the per-conversation unread counters.
+    """
+    con = get_connection()
+    conversations = get_unread_counts(con, user_id)
+    return {
+        "total": sum(c["unread_count"] for c in conversations),
+        "conversations": conversations,
+    }
+
+# Longest a long-poll request may be held open
+MAX_POLL_SECONDS = 60
+
+def _messages_since(user1_id, user2_id, message_id):
+    # Own short-lived connection, so nothing is held while the request waits
+    con = get_connection()
+    try:
+        return get_messages_between_users_since(con, user1_id, user2_id, message_id)
+    finally:
+        con.close()
+
+@app.get("/messages/{user1_id}/{user2_id}/since/{message_id}", response_model=list[MessageGet])
+async def poll_messages_route(
+    user1_id: int,
+    user2_id: int,
+    message_id: int,
+    timeout: float = Query(25, ge=0, le=MAX_POLL_SECONDS),
+):
+    """
+    Long-poll for new messages between two users.
+
+    Returns the messages exchanged after `message_id` (the last one the
+    client has seen), oldest first. If there are none yet, the request is
+    held open, without a database connection, until a new message arrives
+    or `timeout` seconds pass, in which case an empty list is returned.
+
+    Parameters
+    ----------
+    user1_id : int
+        The ID of the first user in the conversation.
+    user2_id : int
+        The ID of the second user in the conversation.
+    message_id : int
+        The last message ID the client already has, 0 for everything.
+    timeout : float
+        Seconds to wait for a new message before returning an empty list.
+
+    Returns
+    -------
+    list[MessageGet]
+        The messages sent after `message_id`, possibly empty.
+    """
+    # Subscribe before querying, so a message sent in between isn't missed
+    queue = message_hub.subscribe(user1_id)
+    try:
+        async with admitted():
+            messages = await run_in_threadpool(_messages_since, user1_id, user2_id, message_id)
+        if messages:
+            return messages
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return []
+            try:
+                message, _ = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                return []
+            if {message["sender_id"], message["receiver_id"]} == {user1_id, user2_id} and message["message_id"] > message_id:
+                break
+
+        # Read the delta from the database, more may have arrived together
+        async with admitted():
+            return await run_in_threadpool(_messages_since, user1_id, user2_id, message_id)
+    finally:
+        message_hub.unsubscribe(user1_id, queue)
+
+@app.websocket("/ws/messages/{user_id}")
+async def messages_websocket(websocket: WebSocket, user_id: int):
+    """
+    Push new messages to a user over a WebSocket.
+
+    Every message the user sends or receives after connecting is pushed as
+    a JSON object with the same fields as `MessageGet`. The socket doesn't
+    hold a database connection while it is open; messages arrive through
+    the process-wide LISTEN/NOTIFY listener in realtime.py.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the user whose messages should be pushed.
+    """
+    await websocket.accept()
+    queue = message_hub.subscribe(user_id)
+
+    async def push():
+        while True:
+            _, text = await queue.get()
+            await websocket.send_text(text)
+
+    pusher = asyncio.create_task(push())
+    try:
+        # Clients don't need to send anything, we only read to notice when they leave
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        pusher.cancel()
+        message_hub.unsubscribe(user_id, queue)
+
 # -----------------------------
 # SUBMISSION / routes
 # -----------------------------
@@ -998,8 +1466,12 @@ def get_submission_route(submission_id: int):
         raise HTTPException(status_code=404, detail="Submission not found")
     return submission
 
-@app.get("/assignments/{assignment_id}/submissions", response_model=list[SubmissionGet])
-def get_submissions_by_assignment_route(assignment_id: int):
+@app.get(
+    "/assignments/{assignment_id}/submissions",
+    response_model=list[SubmissionGet],
+    responses=BULK_RESPONSES,
+)
+def get_submissions_by_assignment_route(assignment_id: int, request: Request):
     """
     Get all submissions for a specific assignment.
 
@@ -1007,6 +1479,10 @@ def get_submissions_by_assignment_route(assignment_id: int):
     `assignment_id`. If the assignment has no submissions, an empty list is
     returned.
 
+    Clients can send `Accept: application/x-msgpack` or
+    `Accept: application/vnd.apache.arrow.stream` to get the rows as
+    MessagePack or as an Arrow IPC stream instead of JSON.
+
     Parameters
     ----------
     assignment_id : int
@@ -1018,11 +1494,20 @@ def get_submissions_by_assignment_route(assignment_id: int):
         A list of submissions for the specified assignment.
     """
     con = get_connection()
+
+    media_type = negotiate(request.headers.get("accept"))
+    if media_type != JSON_TYPE:
+        return bulk_response(media_type, stream_submissions_by_assignment(con, assignment_id))
+
     submissions = get_submissions_by_assignment(con, assignment_id)
     return submissions
 
-@app.get("/students/{student_id}/submissions", response_model=list[SubmissionGet])
-def get_submissions_by_student_route(student_id: int):
+@app.get(
+    "/students/{student_id}/submissions",
+    response_model=list[SubmissionGet],
+    responses=BULK_RESPONSES,
+)
+def get_submissions_by_student_route(student_id: int, request: Request):
     """
     Get all submissions made by a specific student.
 
@@ -1030,6 +1515,10 @@ def get_submissions_by_student_route(student_id: int):
     `student_id`. If the student has not submitted any assignments, an empty
     list is returned.
 
+    Clients can send `Accept: application/x-msgpack` or
+    `Accept: application/vnd.apache.arrow.stream` to get the rows as
+    MessagePack or as an Arrow IPC stream instead of JSON.
+
     Parameters
     ----------
     student_id : int
@@ -1041,6 +1530,11 @@ def get_submissions_by_student_route(student_id: int):
         A list of submissions made by the specified student.
     """
     con = get_connection()
+
+    media_type = negotiate(request.headers.get("accept"))
+    if media_type != JSON_TYPE:
+        return bulk_response(media_type, stream_submissions_by_student(con, student_id))
+
     submissions = get_submissions_by_student(con, student_id)
     return submissions
 
@@ -1085,6 +1579,204 @@ def grade_submission_route(submission_id: int, grade_data: GradeUpdate):
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
 
+@app.get("/assignments/{assignment_id}/stats", response_model=AssignmentGradeStatsGet)
+def assignment_grade_stats_route(
+    assignment_id: int,
+    low: float = Query(0, description="Lower bound of the histogram"),
+    high: float = Query(100, description="Upper bound of the histogram"),
+    buckets: int = Query(10, ge=1, le=100, description="Number of histogram buckets"),
+):
+    """
+    Get grade statistics for an assignment.
+
+    Computes the number of submissions and graded submissions, the mean,
+    standard deviation, minimum, maximum, median and percentiles of their
+    scores, plus a histogram, in a single aggregate query. Scores below
+    `low` or above `high` are counted in the first or last bucket.
+
+    Parameters
+    ----------
+    assignment_id : int
+        The ID of the assignment.
+    low : float
+        Lower bound of the histogram.
+    high : float
+        Upper bound of the histogram.
+    buckets : int
+        Number of equally wide histogram buckets.
+
+    Returns
+    -------
+    AssignmentGradeStatsGet
+        The statistics of the assignment's scores.
+
+    Raises
+    ------
+    HTTPException (400)
+        If `high` is not greater than `low`.
+    HTTPException (404)
+        If the assignment does not exist.
+    """
+    if high <= low:
+        raise HTTPException(status_code=400, detail="high must be greater than low")
+    con = get_connection()
+    stats = get_assignment_grade_stats(con, assignment_id, low, high, buckets)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    return stats
+
+@app.get("/courses/{course_id}/grade-stats", response_model=CourseGradeStatsGet)
+def course_grade_stats_route(
+    course_id: int,
+    low: float = Query(0, description="Lower bound of the histogram"),
+    high: float = Query(100, description="Upper bound of the histogram"),
+    buckets: int = Query(10, ge=1, le=100, description="Number of histogram buckets"),
+):
+    """
+    Get grade statistics over all assignments of a course.
+
+    Same statistics as for a single assignment, computed over every
+    submission to any of the course's assignments in one aggregate query.
+
+    Parameters
+    ----------
+    course_id : int
+        The ID of the course.
+    low : float
+        Lower bound of the histogram.
+    high : float
+        Upper bound of the histogram.
+    buckets : int
+        Number of equally wide histogram buckets.
+
+    Returns
+    -------
+    CourseGradeStatsGet
+        The statistics of the course's scores.
+
+    Raises
+    ------
+    HTTPException (400)
+        If `high` is not greater than `low`.
+    HTTPException (404)
+        If the course does not exist.
+    """
+    if high <= low:
+        raise HTTPException(status_code=400, detail="high must be greater than low")
+    con = get_connection()
+    stats = get_course_grade_stats(con, course_id, low, high, buckets)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+    return stats
+
+def _submission_report_response(con, request, report, stream, owner_id, status, limit, offset):
+    # JSON pages default to 100 rows; the bulk formats return everything
+    # unless a limit is given, so the whole report can be exported
+    media_type = negotiate(request.headers.get("accept"))
+    if media_type != JSON_TYPE:
+        return bulk_response(media_type, stream(con, owner_id, status, limit, offset))
+    return report(con, owner_id, status, limit or 100, offset)
+
+@app.get(
+    "/courses/{course_id}/submission-report",
+    response_model=list[SubmissionReportGet],
+    responses=BULK_RESPONSES,
+)
+def course_submission_report_route(
+    course_id: int,
+    request: Request,
+    status: str | None = Query(None, pattern="^(missing|late)$", description="Only missing or only late"),
+    limit: int | None = Query(None, ge=1, le=1000, description="Rows per page, 100 by default for JSON"),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Get the late and missing submissions of a course.
+
+    Lists every enrolled student who has no submission for an assignment
+    whose due date has passed (`missing`), or whose first submission came
+    in after the due date (`late`). Rows are ordered by due date, then
+    assignment and student, and paginated with `limit` and `offset`.
+
+    Send `Accept: text/csv` to download the report as CSV. MessagePack and
+    Arrow are supported as well. These formats return the whole report
+    unless `limit` is given.
+
+    Parameters
+    ----------
+    course_id : int
+        The ID of the course.
+    status : str, optional
+        `missing` or `late` to report only one of them.
+    limit : int, optional
+        The maximum number of rows to return (1-1000).
+    offset : int
+        The number of rows to skip.
+
+    Returns
+    -------
+    list[SubmissionReportGet]
+        One row per student and assignment that is missing or late.
+
+    Raises
+    ------
+    HTTPException (404)
+        If the course does not exist.
+    """
+    con = get_connection()
+    if not get_course(con, course_id):
+        raise HTTPException(status_code=404, detail="Course not found")
+    return _submission_report_response(
+        con, request, get_course_submission_report, stream_course_submission_report,
+        course_id, status, limit, offset,
+    )
+
+@app.get(
+    "/assignments/{assignment_id}/submission-report",
+    response_model=list[SubmissionReportGet],
+    responses=BULK_RESPONSES,
+)
+def assignment_submission_report_route(
+    assignment_id: int,
+    request: Request,
+    status: str | None = Query(None, pattern="^(missing|late)$", description="Only missing or only late"),
+    limit: int | None = Query(None, ge=1, le=1000, description="Rows per page, 100 by default for JSON"),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Get the late and missing submissions of an assignment.
+
+    Same report as for a course, limited to one assignment. `Accept:
+    text/csv` returns it as CSV.
+
+    Parameters
+    ----------
+    assignment_id : int
+        The ID of the assignment.
+    status : str, optional
+        `missing` or `late` to report only one of them.
+    limit : int, optional
+        The maximum number of rows to return (1-1000).
+    offset : int
+        The number of rows to skip.
+
+    Returns
+    -------
+    list[SubmissionReportGet]
+        One row per enrolled student who is missing or late.
+
+    Raises
+    ------
+    HTTPException (404)
+        If the assignment does not exist.
+    """
+    con = get_connection()
+    if not get_assignment(con, assignment_id):
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    return _submission_report_response(
+        con, request, get_assignment_submission_report, stream_assignment_submission_report,
+        assignment_id, status, limit, offset,
+    )
+
 @app.delete("/submissions/{submission_id}", response_model=SubmissionGet)
 def delete_submission_route(submission_id: int):
     """
@@ -1192,6 +1884,7 @@ def get_lesson_route(lesson_id: int):
     return lesson
 
 @app.get("/courses/{course_id}/lessons", response_model=list[LessonGet])
+@single_flight("lessons_by_course")
 def get_lessons_by_course_route(course_id: int):
     """
     Get all lessons for a specific course.
@@ -1368,6 +2061,7 @@ def get_resource_route(resource_id: int):
     return resource
 
 @app.get("/courses/{course_id}/resources", response_model=list[ResourceGet])
+@single_flight("resources_by_course")
 def get_resources_by_course_route(course_id: int):
     """
     Get all resources for a specific course.
@@ -1390,6 +2084,7 @@ def get_resources_by_course_route(course_id: int):
     return resources
 
 @app.get("/lessons/{lesson_id}/resources", response_model=list[ResourceGet])
+@single_flight("resources_by_lesson")
 def get_resources_by_lesson_route(lesson_id: int):
     """
     Get all resources for a specific lesson.
@@ -1568,8 +2263,12 @@ def get_attendance_route(attendance_id: int):
         raise HTTPException(status_code=404, detail="Attendance record not found")
     return attendance
 
-@app.get("/lessons/{lesson_id}/attendance", response_model=list[AttendanceGet])
-def get_attendance_by_lesson_route(lesson_id: int):
+@app.get(
+    "/lessons/{lesson_id}/attendance",
+    response_model=list[AttendanceGet],
+    responses=BULK_RESPONSES,
+)
+def get_attendance_by_lesson_route(lesson_id: int, request: Request):
     """
     Get all attendance for a specific lesson.
 
@@ -1577,6 +2276,10 @@ def get_attendance_by_lesson_route(lesson_id: int):
     given `lesson_id`. If the lesson has no attendance records, an empty list
     is returned.
 
+    Clients can send `Accept: application/x-msgpack` or
+    `Accept: application/vnd.apache.arrow.stream` to get the rows as
+    MessagePack or as an Arrow IPC stream instead of JSON.
+
     Parameters
     ----------
     lesson_id : int
@@ -1588,11 +2291,20 @@ def get_attendance_by_lesson_route(lesson_id: int):
         A list of attendance records for the specified lesson.
     """
     con = get_connection()
+
+    media_type = negotiate(request.headers.get("accept"))
+    if media_type != JSON_TYPE:
+        return bulk_response(media_type, stream_attendance_by_lesson(con, lesson_id))
+
     attendance = get_attendance_by_lesson(con, lesson_id)
     return attendance
 
-@app.get("/students/{student_id}/attendance", response_model=list[AttendanceGet])
-def get_attendance_by_student_route(student_id: int):
+@app.get(
+    "/students/{student_id}/attendance",
+    response_model=list[AttendanceGet],
+    responses=BULK_RESPONSES,
+)
+def get_attendance_by_student_route(student_id: int, request: Request):
     """
     GEt all attendance for a specific student.
 
@@ -1600,6 +2312,10 @@ def get_attendance_by_student_route(student_id: int):
     given `student_id`. If the student has no attendance records, an empty
     list is returned.
 
+    Clients can send `Accept: application/x-msgpack` or
+    `Accept: application/vnd.apache.arrow.stream` to get the rows as
+    MessagePack or as an Arrow IPC stream instead of JSON.
+
     Parameters
     ----------
     student_id : int
@@ -1611,9 +2327,75 @@ def get_attendance_by_student_route(student_id: int):
         A list of attendance records for the specified student.
     """
     con = get_connection()
+
+    media_type = negotiate(request.headers.get("accept"))
+    if media_type != JSON_TYPE:
+        return bulk_response(media_type, stream_attendance_by_student(con, student_id))
+
     attendance = get_attendance_by_student(con, student_id)
     return attendance
 
+@app.get("/students/{student_id}/attendance-rate", response_model=StudentAttendanceRatesGet)
+def get_student_attendance_rate_route(student_id: int):
+    """
+    Get the attendance rate of a student.
+
+    Returns the student's present/absent/late counts and attendance rate
+    over all courses, and the same numbers per course. The counts are read
+    from the attendance rollup, so no attendance rows are scanned. Late
+    counts as attended; the rate is None while nothing is recorded.
+
+    Parameters
+    ----------
+    student_id : int
+        The ID of the student.
+
+    Returns
+    -------
+    StudentAttendanceRatesGet
+        The overall and per-course attendance of the student.
+
+    Raises
+    ------
+    HTTPException (404)
+        If the student does not exist.
+    """
+    con = get_connection()
+    rates = get_student_attendance_rates(con, student_id)
+    if rates is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    return rates
+
+@app.get("/courses/{course_id}/attendance-rate", response_model=CourseAttendanceRatesGet)
+def get_course_attendance_rate_route(course_id: int):
+    """
+    Get the attendance rate of a course.
+
+    Returns the course's present/absent/late counts and attendance rate
+    over all its students, and the same numbers per student, read from
+    the attendance rollup.
+
+    Parameters
+    ----------
+    course_id : int
+        The ID of the course.
+
+    Returns
+    -------
+    CourseAttendanceRatesGet
+        The overall and per-student attendance of the course.
+
+    Raises
+    ------
+    HTTPException (404)
+        If the course does not exist.
+    """
+    con = get_connection()
+    rates = get_course_attendance_rates(con, course_id)
+    if rates is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+    return rates
+
 @app.put("/attendance/{attendance_id}", response_model=AttendanceGet)
 def update_attendance_put_route(attendance_id: int, attendance: AttendancePut):
     """
@@ -1696,3 +2478,177 @@ def delete_attendance_route(attendance_id: int):
         return deleted
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
+
+# -------------------------
+# SEARCH / routes
+# -------------------------
+@app.get("/search", response_model=list[SearchResultGet])
+def search_route(
+    q: str = Query(..., min_length=1, max_length=200, description="Words to search for"),
+    kind: list[str] | None = Query(None, description="course, lesson and/or resource; all by default"),
+    prefix: bool = Query(False, description="Treat the last word as a prefix, for search as you type"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Search courses, lessons and resources.
+
+    Matches `q` against course titles and descriptions, lesson titles,
+    descriptions and locations, and resource titles and types. Results
+    are ranked with title matches first and paginated with `limit` and
+    `offset`. By default `q` supports web-search syntax ("exact phrase",
+    `or`, `-excluded`); with `prefix=true` every word must match and the
+    last one may be incomplete.
+
+    Parameters
+    ----------
+    q : str
+        The search text.
+    kind : list[str], optional
+        Restrict the search to `course`, `lesson` and/or `resource`.
+    prefix : bool
+        Match the last word as a prefix.
+    limit : int
+        The maximum number of results to return (1-100).
+    offset : int
+        The number of results to skip.
+
+    Returns
+    -------
+    list[SearchResultGet]
+        The matches, best first.
+
+    Raises
+    ------
+    HTTPException (400)
+        If `kind` holds an unknown value.
+    """
+    if kind and not set(kind) <= set(SEARCH_SOURCES):
+        raise HTTPException(status_code=400, detail="kind must be course, lesson or resource")
+    con = get_connection()
+    results = search_content(con, q, kind, prefix, limit, offset)
+    return results
+
+# -------------------------
+# ADMIN / routes
+# -------------------------
+# /admin/* needs `X-Admin-Token: <ADMIN_TOKEN>`, unset turns those routes off.
+# They expose SQL text, file paths and stacks, /metrics stays open for scrapers
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(x_admin_token: str | None = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin routes are disabled, set ADMIN_TOKEN to enable them")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Missing or wrong X-Admin-Token header")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_route():
+    """
+    Get metrics in the Prometheus text format.
+
+    Exposes a duration histogram, a row count histogram and an error counter
+    for every data-access function in db.py, labeled by function name.
+
+    Returns
+    -------
+    str
+        The metrics in Prometheus text exposition format.
+    """
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/compression", dependencies=[Depends(require_admin)])
+def compression_stats_route():
+    """
+    Get response compression statistics.
+
+    Returns, per route, how many responses were compressed, bytes before and
+    after compression, the resulting ratio and the time spent compressing.
+
+    Returns
+    -------
+    dict
+        Compression statistics keyed by route path.
+    """
+    return compression_stats()
+
+@app.get("/admin/admission", dependencies=[Depends(require_admin)])
+def admission_stats_route():
+    """
+    Get admission control statistics.
+
+    Returns the number of requests currently doing database work, the queue
+    depth, how many requests were admitted, queued or rejected, and a
+    histogram of the time spent waiting in the queue.
+
+    Returns
+    -------
+    dict
+        Admission control statistics.
+    """
+    return admission_stats()
+
+@app.get("/admin/coalescing", dependencies=[Depends(require_admin)])
+def coalescing_stats_route():
+    """
+    Get request coalescing statistics.
+
+    Returns, per coalesced route, how many database calls were actually
+    executed and how many identical concurrent requests were collapsed into
+    them.
+
+    Returns
+    -------
+    dict
+        Coalescing statistics keyed by route name.
+    """
+    return coalescing_stats()
+
+@app.get("/admin/realtime", dependencies=[Depends(require_admin)])
+def realtime_stats_route():
+    """
+    Get realtime delivery statistics.
+
+    Returns whether the LISTEN connection is up, how many users and
+    subscribers (WebSockets and waiting requests) are connected to this
+    process, and how many notifications it has received.
+
+    Returns
+    -------
+    dict
+        Realtime statistics for this process.
+    """
+    return message_hub.stats()
+
+@app.get("/admin/slow-queries", dependencies=[Depends(require_admin)])
+def slow_query_stats_route():
+    """
+    Get slow-query log statistics.
+
+    Returns how many statements crossed the slow-query threshold, how many
+    of them were EXPLAINed, the path of the log file and the most recent
+    slow statements with their parameters redacted.
+
+    Returns
+    -------
+    dict
+        Slow-query statistics and recent entries.
+    """
+    return slow_query_stats()
+
+@app.get("/admin/connections", dependencies=[Depends(require_admin)])
+def connection_stats_route():
+    """
+    Get connection diagnostics.
+
+    Only collected with CONNECTION_DIAGNOSTICS=1. Lists every open
+    connection with the route and stack that acquired it, its age, its
+    transaction state and whether it has been held past the warning
+    threshold, plus how many connections were never closed, per route.
+
+    Returns
+    -------
+    dict
+        Connection counters and the currently open connections.
+    """
+    return connection_stats()
@@ -0,0 +1,640 @@
+"""
+Generates a production-sized dataset with binary COPY.
+
+Builds every table in vectorized numpy batches and streams them into
+Postgres with COPY ... (FORMAT binary). Primary keys are handed out here,
+so every foreign key in create_tables() holds by construction: enrollments
+only reference existing students and courses, attendance only pairs a
+lesson with a student enrolled in its course, submissions only come from
+enrolled students, and messages go between students and the teachers of
+their courses.
+
+The shape of the data is tunable: course sizes are log-normal
+(--course-size, --course-size-sigma), messages per student-teacher pair
+are Poisson (--messages-per-pair, --active-pair-rate), and late
+submissions and attendance statuses follow the given rates. The same
+--seed, --now and --batch-rows give the same rows.
+
+To go fast, the load skips the per-row foreign key checks and triggers
+(session_replication_role = replica) and rebuilds secondary indexes
+afterwards; --verify re-checks every foreign key with anti-joins once the
+data is in. --jobs connections load in parallel. Needs numpy and a
+superuser connection, and replaces all data, so --reset is required when
+the database is not empty.
+
+    python -m bench.generate --courses 20000 --reset --verify
+"""
+import argparse
+import io
+import json
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from db_setup import create_tables, get_connection, rebuild_attendance_rollup, rebuild_course_stats
+
+TABLES = (
+    "attendance_rollup", "course_stats", "attendance", "submissions", "resources",
+    "conversation_reads", "messages", "assignments", "lessons", "enrollments", "courses", "users",
+)
+
+# (table, column, referenced table, referenced column), checked by --verify
+FOREIGN_KEYS = [
+    ("courses", "teacher_id", "users", "user_id"),
+    ("enrollments", "user_id", "users", "user_id"),
+    ("enrollments", "course_id", "courses", "course_id"),
+    ("lessons", "course_id", "courses", "course_id"),
+    ("assignments", "course_id", "courses", "course_id"),
+    ("resources", "course_id", "courses", "course_id"),
+    ("resources", "lesson_id", "lessons", "lesson_id"),
+    ("submissions", "assignment_id", "assignments", "assignment_id"),
+    ("submissions", "student_id", "users", "user_id"),
+    ("attendance", "lesson_id", "lessons", "lesson_id"),
+    ("attendance", "student_id", "users", "user_id"),
+    ("messages", "sender_id", "users", "user_id"),
+    ("messages", "receiver_id", "users", "user_id"),
+    ("messages", "course_id", "courses", "course_id"),
+    ("conversation_reads", "user_id", "users", "user_id"),
+    ("conversation_reads", "partner_id", "users", "user_id"),
+]
+
+SEQUENCES = {
+    "users": "user_id",
+    "courses": "course_id",
+    "enrollments": "enrollment_id",
+    "lessons": "lesson_id",
+    "assignments": "assignment_id",
+    "resources": "resource_id",
+    "submissions": "submission_id",
+    "attendance": "attendance_id",
+    "messages": "message_id",
+}
+
+DAY_US = 86400 * 10**6
+# Postgres counts dates and timestamps from 2000-01-01
+PG_EPOCH = 946684800
+
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_TRAILER = struct.pack(">h", -1)
+
+
+# -------------------------
+# Binary COPY encoding
+# -------------------------
+# Columns are (kind, values) with kind one of "int4", "date" (days since
+# 2000-01-01), "timestamp" (microseconds since 2000-01-01) and "text" (a
+# fixed-width numpy bytes array), or ("category", codes, values) for text
+# columns with a few possible values, None meaning NULL.
+
+def fixed_text(prefix, numbers, width, suffix=b""):
+    """prefix + zero-padded numbers + suffix as a fixed-width bytes array, without a Python loop per row."""
+    head, tail = len(prefix), len(prefix) + width
+    out = np.empty((len(numbers), tail + len(suffix)), dtype=np.uint8)
+    out[:, :head] = np.frombuffer(prefix, np.uint8)
+    digits = np.asarray(numbers, dtype=np.int64).copy()
+    for i in range(tail - 1, head - 1, -1):
+        out[:, i] = 48 + digits % 10
+        digits //= 10
+    if suffix:
+        out[:, tail:] = np.frombuffer(suffix, np.uint8)
+    return out.view(f"S{out.shape[1]}").ravel()
+
+
+def _encode_group(columns, index, rows):
+    fields = [("count", ">i2")]
+    values = {"count": len(columns)}
+    for i, column in enumerate(columns):
+        kind = column[0]
+        if kind == "category":
+            value = column[2][column[1][index[0]]]
+            fields.append((f"l{i}", ">i4"))
+            if value is None:
+                values[f"l{i}"] = -1
+                continue
+            fields.append((f"v{i}", f"S{len(value)}"))
+            values[f"l{i}"] = len(value)
+            values[f"v{i}"] = value
+            continue
+
+        data = column[1] if index is None else column[1][index]
+        if kind == "text":
+            width = data.dtype.itemsize
+            fields += [(f"l{i}", ">i4"), (f"v{i}", f"S{width}")]
+            values[f"l{i}"] = width
+        elif kind == "int4" or kind == "date":
+            fields += [(f"l{i}", ">i4"), (f"v{i}", ">i4")]
+            values[f"l{i}"] = 4
+        elif kind == "timestamp":
+            fields += [(f"l{i}", ">i4"), (f"v{i}", ">i8")]
+            values[f"l{i}"] = 8
+        else:
+            raise ValueError(f"Unknown column kind {kind}")
+        values[f"v{i}"] = data
+
+    out = np.empty(rows, dtype=fields)
+    for name, value in values.items():
+        out[name] = value
+    return out.tobytes()
+
+
+def encode_copy(columns, rows):
+    """
+    Rows in the COPY binary format.
+
+    Every field is written with its length in front, so a numpy structured
+    array can only hold rows of one width. Rows are therefore grouped by
+    their category values (for example one group per attendance status)
+    and each group is encoded as one fixed-width array.
+    """
+    categories = [column for column in columns if column[0] == "category"]
+    if not categories:
+        return COPY_HEADER + _encode_group(columns, None, rows) + COPY_TRAILER
+
+    key = np.zeros(rows, dtype=np.int64)
+    for _, codes, values in categories:
+        key = key * len(values) + codes
+    order = np.argsort(key, kind="stable")
+    bounds = np.flatnonzero(np.diff(key[order])) + 1
+    parts = [COPY_HEADER]
+    for index in np.split(order, bounds):
+        parts.append(_encode_group(columns, index, len(index)))
+    parts.append(COPY_TRAILER)
+    return b"".join(parts)
+
+
+# -------------------------
+# Loading
+# -------------------------
+
+class CopyWriter:
+    """
+    Runs the COPY statements on background threads, one connection each.
+
+    psycopg2 releases the GIL while it sends data, so the next batch is
+    generated while the previous ones are on their way to the server, and
+    with several connections the server parses and inserts them on several
+    cores. close() commits the connections one after the other once every
+    batch is written, or rolls them all back if a COPY failed. A failure
+    during those commits can leave the earlier connections committed, so
+    rerun with --reset after an error.
+    """
+
+    def __init__(self, connections):
+        self.connections = connections
+        self.rows = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=2 * len(connections))
+        self._error = None
+        self._threads = [
+            threading.Thread(target=self._run, args=(con,), name=f"copy-writer-{i}", daemon=True)
+            for i, con in enumerate(connections)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self, con):
+        with con.cursor() as cursor:
+            # Skips the foreign key triggers, the generator guarantees them
+            cursor.execute("SET session_replication_role = replica;")
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                if self._error is not None:
+                    continue
+                table, names, payload, rows = item
+                try:
+                    cursor.copy_expert(
+                        f"COPY {table} ({', '.join(names)}) FROM STDIN WITH (FORMAT binary);",
+                        io.BytesIO(payload),
+                        size=1 << 20,
+                    )
+                except Exception as e:
+                    self._error = e
+                    continue
+                with self._lock:
+                    self.rows[table] = self.rows.get(table, 0) + rows
+
+    def copy(self, table, columns, rows):
+        if self._error is not None:
+            raise self._error
+        names = [name for name, _ in columns]
+        payload = encode_copy([column for _, column in columns], rows)
+        self._queue.put((table, names, payload, rows))
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        for con in self.connections:
+            if self._error is None:
+                con.commit()
+            else:
+                con.rollback()
+        if self._error is not None:
+            raise self._error
+
+
+def _batches(total, size):
+    for start in range(0, total, size):
+        yield start, min(start + size, total)
+
+
+def _pg_timestamp(unix_seconds):
+    return ((np.asarray(unix_seconds, dtype=np.float64) - PG_EPOCH) * 10**6).astype(np.int64)
+
+
+class Generator:
+    def __init__(self, args, writer):
+        self.args = args
+        self.writer = writer
+        self.rng = np.random.default_rng(args.seed)
+        self.now = _pg_timestamp(args.now)
+        self.today = int((args.now - PG_EPOCH) // 86400)
+
+    def users(self):
+        args = self.args
+        total = args.teachers + args.students
+        for start, stop in _batches(total, args.batch_rows):
+            ids = np.arange(start + 1, stop + 1)
+            is_student = ids > args.teachers
+            number = np.where(is_student, ids - args.teachers, ids)
+            # "teacher" and "student" have the same length, so one username/email width fits both
+            username = np.where(is_student, fixed_text(b"student_", number, 8), fixed_text(b"teacher_", number, 8))
+            email = np.where(
+                is_student,
+                fixed_text(b"student_", number, 8, b"@example.com"),
+                fixed_text(b"teacher_", number, 8, b"@example.com"),
+            )
+            created_at = self.now - self.rng.integers(0, 5 * 365 * DAY_US, len(ids))
+            self.writer.copy("users", [
+                ("user_id", ("int4", ids)),
+                ("username", ("text", username)),
+                ("email", ("text", email)),
+                ("role", ("category", is_student.astype(np.int64), [b"teacher", b"student"])),
+                ("password", ("category", np.zeros(len(ids), dtype=np.int64), [b"not-a-real-password-hash"])),
+                ("created_at", ("timestamp", created_at)),
+            ], len(ids))
+
+    def courses(self):
+        args = self.args
+        rng = self.rng
+        ids = np.arange(1, args.courses + 1)
+        self.teacher = rng.integers(1, args.teachers + 1, args.courses)
+        self.start_date = self.today - rng.integers(0, 365, args.courses)
+        # Log-normal with the requested mean, so a few courses are much larger than the rest
+        mu = np.log(args.course_size) - args.course_size_sigma ** 2 / 2
+        self.size = np.clip(np.rint(rng.lognormal(mu, args.course_size_sigma, args.courses)), 1, args.students).astype(np.int64)
+        self.offset = rng.integers(0, args.students, args.courses)
+        # Enrollments are generated course by course, so course c owns
+        # enrollment IDs first_enrollment[c] .. first_enrollment[c] + size[c] - 1
+        self.first_enrollment = np.concatenate(([0], np.cumsum(self.size)[:-1]))
+        self.enrollment_count = int(self.size.sum())
+
+        self.writer.copy("courses", [
+            ("course_id", ("int4", ids)),
+            ("title", ("text", fixed_text(b"Course ", ids, 8))),
+            ("description", ("text", fixed_text(b"Description of course ", ids, 8, b", an introduction to the subject"))),
+            ("teacher_id", ("int4", self.teacher)),
+            ("start_date", ("date", self.start_date)),
+            ("end_date", ("date", self.start_date + 120)),
+        ], args.courses)
+
+    def _course_chunks(self, rows_per_enrollment):
+        # Consecutive course ranges holding about batch_rows rows each
+        rows = np.cumsum(self.size * rows_per_enrollment)
+        start = 0
+        while start < len(rows):
+            done = rows[start - 1] if start else 0
+            stop = int(np.searchsorted(rows, done + self.args.batch_rows, side="right"))
+            stop = max(stop, start + 1)
+            yield start, stop
+            start = stop
+
+    def _enrollments_of(self, start, stop):
+        """Course index, student ID and enrollment index of every enrollment in courses start..stop-1."""
+        sizes = self.size[start:stop]
+        course = np.repeat(np.arange(start, stop), sizes)
+        k = np.arange(len(course)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        # A run of consecutive students from the course's own offset, so no pair repeats
+        student = self.args.teachers + 1 + (self.offset[course] + k) % self.args.students
+        return course, student, self.first_enrollment[course] + k
+
+    def enrollments(self):
+        for start, stop in self._course_chunks(1):
+            course, student, index = self._enrollments_of(start, stop)
+            enrolled_at = self.start_date[course] * DAY_US - self.rng.integers(0, 30 * DAY_US, len(course))
+            self.writer.copy("enrollments", [
+                ("enrollment_id", ("int4", index + 1)),
+                ("user_id", ("int4", student)),
+                ("course_id", ("int4", course + 1)),
+                ("enrolled_at", ("timestamp", enrolled_at)),
+            ], len(course))
+
+    def lessons(self):
+        args = self.args
+        per_course = args.lessons_per_course
+        for start, stop in _batches(args.courses, max(1, args.batch_rows // per_course)):
+            course = np.repeat(np.arange(start, stop), per_course)
+            k = np.tile(np.arange(1, per_course + 1), stop - start)
+            ids = course * per_course + k
+            scheduled_at = (self.start_date[course] + k * 7) * DAY_US + 9 * 3600 * 10**6
+            self.writer.copy("lessons", [
+                ("lesson_id", ("int4", ids)),
+                ("course_id", ("int4", course + 1)),
+                ("title", ("text", fixed_text(b"Lesson ", k, 3))),
+                ("description", ("text", fixed_text(b"Notes for lesson ", ids, 10))),
+                ("scheduled_at", ("timestamp", scheduled_at)),
+                ("duration_minutes", ("int4", np.array([45, 60, 90])[k % 3])),
+                ("location", ("text", fixed_text(b"Room ", 1 + (course + k) % 40, 2))),
+            ], len(ids))
+
+    def assignments(self):
+        args = self.args
+        per_course = args.assignments_per_course
+        for start, stop in _batches(args.courses, max(1, args.batch_rows // per_course)):
+            course = np.repeat(np.arange(start, stop), per_course)
+            k = np.tile(np.arange(1, per_course + 1), stop - start)
+            ids = course * per_course + k
+            self.writer.copy("assignments", [
+                ("assignment_id", ("int4", ids)),
+                ("course_id", ("int4", course + 1)),
+                ("title", ("text", fixed_text(b"Assignment ", k, 3))),
+                ("description", ("text", fixed_text(b"Hand in exercise set ", k, 3))),
+                ("due_date", ("timestamp", (self.start_date[course] + k * 10) * DAY_US + (23 * 3600 + 59 * 60) * 10**6)),
+            ], len(ids))
+
+    def resources(self):
+        args = self.args
+        lessons = args.courses * args.lessons_per_course
+        per_lesson = args.resources_per_lesson
+        for start, stop in _batches(lessons, max(1, args.batch_rows // per_lesson)):
+            lesson = np.repeat(np.arange(start, stop), per_lesson)
+            k = np.tile(np.arange(1, per_lesson + 1), stop - start)
+            ids = lesson * per_lesson + k
+            self.writer.copy("resources", [
+                ("resource_id", ("int4", ids)),
+                ("course_id", ("int4", lesson // args.lessons_per_course + 1)),
+                ("lesson_id", ("int4", lesson + 1)),
+                ("title", ("text", fixed_text(b"Material ", ids, 10))),
+                ("type", ("category", (lesson + k) % 3, [b"PDF", b"video", b"link"])),
+                ("url", ("text", fixed_text(b"https://example.com/resources/", ids, 10))),
+            ], len(ids))
+
+    def submissions(self):
+        args = self.args
+        rng = self.rng
+        per_course = args.assignments_per_course
+        next_id = 1
+        for start, stop in self._course_chunks(per_course):
+            course, student, _ = self._enrollments_of(start, stop)
+            course = np.repeat(course, per_course)
+            student = np.repeat(student, per_course)
+            k = np.tile(np.arange(1, per_course + 1), len(course) // per_course)
+            keep = rng.random(len(course)) < args.submission_rate
+            course, student, k = course[keep], student[keep], k[keep]
+            rows = len(course)
+
+            due = (self.start_date[course] + k * 10) * DAY_US + (23 * 3600 + 59 * 60) * 10**6
+            late = rng.random(rows) < args.late_rate
+            submitted_at = np.where(
+                late,
+                due + rng.integers(1, 3 * DAY_US, rows),
+                due - rng.integers(0, 7 * DAY_US, rows),
+            )
+            graded = rng.random(rows) < args.graded_rate
+            grade = np.where(graded, rng.integers(0, 5, rows), 5)
+            ids = np.arange(next_id, next_id + rows)
+            next_id += rows
+            self.writer.copy("submissions", [
+                ("submission_id", ("int4", ids)),
+                ("assignment_id", ("int4", course * per_course + k)),
+                ("student_id", ("int4", student)),
+                ("submitted_at", ("timestamp", submitted_at)),
+                ("url", ("text", fixed_text(b"https://example.com/submissions/", ids, 10))),
+                ("grade", ("category", grade, [b"A", b"B", b"C", b"D", b"F", None])),
+                ("feedback", ("category", graded.astype(np.int64), [None, b"Graded, see the comments in the file"])),
+            ], rows)
+
+    def attendance(self):
+        args = self.args
+        rng = self.rng
+        per_course = args.lessons_per_course
+        next_id = 1
+        statuses = [b"present", b"late", b"absent"]
+        p_absent, p_late = args.absent_rate, args.late_attendance_rate
+        for start, stop in self._course_chunks(per_course):
+            course, student, _ = self._enrollments_of(start, stop)
+            course = np.repeat(course, per_course)
+            student = np.repeat(student, per_course)
+            k = np.tile(np.arange(1, per_course + 1), len(course) // per_course)
+            rows = len(course)
+            r = rng.random(rows)
+            status = np.where(r < p_absent, 2, np.where(r < p_absent + p_late, 1, 0))
+            ids = np.arange(next_id, next_id + rows)
+            next_id += rows
+            self.writer.copy("attendance", [
+                ("attendance_id", ("int4", ids)),
+                ("lesson_id", ("int4", course * per_course + k)),
+                ("student_id", ("int4", student)),
+                ("status", ("category", status, statuses)),
+                ("recorded_at", ("timestamp", (self.start_date[course] + k * 7) * DAY_US + 9 * 3600 * 10**6)),
+            ], rows)
+
+    def messages(self):
+        args = self.args
+        rng = self.rng
+        # Messages per student-teacher pair, drawn once so the total is known up front
+        active = rng.random(self.enrollment_count) < args.active_pair_rate
+        counts = np.where(active, rng.poisson(args.messages_per_pair, self.enrollment_count), 0)
+        total = int(counts.sum())
+        span = 180 * DAY_US
+        next_id = 1
+        for start, stop in self._course_chunks(1):
+            course, student, index = self._enrollments_of(start, stop)
+            n = counts[index]
+            course = np.repeat(course, n)
+            student = np.repeat(student, n)
+            rows = len(course)
+            if not rows:
+                continue
+            from_student = rng.random(rows) < 0.5
+            teacher = self.teacher[course]
+            ids = np.arange(next_id, next_id + rows)
+            next_id += rows
+            # IDs grow with sent_at, like they do in production
+            sent_at = self.now - span + ids * (span // max(total, 1)) + rng.integers(0, max(span // max(total, 1), 1), rows)
+            self.writer.copy("messages", [
+                ("message_id", ("int4", ids)),
+                ("sender_id", ("int4", np.where(from_student, student, teacher))),
+                ("receiver_id", ("int4", np.where(from_student, teacher, student))),
+                ("course_id", ("int4", course + 1)),
+                ("content", ("text", fixed_text(b"Message ", ids, 10, b" about the last lesson"))),
+                ("sent_at", ("timestamp", sent_at)),
+            ], rows)
+
+
+def _drop_secondary_indexes(cursor):
+    """Drops indexes that don't back a constraint and returns their definitions."""
+    cursor.execute("""
+        SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class t ON t.oid = i.indrelid
+        WHERE t.relname = ANY(%s)
+          AND t.relnamespace = 'public'::regnamespace
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid);
+    """, (list(TABLES),))
+    indexes = cursor.fetchall()
+    for name, _ in indexes:
+        cursor.execute(f"DROP INDEX {name};")
+    return [definition for _, definition in indexes]
+
+
+def _create_indexes(con, definitions):
+    with con:
+        with con.cursor() as cursor:
+            for definition in definitions:
+                cursor.execute(definition + ";")
+
+
+def verify(con):
+    """Number of rows violating each foreign key, all should be 0."""
+    violations = {}
+    with con.cursor() as cursor:
+        for table, column, ref_table, ref_column in FOREIGN_KEYS:
+            cursor.execute(f"""
+                SELECT count(*) FROM {table} t
+                WHERE t.{column} IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM {ref_table} r WHERE r.{ref_column} = t.{column});
+            """)
+            violations[f"{table}.{column}"] = cursor.fetchone()[0]
+        # Attendance and submissions must also come from students enrolled in the course
+        cursor.execute("""
+            SELECT count(*) FROM attendance a
+            JOIN lessons l ON l.lesson_id = a.lesson_id
+            WHERE NOT EXISTS (
+                SELECT 1 FROM enrollments e WHERE e.course_id = l.course_id AND e.user_id = a.student_id
+            );
+        """)
+        violations["attendance.enrolled"] = cursor.fetchone()[0]
+        cursor.execute("""
+            SELECT count(*) FROM submissions s
+            JOIN assignments a ON a.assignment_id = s.assignment_id
+            WHERE NOT EXISTS (
+                SELECT 1 FROM enrollments e WHERE e.course_id = a.course_id AND e.user_id = s.student_id
+            );
+        """)
+        violations["submissions.enrolled"] = cursor.fetchone()[0]
+    return violations
+
+
+def main(args):
+    create_tables()
+    con = get_connection()
+    report = {}
+    try:
+        with con:
+            with con.cursor() as cursor:
+                cursor.execute("SELECT EXISTS (SELECT 1 FROM users);")
+                if cursor.fetchone()[0] and not args.reset:
+                    raise SystemExit("The database already has data, pass --reset to replace it")
+                cursor.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE;")
+                indexes = _drop_secondary_indexes(cursor)
+
+        # The drop above is committed, so the indexes come back even when the load fails
+        indexes_restored = False
+        try:
+            started = time.perf_counter()
+            connections = [get_connection() for _ in range(args.jobs)]
+            try:
+                writer = CopyWriter(connections)
+                generator = Generator(args, writer)
+                try:
+                    for table in ("users", "courses", "enrollments", "lessons", "assignments",
+                                  "resources", "submissions", "attendance", "messages"):
+                        getattr(generator, table)()
+                finally:
+                    writer.close()
+            finally:
+                for connection in connections:
+                    connection.close()
+            load_seconds = time.perf_counter() - started
+            rows = sum(writer.rows.values())
+            report["rows"] = writer.rows
+            report["load_seconds"] = round(load_seconds, 3)
+            report["rows_per_second"] = round(rows / load_seconds)
+
+            started = time.perf_counter()
+            with con:
+                with con.cursor() as cursor:
+                    for table, column in SEQUENCES.items():
+                        cursor.execute(
+                            f"SELECT setval(pg_get_serial_sequence(%s, %s), coalesce(max({column}), 0) + 1, false) FROM {table};",
+                            (table, column),
+                        )
+                    # COPY can't call grade_to_score(), so scores are filled in here
+                    cursor.execute("UPDATE submissions SET score = grade_to_score(grade) WHERE grade IS NOT NULL;")
+                    cursor.execute("""
+                        INSERT INTO conversation_reads (user_id, partner_id, unread_count)
+                        SELECT receiver_id, sender_id, count(*) FILTER (WHERE sent_at > now() - interval '7 days')
+                        FROM messages
+                        GROUP BY receiver_id, sender_id;
+                    """)
+                    cursor.execute("""
+                        INSERT INTO conversation_reads (user_id, partner_id)
+                        SELECT DISTINCT sender_id, receiver_id FROM messages
+                        ON CONFLICT (user_id, partner_id) DO NOTHING;
+                    """)
+                    for definition in indexes:
+                        cursor.execute(definition + ";")
+            indexes_restored = True
+        finally:
+            if not indexes_restored:
+                _create_indexes(con, indexes)
+
+        # The COPY ran with triggers off, so the rollups start empty
+        rebuild_attendance_rollup()
+        rebuild_course_stats()
+        con.autocommit = True
+        with con.cursor() as cursor:
+            cursor.execute("ANALYZE;")
+        report["index_and_analyze_seconds"] = round(time.perf_counter() - started, 3)
+
+        if args.verify:
+            report["foreign_key_violations"] = verify(con)
+    finally:
+        con.close()
+
+    print(json.dumps(report, indent=2))
+    if args.verify and any(report["foreign_key_violations"].values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="truncate all tables first")
+    parser.add_argument("--verify", action="store_true", help="check every foreign key after loading")
+    parser.add_argument("--batch-rows", type=int, default=500_000, help="rows per COPY")
+    parser.add_argument("--jobs", type=int, default=4, help="connections loading in parallel")
+    parser.add_argument("--now", type=float, default=time.time(), help="Unix time the data is generated around")
+    parser.add_argument("--teachers", type=int, default=2000)
+    parser.add_argument("--students", type=int, default=200000)
+    parser.add_argument("--courses", type=int, default=10000)
+    parser.add_argument("--course-size", type=float, default=40, help="mean students per course")
+    parser.add_argument("--course-size-sigma", type=float, default=0.6, help="spread of the log-normal course sizes")
+    parser.add_argument("--lessons-per-course", type=int, default=40)
+    parser.add_argument("--assignments-per-course", type=int, default=12)
+    parser.add_argument("--resources-per-lesson", type=int, default=2)
+    parser.add_argument("--submission-rate", type=float, default=0.85)
+    parser.add_argument("--late-rate", type=float, default=0.15, help="share of submissions after the due date")
+    parser.add_argument("--graded-rate", type=float, default=0.7)
+    parser.add_argument("--absent-rate", type=float, default=0.08)
+    parser.add_argument("--late-attendance-rate", type=float, default=0.07)
+    parser.add_argument("--messages-per-pair", type=float, default=10, help="mean messages per active student-teacher pair")
+    parser.add_argument("--active-pair-rate", type=float, default=0.5, help="share of pairs that exchange messages")
+    main(parser.parse_args())
@@ -0,0 +1,281 @@
+"""
+HTTP load test: drives a weighted mix of app.py routes and reports latency per route.
+
+Seed the database first (python -m bench.seed) and start the server, e.g.
+`uvicorn app:app --workers 4`. IDs for the requests are sampled from the
+same database, so run this on a machine that can reach it. --concurrency
+clients send requests back to back for --duration seconds after --warmup
+seconds that are not counted. The report is JSON with throughput, error
+counts and p50/p95/p99 per route. --compare adds the change against an
+earlier report, so releases can be compared.
+
+    python -m bench.load_test --url http://localhost:8000 --output bench_output.json
+    python -m bench.load_test --compare bench_output.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+from db_setup import get_connection
+
+# (route, weight, method) -- reads dominate, like in production
+ROUTES = [
+    ("GET /users/{user_id}", 10, "GET"),
+    ("GET /users/search", 2, "GET"),
+    ("GET /courses/{course_id}", 10, "GET"),
+    ("GET /teachers/{teacher_id}/courses", 4, "GET"),
+    ("GET /teachers/{teacher_id}/courses/stats", 2, "GET"),
+    ("GET /users/{user_id}/enrollments", 6, "GET"),
+    ("GET /courses/{course_id}/lessons", 8, "GET"),
+    ("GET /courses/{course_id}/assignments", 8, "GET"),
+    ("GET /courses/{course_id}/resources", 5, "GET"),
+    ("GET /lessons/{lesson_id}/resources", 4, "GET"),
+    ("GET /assignments/{assignment_id}/submissions", 4, "GET"),
+    ("GET /students/{student_id}/submissions", 5, "GET"),
+    ("GET /assignments/{assignment_id}/stats", 2, "GET"),
+    ("GET /courses/{course_id}/submission-report", 2, "GET"),
+    ("GET /lessons/{lesson_id}/attendance", 4, "GET"),
+    ("GET /students/{student_id}/attendance", 5, "GET"),
+    ("GET /students/{student_id}/attendance-rate", 3, "GET"),
+    ("GET /messages/{user1_id}/{user2_id}", 6, "GET"),
+    ("GET /users/{user_id}/conversations", 5, "GET"),
+    ("GET /users/{user_id}/unread", 5, "GET"),
+    ("GET /users/{user_id}/messages/search", 2, "GET"),
+    ("GET /search", 3, "GET"),
+    ("POST /messages", 3, "POST"),
+    ("POST /attendance", 2, "POST"),
+    ("PUT /submissions/{submission_id}/grade", 2, "PUT"),
+    ("PATCH /users/{user_id}", 1, "PATCH"),
+]
+
+
+def load_ids(pair_sample):
+    """ID ranges and a sample of conversation pairs from the seeded database."""
+    con = get_connection()
+    try:
+        with con:
+            with con.cursor() as cursor:
+                cursor.execute("""
+                    SELECT
+                        (SELECT array_agg(user_id) FROM users WHERE role = 'teacher'),
+                        (SELECT array_agg(user_id) FROM users WHERE role = 'student'),
+                        (SELECT max(course_id) FROM courses),
+                        (SELECT max(lesson_id) FROM lessons),
+                        (SELECT max(assignment_id) FROM assignments),
+                        (SELECT max(submission_id) FROM submissions);
+                """)
+                teachers, students, courses, lessons, assignments, submissions = cursor.fetchone()
+                cursor.execute(
+                    "SELECT sender_id, receiver_id FROM messages TABLESAMPLE SYSTEM (10) LIMIT %s;",
+                    (pair_sample,),
+                )
+                pairs = cursor.fetchall()
+    finally:
+        con.close()
+    if not teachers or not students or not courses or not pairs:
+        raise SystemExit("The database looks empty, run python -m bench.seed first")
+    return {
+        "teachers": teachers,
+        "students": students,
+        "courses": courses,
+        "lessons": lessons,
+        "assignments": assignments,
+        "submissions": submissions,
+        "pairs": pairs,
+    }
+
+
+def build_request(route, ids, rng):
+    """Method, URL and JSON body for one request to `route`."""
+    student = rng.choice(ids["students"])
+    course = rng.randint(1, ids["courses"])
+    lesson = rng.randint(1, ids["lessons"])
+    sender, receiver = rng.choice(ids["pairs"])
+
+    if route == "GET /users/{user_id}":
+        return f"/users/{rng.choice((student, sender))}", None
+    if route == "GET /users/search":
+        return f"/users/search?q=student_{rng.randint(1, 999)}", None
+    if route == "GET /courses/{course_id}":
+        return f"/courses/{course}", None
+    if route == "GET /teachers/{teacher_id}/courses":
+        return f"/teachers/{rng.choice(ids['teachers'])}/courses", None
+    if route == "GET /teachers/{teacher_id}/courses/stats":
+        return f"/teachers/{rng.choice(ids['teachers'])}/courses/stats", None
+    if route == "GET /users/{user_id}/enrollments":
+        return f"/users/{student}/enrollments", None
+    if route == "GET /courses/{course_id}/lessons":
+        return f"/courses/{course}/lessons", None
+    if route == "GET /courses/{course_id}/assignments":
+        return f"/courses/{course}/assignments", None
+    if route == "GET /courses/{course_id}/resources":
+        return f"/courses/{course}/resources", None
+    if route == "GET /lessons/{lesson_id}/resources":
+        return f"/lessons/{lesson}/resources", None
+    if route == "GET /assignments/{assignment_id}/submissions":
+        return f"/assignments/{rng.randint(1, ids['assignments'])}/submissions", None
+    if route == "GET /assignments/{assignment_id}/stats":
+        return f"/assignments/{rng.randint(1, ids['assignments'])}/stats", None
+    if route == "GET /courses/{course_id}/submission-report":
+        return f"/courses/{course}/submission-report", None
+    if route == "GET /students/{student_id}/submissions":
+        return f"/students/{student}/submissions", None
+    if route == "GET /lessons/{lesson_id}/attendance":
+        return f"/lessons/{lesson}/attendance", None
+    if route == "GET /students/{student_id}/attendance":
+        return f"/students/{student}/attendance", None
+    if route == "GET /messages/{user1_id}/{user2_id}":
+        return f"/messages/{sender}/{receiver}", None
+    if route == "GET /users/{user_id}/conversations":
+        return f"/users/{receiver}/conversations", None
+    if route == "GET /users/{user_id}/unread":
+        return f"/users/{receiver}/unread", None
+    if route == "GET /students/{student_id}/attendance-rate":
+        return f"/students/{student}/attendance-rate", None
+    if route == "GET /search":
+        return f"/search?q=course+{course}", None
+    if route == "GET /users/{user_id}/messages/search":
+        return f"/users/{receiver}/messages/search?q=course", None
+    if route == "POST /messages":
+        return "/messages", {"sender_id": sender, "receiver_id": receiver, "content": "Load test message"}
+    if route == "POST /attendance":
+        return "/attendance", {"lesson_id": lesson, "student_id": student, "status": "present"}
+    if route == "PUT /submissions/{submission_id}/grade":
+        return f"/submissions/{rng.randint(1, ids['submissions'])}/grade", {"grade": rng.choice("ABCDF")}
+    if route == "PATCH /users/{user_id}":
+        return f"/users/{student}", {"username": f"student_{student}"}
+    raise ValueError(f"Unknown route {route}")
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def worker(client, ids, routes, weights, rng, warmup_end, deadline, results):
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            return
+        name, method = rng.choices(routes, weights)[0]
+        path, body = build_request(name, ids, rng)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, json=body)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - started
+        if started >= warmup_end:
+            results[name].append((elapsed, status))
+
+
+def summarize(results, seconds):
+    routes = {}
+    total = 0
+    total_errors = 0
+    for name, samples in sorted(results.items()):
+        latencies = sorted(elapsed * 1000 for elapsed, _ in samples)
+        statuses = Counter(str(status) for _, status in samples)
+        errors = sum(n for status, n in statuses.items() if not status.startswith(("2", "3")))
+        total += len(samples)
+        total_errors += errors
+        routes[name] = {
+            "requests": len(samples),
+            "errors": errors,
+            "statuses": dict(statuses),
+            "throughput_rps": round(len(samples) / seconds, 2),
+            "mean_ms": round(sum(latencies) / len(latencies), 3),
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "max_ms": round(latencies[-1], 3),
+        }
+    return {
+        "requests": total,
+        "errors": total_errors,
+        "throughput_rps": round(total / seconds, 2),
+        "routes": routes,
+    }
+
+
+def _change_pct(new, old):
+    if not old:
+        return None
+    return round((new - old) / old * 100, 1)
+
+
+def compare(report, previous):
+    """Adds the change in throughput and latency against an earlier report."""
+    report["compared_to"] = previous.get("started_at")
+    report["throughput_change_pct"] = _change_pct(report["throughput_rps"], previous.get("throughput_rps"))
+    for name, route in report["routes"].items():
+        old = previous.get("routes", {}).get(name)
+        if old is None:
+            continue
+        route["change_pct"] = {
+            key: _change_pct(route[key], old.get(key))
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+        }
+
+
+async def main(args):
+    ids = load_ids(args.pair_sample)
+    weights_by_route = {name: weight for name, weight, _ in ROUTES}
+    if args.mix:
+        with open(args.mix) as f:
+            weights_by_route.update(json.load(f))
+    routes = [(name, method) for name, _, method in ROUTES if weights_by_route[name] > 0]
+    weights = [weights_by_route[name] for name, _ in routes]
+
+    results = defaultdict(list)
+    started_at = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        start = time.perf_counter()
+        warmup_end = start + args.warmup
+        deadline = warmup_end + args.duration
+        await asyncio.gather(*(
+            worker(client, ids, routes, weights, random.Random(args.seed + i), warmup_end, deadline, results)
+            for i in range(args.concurrency)
+        ))
+
+    report = {
+        "started_at": started_at,
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        **summarize(results, args.duration),
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds before measuring starts")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per request, in seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--pair-sample", type=int, default=1000, help="conversation pairs to draw from")
+    parser.add_argument("--mix", help='JSON file with route weights overriding the defaults, e.g. {"POST /messages": 0}')
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    asyncio.run(main(parser.parse_args()))
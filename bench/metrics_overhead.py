@@ -0,0 +1,64 @@
+"""
+Measures what @timed (metrics.py) adds to every db.py call.
+
+Times a trivial function with and without the decorator, for both a
+successful call and one that raises, and prints the overhead per call in
+microseconds. No database is needed.
+
+    python -m bench.metrics_overhead
+"""
+import argparse
+import json
+import timeit
+
+from metrics import timed
+
+
+def plain(con, value):
+    return {"id": value}
+
+
+def failing(con, value):
+    try:
+        raise ValueError(value)
+    except ValueError as e:
+        raise Exception("Database error") from e
+
+
+def per_call_us(func, number, repeat):
+    # Best of `repeat` runs, the least disturbed by the rest of the machine
+    return min(timeit.repeat(lambda: func(None, 1), number=number, repeat=repeat)) / number * 1e6
+
+
+def per_failing_call_us(func, number, repeat):
+    def call():
+        try:
+            func(None, 1)
+        except Exception:
+            pass
+    return min(timeit.repeat(call, number=number, repeat=repeat)) / number * 1e6
+
+
+def main(args):
+    timed_plain = timed(plain)
+    timed_failing = timed(failing)
+
+    ok_base = per_call_us(plain, args.number, args.repeat)
+    ok_timed = per_call_us(timed_plain, args.number, args.repeat)
+    error_base = per_failing_call_us(failing, args.number, args.repeat)
+    error_timed = per_failing_call_us(timed_failing, args.number, args.repeat)
+
+    print(json.dumps({
+        "ok_call_overhead_us": round(ok_timed - ok_base, 3),
+        "error_call_overhead_us": round(error_timed - error_base, 3),
+        "budget_us": args.budget_us,
+        "within_budget": max(ok_timed - ok_base, error_timed - error_base) <= args.budget_us,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-us", type=float, default=5.0)
+    main(parser.parse_args())
@@ -0,0 +1,451 @@
+"""
+Micro-benchmarks for the data-access functions in db.py.
+
+Every db.py function is called directly against the local database, with
+IDs sampled from the seeded dataset (python -m bench.seed). Each benchmark
+is warmed up, then timed in --rounds rounds of at least --round-seconds
+each; the median of the per-round means is the number that is compared.
+Writes run for real: rows they create are removed again outside of the
+timed part, and updates write back the values a row already has.
+
+    python -m bench.micro run [--only get_user] [--output results.json]
+    python -m bench.micro baseline          # store bench/baselines/micro.json
+    python -m bench.micro baseline --only get_new_function   # add or re-record just these
+    python -m bench.micro compare --threshold 10
+
+compare exits with status 1 when a function got slower than the baseline
+by more than --threshold percent.
+"""
+import argparse
+import fnmatch
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import db
+from db_setup import get_connection
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "micro.json")
+
+# Deterministic samples of existing rows, so gaps in the IDs don't matter
+SAMPLE_QUERIES = {
+    "user": "SELECT user_id FROM users",
+    "student": "SELECT user_id FROM users WHERE role = 'student'",
+    "teacher": "SELECT user_id FROM users WHERE role = 'teacher'",
+    "course": "SELECT course_id FROM courses",
+    "enrollment": "SELECT enrollment_id FROM enrollments",
+    "assignment": "SELECT assignment_id FROM assignments",
+    "lesson": "SELECT lesson_id FROM lessons",
+    "resource": "SELECT resource_id FROM resources",
+    "submission": "SELECT submission_id FROM submissions",
+    "attendance": "SELECT attendance_id FROM attendance",
+    "message": "SELECT message_id FROM messages",
+    "pair": "SELECT sender_id, receiver_id FROM messages",
+}
+
+_unique = itertools.count()
+
+
+class Benchmark:
+    """
+    One db.py function to time.
+
+    prepare(context) returns the arguments of the next call and runs
+    untimed, cleanup(context, result) undoes what the call wrote.
+    """
+
+    def __init__(self, name, prepare, cleanup=None, call=None):
+        self.name = name
+        self.prepare = prepare
+        self.cleanup = cleanup
+        self.call = call or getattr(db, name)
+
+
+class Context:
+    def __init__(self, con, samples, rng):
+        self.con = con
+        self.samples = samples
+        self.rng = rng
+        self.bench_user = None
+
+    def pick(self, key):
+        return self.rng.choice(self.samples[key])
+
+    def execute(self, query, params=()):
+        with self.con:
+            with self.con.cursor() as cursor:
+                cursor.execute(query, params)
+
+
+def _consume(stream):
+    return lambda con, *args: sum(len(rows) for _, rows in stream(con, *args))
+
+
+def _new_user(ctx):
+    n = next(_unique)
+    return (f"bench_{n}", f"bench_{os.getpid()}_{n}@example.com", "student", "bench")
+
+
+def _new_course(ctx):
+    return ("Benchmark course", "Created by bench.micro", ctx.pick("teacher"), date.today(), date.today() + timedelta(days=90))
+
+
+def _new_assignment(ctx):
+    return (ctx.pick("course"), "Benchmark assignment", "Created by bench.micro", datetime.now() + timedelta(days=7))
+
+
+def _new_lesson(ctx):
+    return (ctx.pick("course"), "Benchmark lesson", "Created by bench.micro", datetime.now(), 60, "Room 1")
+
+
+def _new_resource(ctx):
+    return (ctx.pick("course"), None, "Benchmark resource", "link", "https://example.com/bench")
+
+
+def _new_submission(ctx):
+    return (ctx.pick("assignment"), ctx.bench_user, "https://example.com/bench")
+
+
+def _new_attendance(ctx):
+    return (ctx.pick("lesson"), ctx.bench_user, "present", None)
+
+
+def _delete(delete, key):
+    return lambda ctx, result: delete(ctx.con, result[key])
+
+
+def _same_user(ctx):
+    user = db.get_user_by_id(ctx.con, ctx.pick("user"))
+    return (user["user_id"], user["username"], user["email"], user["role"])
+
+
+def _same_course(ctx):
+    c = db.get_course(ctx.con, ctx.pick("course"))
+    return (c["course_id"], c["title"], c["description"], c["teacher_id"], c["start_date"], c["end_date"])
+
+
+def _same_assignment(ctx):
+    a = db.get_assignment(ctx.con, ctx.pick("assignment"))
+    return (a["assignment_id"], a["course_id"], a["title"], a["description"], a["due_date"])
+
+
+def _same_lesson(ctx):
+    l = db.get_lesson(ctx.con, ctx.pick("lesson"))
+    return (l["lesson_id"], l["course_id"], l["title"], l["description"], l["scheduled_at"], l["duration_minutes"], l["location"])
+
+
+def _same_resource(ctx):
+    r = db.get_resource(ctx.con, ctx.pick("resource"))
+    return (r["resource_id"], r["course_id"], r["lesson_id"], r["title"], r["type"], r["url"], r["uploaded_at"])
+
+
+def _same_attendance(ctx):
+    a = db.get_attendance(ctx.con, ctx.pick("attendance"))
+    return (a["attendance_id"], a["lesson_id"], a["student_id"], a["status"], a["url"], a["recorded_at"], a["uploaded_at"])
+
+
+def _same_grade(ctx):
+    s = db.get_submission(ctx.con, ctx.pick("submission"))
+    return (s["submission_id"], s["grade"], s["feedback"])
+
+
+def _user_search(ctx):
+    # Part of a seeded username, a common substring, or a typo that only matches by similarity
+    number = ctx.rng.randint(1, 999)
+    return (ctx.rng.choice((f"student_{number}", "example", f"studnet_{number}")),)
+
+
+def _delete_message(ctx, result):
+    ctx.execute("DELETE FROM messages WHERE message_id = %s;", (result["message_id"],))
+    ctx.execute(
+        "UPDATE conversation_reads SET unread_count = unread_count - 1 WHERE user_id = %s AND partner_id = %s;",
+        (result["receiver_id"], result["sender_id"]),
+    )
+
+
+def _delete_broadcast(ctx, result):
+    ctx.execute(
+        "DELETE FROM messages WHERE message_id BETWEEN %s AND %s AND sender_id = %s;",
+        (result["first_message_id"], result["last_message_id"], ctx.bench_user),
+    )
+    ctx.execute("DELETE FROM conversation_reads WHERE partner_id = %s;", (ctx.bench_user,))
+
+
+BENCHMARKS = [
+    # Users
+    Benchmark("create_user", _new_user, _delete(db.delete_user, "user_id")),
+    Benchmark("get_user_by_id", lambda ctx: (ctx.pick("user"),)),
+    Benchmark("get_all_users", lambda ctx: ()),
+    Benchmark("update_user", _same_user),
+    Benchmark("delete_user", lambda ctx: (db.create_user(ctx.con, *_new_user(ctx))["user_id"],)),
+    Benchmark("search_users", _user_search),
+    # Courses
+    Benchmark("create_course", _new_course, _delete(db.delete_course, "course_id")),
+    Benchmark("get_course", lambda ctx: (ctx.pick("course"),)),
+    Benchmark("get_courses_by_teacher", lambda ctx: (ctx.pick("teacher"),)),
+    Benchmark("get_course_stats", lambda ctx: (ctx.pick("course"),)),
+    Benchmark("get_course_stats_by_teacher", lambda ctx: (ctx.pick("teacher"),)),
+    Benchmark("update_course", _same_course),
+    Benchmark("delete_course", lambda ctx: (db.create_course(ctx.con, *_new_course(ctx))["course_id"],)),
+    # Enrollments
+    Benchmark(
+        "create_enrollment",
+        lambda ctx: (ctx.bench_user, ctx.pick("course")),
+        lambda ctx, result: ctx.execute("DELETE FROM enrollments WHERE enrollment_id = %s;", (result["enrollment_id"],)),
+    ),
+    Benchmark("get_enrollment", lambda ctx: (ctx.pick("enrollment"),)),
+    Benchmark("get_enrollments_by_user", lambda ctx: (ctx.pick("student"),)),
+    # Assignments
+    Benchmark("create_assignment", _new_assignment, _delete(db.delete_assignment, "assignment_id")),
+    Benchmark("get_assignment", lambda ctx: (ctx.pick("assignment"),)),
+    Benchmark("get_assignments_by_course", lambda ctx: (ctx.pick("course"),)),
+    Benchmark("update_assignment", _same_assignment),
+    Benchmark("patch_assignment", lambda ctx: (lambda a: (a[0], {"title": a[2]}))(_same_assignment(ctx))),
+    Benchmark("delete_assignment", lambda ctx: (db.create_assignment(ctx.con, *_new_assignment(ctx))["assignment_id"],)),
+    # Messages
+    Benchmark(
+        "create_message",
+        lambda ctx: (*ctx.pick("pair"), None, "Benchmark message"),
+        _delete_message,
+    ),
+    Benchmark(
+        "create_course_broadcast",
+        lambda ctx: (ctx.pick("course"), ctx.bench_user, "Benchmark broadcast"),
+        _delete_broadcast,
+    ),
+    Benchmark("get_message", lambda ctx: (ctx.pick("message"),)),
+    Benchmark("get_messages_between_users", lambda ctx: ctx.pick("pair")),
+    Benchmark("get_messages_between_users_since", lambda ctx: (*ctx.pick("pair"), ctx.pick("message"))),
+    Benchmark("get_conversations", lambda ctx: (ctx.pick("pair")[1], 20, 0)),
+    Benchmark("search_messages", lambda ctx: (ctx.pick("pair")[1], "course")),
+    Benchmark(
+        "mark_conversation_read",
+        lambda ctx: (ctx.bench_user, ctx.pick("user")),
+        lambda ctx, result: ctx.execute("DELETE FROM conversation_reads WHERE user_id = %s;", (ctx.bench_user,)),
+    ),
+    Benchmark("get_conversation_read", lambda ctx: ctx.pick("pair")[::-1]),
+    Benchmark("get_unread_counts", lambda ctx: (ctx.pick("pair")[1],)),
+    # Submissions
+    Benchmark("create_submission", _new_submission, _delete(db.delete_submission, "submission_id")),
+    Benchmark("get_submission", lambda ctx: (ctx.pick("submission"),)),
+    Benchmark("get_submissions_by_assignment", lambda ctx: (ctx.pick("assignment"),)),
+    Benchmark("get_submissions_by_student", lambda ctx: (ctx.pick("student"),)),
+    Benchmark("update_submission_grade", _same_grade),
+    Benchmark("get_assignment_grade_stats", lambda ctx: (ctx.pick("assignment"),)),
+    Benchmark("get_course_grade_stats", lambda ctx: (ctx.pick("course"),)),
+    Benchmark("get_course_submission_report", lambda ctx: (ctx.pick("course"),)),
+    Benchmark("get_assignment_submission_report", lambda ctx: (ctx.pick("assignment"),)),
+    Benchmark("delete_submission", lambda ctx: (db.create_submission(ctx.con, *_new_submission(ctx))["submission_id"],)),
+    Benchmark("stream_submissions_by_assignment", lambda ctx: (ctx.pick("assignment"),), call=_consume(db.stream_submissions_by_assignment)),
+    Benchmark("stream_submissions_by_student", lambda ctx: (ctx.pick("student"),), call=_consume(db.stream_submissions_by_student)),
+    # Lessons
+    Benchmark("create_lesson", _new_lesson, _delete(db.delete_lesson, "lesson_id")),
+    Benchmark("get_lesson", lambda ctx: (ctx.pick("lesson"),)),
+    Benchmark("get_lessons_by_course", lambda ctx: (ctx.pick("course"),)),
+    Benchmark("update_lesson", _same_lesson),
+    Benchmark("delete_lesson", lambda ctx: (db.create_lesson(ctx.con, *_new_lesson(ctx))["lesson_id"],)),
+    # Resources
+    Benchmark("create_resource", _new_resource, _delete(db.delete_resource, "resource_id")),
+    Benchmark("get_resource", lambda ctx: (ctx.pick("resource"),)),
+    Benchmark("get_resources_by_course", lambda ctx: (ctx.pick("course"),)),
+    Benchmark("get_resources_by_lesson", lambda ctx: (ctx.pick("lesson"),)),
+    Benchmark("update_resource", _same_resource),
+    Benchmark("delete_resource", lambda ctx: (db.create_resource(ctx.con, *_new_resource(ctx))["resource_id"],)),
+    # Attendance
+    Benchmark("create_attendance", _new_attendance, _delete(db.delete_attendance, "attendance_id")),
+    Benchmark("get_attendance", lambda ctx: (ctx.pick("attendance"),)),
+    Benchmark("get_attendance_by_lesson", lambda ctx: (ctx.pick("lesson"),)),
+    Benchmark("get_attendance_by_student", lambda ctx: (ctx.pick("student"),)),
+    Benchmark("update_attendance", _same_attendance),
+    Benchmark("delete_attendance", lambda ctx: (db.create_attendance(ctx.con, *_new_attendance(ctx))["attendance_id"],)),
+    Benchmark("stream_attendance_by_lesson", lambda ctx: (ctx.pick("lesson"),), call=_consume(db.stream_attendance_by_lesson)),
+    Benchmark("stream_attendance_by_student", lambda ctx: (ctx.pick("student"),), call=_consume(db.stream_attendance_by_student)),
+    Benchmark("get_student_attendance_rates", lambda ctx: (ctx.pick("student"),)),
+    Benchmark("get_course_attendance_rates", lambda ctx: (ctx.pick("course"),)),
+    Benchmark("search_content", lambda ctx: (f"course {ctx.pick('course')}",)),
+    Benchmark("search_content_prefix", lambda ctx: (f"room {ctx.rng.randint(1, 40)} no", None, True), call=db.search_content),
+]
+
+
+def remove_bench_user(ctx):
+    """Deletes everything the benchmark user wrote, then the user itself."""
+    for table, column in (("attendance", "student_id"), ("submissions", "student_id"),
+                          ("enrollments", "user_id"), ("messages", "sender_id"),
+                          ("conversation_reads", "user_id"), ("conversation_reads", "partner_id")):
+        ctx.execute(f"DELETE FROM {table} WHERE {column} = %s;", (ctx.bench_user,))
+    db.delete_user(ctx.con, ctx.bench_user)
+
+
+def load_samples(con, size):
+    samples = {}
+    with con:
+        with con.cursor() as cursor:
+            for key, query in SAMPLE_QUERIES.items():
+                cursor.execute(f"SELECT * FROM ({query}) s ORDER BY md5(s::text) LIMIT %s;", (size,))
+                rows = cursor.fetchall()
+                if not rows:
+                    raise SystemExit(f"No {key} rows found, run python -m bench.seed first")
+                samples[key] = [row if len(row) > 1 else row[0] for row in rows]
+    return samples
+
+
+def dataset_info(con):
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute("SHOW server_version;")
+            server_version = cursor.fetchone()[0]
+            rows = {}
+            for table in ("users", "courses", "enrollments", "lessons", "assignments",
+                          "resources", "submissions", "attendance", "messages"):
+                cursor.execute(f"SELECT count(*) FROM {table};")
+                rows[table] = cursor.fetchone()[0]
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "postgres": server_version,
+        "rows": rows,
+    }
+
+
+def run_benchmark(ctx, benchmark, warmup, rounds, round_seconds):
+    def one_call():
+        args = benchmark.prepare(ctx)
+        started = time.perf_counter()
+        result = benchmark.call(ctx.con, *args)
+        elapsed = time.perf_counter() - started
+        if benchmark.cleanup is not None:
+            benchmark.cleanup(ctx, result)
+        return elapsed
+
+    for _ in range(warmup):
+        one_call()
+
+    means = []
+    calls = []
+    for _ in range(rounds):
+        spent = 0.0
+        round_calls = []
+        # Untimed prepare/cleanup don't count towards the round length
+        while spent < round_seconds:
+            elapsed = one_call()
+            spent += elapsed
+            round_calls.append(elapsed)
+        means.append(spent / len(round_calls))
+        calls.extend(round_calls)
+
+    calls.sort()
+    return {
+        "calls": len(calls),
+        "median_us": round(statistics.median(means) * 1e6, 1),
+        "min_us": round(min(means) * 1e6, 1),
+        "p95_us": round(calls[min(len(calls) - 1, int(len(calls) * 0.95))] * 1e6, 1),
+        "stdev_pct": round(statistics.pstdev(means) / statistics.mean(means) * 100, 1),
+    }
+
+
+def run(args):
+    con = get_connection()
+    try:
+        ctx = Context(con, load_samples(con, args.sample_size), random.Random(args.seed))
+        ctx.bench_user = db.create_user(con, *_new_user(ctx))["user_id"]
+        results = {}
+        try:
+            for benchmark in BENCHMARKS:
+                if args.only and not any(fnmatch.fnmatch(benchmark.name, f"*{p}*") for p in args.only):
+                    continue
+                try:
+                    results[benchmark.name] = run_benchmark(ctx, benchmark, args.warmup, args.rounds, args.round_seconds)
+                except db.ExtensionMissing as e:
+                    print(f"{benchmark.name:40} skipped: {e}", file=sys.stderr)
+                    continue
+                print(f"{benchmark.name:40} {results[benchmark.name]['median_us']:>12.1f} us", file=sys.stderr)
+        finally:
+            remove_bench_user(ctx)
+        return {"info": dataset_info(con), "settings": {
+            "warmup": args.warmup, "rounds": args.rounds, "round_seconds": args.round_seconds, "seed": args.seed,
+        }, "results": results}
+    finally:
+        con.close()
+
+
+def compare(current, baseline, threshold):
+    """Change of every function's median against the baseline, and which ones regressed."""
+    report = {}
+    regressions = []
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            report[name] = {"median_us": result["median_us"], "baseline_us": None}
+            continue
+        change = (result["median_us"] - old["median_us"]) / old["median_us"] * 100
+        report[name] = {
+            "median_us": result["median_us"],
+            "baseline_us": old["median_us"],
+            "change_pct": round(change, 1),
+        }
+        if change > threshold:
+            regressions.append(name)
+    return report, regressions
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+
+
+def main(args):
+    current = run(args)
+
+    if args.command == "run":
+        print(json.dumps(current, indent=2))
+        if args.output:
+            _write(args.output, current)
+        return
+
+    if args.command == "baseline":
+        if args.only and os.path.exists(args.baseline):
+            # Only the selected functions are (re)recorded, the rest of the
+            # baseline stays as it was so earlier regressions don't disappear
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            baseline["results"].update(current["results"])
+            current = {**current, "results": baseline["results"]}
+        _write(args.baseline, current)
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    report, regressions = compare(current, baseline, args.threshold)
+    print(json.dumps({
+        "threshold_pct": args.threshold,
+        "regressions": regressions,
+        # Numbers from a different dataset or machine are not comparable
+        "same_dataset": baseline["info"]["rows"] == current["info"]["rows"],
+        "results": report,
+    }, indent=2))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("run", "baseline", "compare"))
+    parser.add_argument("--only", nargs="+", help="only functions whose name contains one of these")
+    parser.add_argument("--warmup", type=int, default=20, help="untimed calls per function")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--round-seconds", type=float, default=0.2, help="minimum timed seconds per round")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sample-size", type=int, default=500, help="IDs sampled per table")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent slower that counts as a regression")
+    parser.add_argument("--output", help="with run: also write the results to this file")
+    main(parser.parse_args())
@@ -0,0 +1,234 @@
+"""
+Query-plan snapshots for the SQL in db.py.
+
+Calls every db.py function once, the same way bench.micro does, against a
+database seeded with bench.seed. It records the statements they send and
+runs EXPLAIN (FORMAT JSON) on each. Only the shape of a plan is kept:
+node types, the tables they read, index names and join types, but no
+costs. Shapes are stored in bench/plan_snapshots, one file per function.
+
+    python -m bench.plans snapshot     # (re)write the snapshots
+    python -m bench.plans check        # compare against them
+
+check exits with status 1 when a table that was read through an index is
+now read with a sequential scan, or when any plan reads one of the
+LARGE_TABLES with a sequential scan, snapshotted or not. Other plan
+changes are listed but don't fail the check unless --strict is given;
+after an intended change, run snapshot again and commit the new files.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+
+import psycopg2.extensions
+
+from bench.micro import BENCHMARKS, Context, _new_user, load_samples, remove_bench_user
+from db import ExtensionMissing, create_user
+from db_setup import get_connection
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), "plan_snapshots")
+
+INDEX_SCANS = ("Index Scan", "Index Only Scan", "Bitmap Index Scan", "Bitmap Heap Scan")
+
+# Tables that grow with every course and student. No function may read them
+# with a Seq Scan, so a missing index can't hide in an accepted snapshot
+LARGE_TABLES = (
+    "attendance", "submissions", "messages", "enrollments",
+    "lessons", "resources", "assignments", "courses", "users",
+)
+# Functions that return a whole table, where a Seq Scan is the right plan
+FULL_TABLE_READS = {
+    "get_all_users": ("users",),
+}
+
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+class CapturingConnection(psycopg2.extensions.connection):
+    """Connection that remembers the statements its cursors execute while `captured` is a list."""
+
+    captured = None
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        connection = self
+
+        class CapturingCursor(base):
+            def execute(self, query, vars=None):
+                if connection.captured is not None:
+                    connection.captured.append((query, vars))
+                return super().execute(query, vars)
+
+        kwargs["cursor_factory"] = CapturingCursor
+        return super().cursor(*args, **kwargs)
+
+
+def plan_shape(node, depth=0):
+    """One line per plan node, e.g. 'Index Scan on users using users_pkey', indented by depth."""
+    line = node["Node Type"]
+    if "Join Type" in node and node["Join Type"] != "Inner":
+        line += f" ({node['Join Type']})"
+    if "Relation Name" in node:
+        line += f" on {node['Relation Name']}"
+    if "Index Name" in node:
+        line += f" using {node['Index Name']}"
+    lines = ["  " * depth + line]
+    for child in node.get("Plans", []):
+        lines.extend(plan_shape(child, depth + 1))
+    return lines
+
+
+def _scans(shape):
+    """(table, scan type) pairs of a plan shape."""
+    scans = set()
+    for line in shape:
+        match = re.match(r"\s*(.+?) on (\w+)", line)
+        if match:
+            scans.add((match.group(2), match.group(1)))
+    return scans
+
+
+def index_to_seq_flips(old_shape, new_shape):
+    """Tables read through an index in the old plan and with a Seq Scan in the new one."""
+    old, new = _scans(old_shape), _scans(new_shape)
+    indexed = {table for table, scan in old if scan in INDEX_SCANS}
+    return sorted(table for table, scan in new if scan == "Seq Scan" and table in indexed)
+
+
+def large_table_seq_scans(function, shape):
+    """LARGE_TABLES read with a Seq Scan in a plan shape, except the function's FULL_TABLE_READS."""
+    allowed = FULL_TABLE_READS.get(function, ())
+    return sorted(
+        table for table, scan in _scans(shape)
+        if scan == "Seq Scan" and table in LARGE_TABLES and table not in allowed
+    )
+
+
+def explain(cursor, query, params):
+    # Without ANALYZE nothing is executed, so writes are safe to explain
+    cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan_shape(plan[0]["Plan"])
+
+
+def capture_plans(args):
+    """Plan shapes of every statement sent by every benchmarked db.py function."""
+    con = get_connection(connection_factory=CapturingConnection)
+    explain_con = get_connection(connection_factory=psycopg2.extensions.connection)
+    explain_con.autocommit = True
+    snapshots = {}
+    try:
+        ctx = Context(con, load_samples(con, args.sample_size), random.Random(args.seed))
+        ctx.bench_user = create_user(con, *_new_user(ctx))["user_id"]
+        try:
+            for benchmark in BENCHMARKS:
+                if args.only and not any(p in benchmark.name for p in args.only):
+                    continue
+                call_args = benchmark.prepare(ctx)
+                con.captured = []
+                try:
+                    result = benchmark.call(con, *call_args)
+                except ExtensionMissing as e:
+                    print(f"{benchmark.name}: skipped, {e}", file=sys.stderr)
+                    continue
+                finally:
+                    statements, con.captured = con.captured, None
+                if benchmark.cleanup is not None:
+                    benchmark.cleanup(ctx, result)
+
+                entries = []
+                with explain_con.cursor() as cursor:
+                    for query, params in statements:
+                        query = query.decode() if isinstance(query, bytes) else str(query)
+                        if not _EXPLAINABLE.match(query):
+                            continue
+                        entries.append({
+                            "query": _WHITESPACE.sub(" ", query).strip(),
+                            "plan": explain(cursor, query, params),
+                        })
+                snapshots[benchmark.name] = entries
+        finally:
+            remove_bench_user(ctx)
+    finally:
+        con.close()
+        explain_con.close()
+    return snapshots
+
+
+def _path(directory, function):
+    return os.path.join(directory, f"{function}.json")
+
+
+def write_snapshots(directory, snapshots):
+    os.makedirs(directory, exist_ok=True)
+    for function, entries in snapshots.items():
+        with open(_path(directory, function), "w") as f:
+            json.dump({"function": function, "statements": entries}, f, indent=2)
+            f.write("\n")
+
+
+def check_snapshots(directory, snapshots):
+    """Compares against the stored snapshots; returns (flips, seq_scans, changes, missing)."""
+    flips, seq_scans, changes, missing = [], [], [], []
+    for function, entries in snapshots.items():
+        for i, entry in enumerate(entries):
+            tables = large_table_seq_scans(function, entry["plan"])
+            if tables:
+                seq_scans.append({"function": function, "statement": i, "tables": tables, "plan": entry["plan"]})
+
+        path = _path(directory, function)
+        if not os.path.exists(path):
+            missing.append(function)
+            continue
+        with open(path) as f:
+            stored = json.load(f)["statements"]
+        if len(stored) != len(entries):
+            changes.append({"function": function, "reason": f"{len(stored)} statements before, {len(entries)} now"})
+            continue
+        for i, (old, new) in enumerate(zip(stored, entries)):
+            if old["query"] != new["query"]:
+                changes.append({"function": function, "statement": i, "reason": "query text changed"})
+            elif old["plan"] != new["plan"]:
+                tables = index_to_seq_flips(old["plan"], new["plan"])
+                entry = {"function": function, "statement": i, "before": old["plan"], "now": new["plan"]}
+                if tables:
+                    flips.append({**entry, "tables": tables})
+                else:
+                    changes.append({**entry, "reason": "plan changed"})
+    return flips, seq_scans, changes, missing
+
+
+def main(args):
+    snapshots = capture_plans(args)
+
+    if args.command == "snapshot":
+        write_snapshots(args.directory, snapshots)
+        print(f"Wrote {len(snapshots)} plan snapshots to {args.directory}", file=sys.stderr)
+        return
+
+    flips, seq_scans, changes, missing = check_snapshots(args.directory, snapshots)
+    print(json.dumps({
+        "index_to_seq_scan": flips,
+        "large_table_seq_scan": seq_scans,
+        "changed": changes,
+        "missing": missing,
+    }, indent=2))
+    if flips or seq_scans or (args.strict and (changes or missing)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("snapshot", "check"))
+    parser.add_argument("--only", nargs="+", help="only functions whose name contains one of these")
+    parser.add_argument("--directory", default=SNAPSHOT_DIR)
+    parser.add_argument("--strict", action="store_true", help="also fail on any other plan change")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sample-size", type=int, default=500, help="IDs sampled per table")
+    main(parser.parse_args())
@@ -0,0 +1,225 @@
+"""
+Seeds the database with a realistic dataset for the benchmarks.
+
+Creates teachers and students, courses of varying size with their
+enrollments, lessons, assignments, resources, submissions (some of them
+late), attendance for every lesson and enrolled student, and messages
+between students and their teachers. All rows are generated inside
+Postgres with generate_series, so even the default scale takes seconds.
+
+--scale multiplies every count; the per-course numbers stay the same.
+The same --seed and --scale give the same data. Existing data is only
+replaced with --reset, which truncates all tables.
+
+    python -m bench.seed --scale 1 --reset
+"""
+import argparse
+import json
+import time
+
+from db_setup import create_tables, get_connection
+
+TABLES = (
+    "attendance_rollup", "course_stats", "attendance", "submissions", "resources",
+    "conversation_reads", "messages", "assignments", "lessons", "enrollments", "courses", "users",
+)
+
+STEPS = [
+    ("users", """
+        INSERT INTO users (username, email, role, password, created_at)
+        SELECT 'teacher_' || i, 'teacher_' || i || '@example.com', 'teacher', md5(i::text),
+               now() - random() * interval '5 years'
+        FROM generate_series(1, %(teachers)s) i;
+
+        INSERT INTO users (username, email, role, password, created_at)
+        SELECT 'student_' || i, 'student_' || i || '@example.com', 'student', md5(i::text),
+               now() - random() * interval '3 years'
+        FROM generate_series(1, %(students)s) i;
+    """),
+    ("courses", """
+        INSERT INTO courses (title, description, teacher_id, start_date, end_date)
+        SELECT 'Course ' || i,
+               'Description of course ' || i || ', ' || repeat('an introduction to the subject ', 1 + i %% 5),
+               1 + (i - 1) %% %(teachers)s,
+               start_date,
+               start_date + 120
+        FROM (
+            SELECT i, current_date - (random() * 365)::int AS start_date
+            FROM generate_series(1, %(courses)s) i
+        ) c;
+    """),
+    # Course sizes vary between a quarter and 1.75 times the average. Each
+    # course takes a consecutive run of students from its own offset, so
+    # the pairs stay unique
+    ("enrollments", """
+        INSERT INTO enrollments (user_id, course_id, enrolled_at)
+        SELECT %(teachers)s + 1 + (s.course_id * 7919 + k) %% %(students)s,
+               s.course_id,
+               s.start_date - random() * interval '30 days'
+        FROM (
+            SELECT course_id, start_date,
+                   least(%(students)s, greatest(1, round(%(students_per_course)s * (0.25 + 1.5 * random()))))::int AS size
+            FROM courses
+        ) s
+        CROSS JOIN LATERAL generate_series(0, s.size - 1) k;
+    """),
+    ("lessons", """
+        INSERT INTO lessons (course_id, title, description, scheduled_at, duration_minutes, location)
+        SELECT c.course_id, 'Lesson ' || k, 'Notes for lesson ' || k || ' of course ' || c.course_id,
+               c.start_date + (k * 7) + time '09:00',
+               (ARRAY[45, 60, 90])[1 + k %% 3],
+               'Room ' || (1 + (c.course_id + k) %% 40)
+        FROM courses c
+        CROSS JOIN generate_series(1, %(lessons_per_course)s) k;
+    """),
+    ("assignments", """
+        INSERT INTO assignments (course_id, title, description, due_date)
+        SELECT c.course_id, 'Assignment ' || k, 'Hand in exercise set ' || k,
+               c.start_date + (k * 10) + time '23:59'
+        FROM courses c
+        CROSS JOIN generate_series(1, %(assignments_per_course)s) k;
+    """),
+    ("resources", """
+        INSERT INTO resources (course_id, lesson_id, title, type, url, uploaded_at)
+        SELECT l.course_id, l.lesson_id, 'Material ' || k || ' for ' || l.title,
+               (ARRAY['PDF', 'video', 'link'])[1 + (l.lesson_id + k) %% 3],
+               'https://example.com/resources/' || l.lesson_id || '/' || k,
+               l.scheduled_at - interval '2 days'
+        FROM lessons l
+        CROSS JOIN generate_series(1, %(resources_per_lesson)s) k;
+    """),
+    # late_rate of the submissions come in up to three days after the due date
+    ("submissions", """
+        INSERT INTO submissions (assignment_id, student_id, submitted_at, url, grade, score, feedback)
+        SELECT s.assignment_id, s.user_id,
+               CASE WHEN s.late < %(late_rate)s
+                    THEN s.due_date + s.offset_ * interval '3 days'
+                    ELSE s.due_date - s.offset_ * interval '7 days'
+               END,
+               'https://example.com/submissions/' || s.assignment_id || '/' || s.user_id,
+               s.grade,
+               grade_to_score(s.grade),
+               CASE WHEN s.grade IS NOT NULL THEN 'Feedback for student ' || s.user_id END
+        FROM (
+            SELECT a.assignment_id, a.due_date, e.user_id,
+                   random() AS submit, random() AS late, random() AS offset_,
+                   CASE WHEN random() < 0.7
+                        THEN (ARRAY['A', 'B+', 'B', 'C+', 'C', 'D', 'F'])[1 + floor(random() * 7)::int]
+                   END AS grade
+            FROM assignments a
+            JOIN enrollments e ON e.course_id = a.course_id
+        ) s
+        WHERE s.submit < %(submission_rate)s;
+    """),
+    ("attendance", """
+        INSERT INTO attendance (lesson_id, student_id, status, recorded_at)
+        SELECT a.lesson_id, a.user_id,
+               CASE WHEN a.r < %(absent_rate)s THEN 'absent'
+                    WHEN a.r < %(absent_rate)s + %(late_attendance_rate)s THEN 'late'
+                    ELSE 'present'
+               END,
+               a.scheduled_at
+        FROM (
+            SELECT l.lesson_id, l.scheduled_at, e.user_id, random() AS r
+            FROM lessons l
+            JOIN enrollments e ON e.course_id = l.course_id
+        ) a;
+    """),
+    # Random enrollments, half of the messages go from the student to the
+    # course's teacher and half the other way
+    ("messages", """
+        INSERT INTO messages (sender_id, receiver_id, course_id, content, sent_at)
+        SELECT CASE WHEN m.from_student THEN e.user_id ELSE c.teacher_id END,
+               CASE WHEN m.from_student THEN c.teacher_id ELSE e.user_id END,
+               e.course_id,
+               'Message ' || m.i || ' about ' || c.title,
+               now() - m.age * interval '180 days'
+        FROM (
+            SELECT i, 1 + floor(random() * (SELECT count(*) FROM enrollments))::int AS enrollment_id,
+                   random() < 0.5 AS from_student, random() AS age
+            FROM generate_series(1, %(messages)s) i
+        ) m
+        JOIN enrollments e USING (enrollment_id)
+        JOIN courses c ON c.course_id = e.course_id;
+
+        INSERT INTO conversation_reads (user_id, partner_id, unread_count)
+        SELECT receiver_id, sender_id, count(*) FILTER (WHERE sent_at > now() - interval '7 days')
+        FROM messages
+        GROUP BY receiver_id, sender_id;
+
+        INSERT INTO conversation_reads (user_id, partner_id)
+        SELECT DISTINCT sender_id, receiver_id FROM messages
+        ON CONFLICT (user_id, partner_id) DO NOTHING;
+    """),
+]
+
+
+def sizes(args):
+    return {
+        "teachers": max(1, round(args.teachers * args.scale)),
+        "students": max(1, round(args.students * args.scale)),
+        "courses": max(1, round(args.courses * args.scale)),
+        "messages": round(args.messages * args.scale),
+        "students_per_course": args.students_per_course,
+        "lessons_per_course": args.lessons_per_course,
+        "assignments_per_course": args.assignments_per_course,
+        "resources_per_lesson": args.resources_per_lesson,
+        "submission_rate": args.submission_rate,
+        "late_rate": args.late_rate,
+        "absent_rate": args.absent_rate,
+        "late_attendance_rate": args.late_attendance_rate,
+    }
+
+
+def main(args):
+    create_tables()
+    params = sizes(args)
+    con = get_connection()
+    try:
+        with con:
+            with con.cursor() as cursor:
+                cursor.execute("SELECT EXISTS (SELECT 1 FROM users);")
+                if cursor.fetchone()[0] and not args.reset:
+                    raise SystemExit("The database already has data, pass --reset to replace it")
+                # RESTART IDENTITY so every run hands out the same IDs
+                cursor.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE;")
+                cursor.execute("SELECT setseed(%s);", (args.seed,))
+
+                timings = {}
+                for table, sql in STEPS:
+                    started = time.perf_counter()
+                    cursor.execute(sql, params)
+                    timings[table] = round(time.perf_counter() - started, 3)
+
+        # Fresh statistics, otherwise the first benchmark runs against bad plans
+        con.autocommit = True
+        with con.cursor() as cursor:
+            cursor.execute("ANALYZE;")
+            rows = {}
+            for table in TABLES:
+                cursor.execute(f"SELECT count(*) FROM {table};")
+                rows[table] = cursor.fetchone()[0]
+    finally:
+        con.close()
+
+    print(json.dumps({"params": params, "rows": rows, "seconds": timings}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies users, courses and messages")
+    parser.add_argument("--seed", type=float, default=0.42, help="passed to setseed(), between -1 and 1")
+    parser.add_argument("--reset", action="store_true", help="truncate all tables first")
+    parser.add_argument("--teachers", type=int, default=200)
+    parser.add_argument("--students", type=int, default=10000)
+    parser.add_argument("--courses", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--students-per-course", type=int, default=30, help="average, actual sizes vary")
+    parser.add_argument("--lessons-per-course", type=int, default=20)
+    parser.add_argument("--assignments-per-course", type=int, default=10)
+    parser.add_argument("--resources-per-lesson", type=int, default=2)
+    parser.add_argument("--submission-rate", type=float, default=0.85)
+    parser.add_argument("--late-rate", type=float, default=0.15, help="share of submissions after the due date")
+    parser.add_argument("--absent-rate", type=float, default=0.08)
+    parser.add_argument("--late-attendance-rate", type=float, default=0.07)
+    main(parser.parse_args())
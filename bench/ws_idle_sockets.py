@@ -0,0 +1,122 @@
+"""
+Load test for the message WebSocket: many idle sockets on one worker.
+
+Opens --sockets WebSockets (10 000 by default) against /ws/messages/{user_id},
+keeps them idle, then posts --messages messages through POST /messages and
+measures how long each one takes to reach the receiver's socket. With
+--server-pid the worker's memory is read before and after connecting.
+
+The sender and receiver IDs must exist in the database (bench/seed.py
+creates them). Raise the open file limit first, e.g. `ulimit -n 65536`,
+on both the client and the server side.
+
+    python bench/ws_idle_sockets.py --sockets 10000 --server-pid $(pgrep -f "uvicorn app:app")
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+import httpx
+import websockets
+
+
+def rss_mb(pid):
+    if pid is None:
+        return None
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+async def open_socket(url, user_id, sockets, inboxes, semaphore):
+    async with semaphore:
+        ws = await websockets.connect(f"{url}/ws/messages/{user_id}", open_timeout=30, ping_interval=None)
+    sockets.append(ws)
+    inbox = inboxes.setdefault(user_id, asyncio.Queue())
+    try:
+        async for raw in ws:
+            inbox.put_nowait((time.perf_counter(), json.loads(raw)))
+    except websockets.ConnectionClosed:
+        pass
+
+
+async def main(args):
+    sockets = []
+    inboxes = {}
+    user_ids = [args.first_user_id + i % args.users for i in range(args.sockets)]
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    rss_before = rss_mb(args.server_pid)
+    started = time.perf_counter()
+    readers = [
+        asyncio.create_task(open_socket(args.url.replace("http", "ws", 1), user_id, sockets, inboxes, semaphore))
+        for user_id in user_ids
+    ]
+    while len(sockets) < args.sockets:
+        failed = [task for task in readers if task.done() and task.exception()]
+        if failed:
+            raise failed[0].exception()
+        await asyncio.sleep(0.1)
+    connect_seconds = time.perf_counter() - started
+
+    await asyncio.sleep(args.idle_seconds)
+    rss_after = rss_mb(args.server_pid)
+
+    latencies = []
+    receivers = sorted(set(user_ids))
+    async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+        for _ in range(args.messages):
+            receiver_id = random.choice(receivers)
+            inbox = inboxes[receiver_id]
+            sent = time.perf_counter()
+            response = await client.post("/messages", json={
+                "sender_id": args.sender_id,
+                "receiver_id": receiver_id,
+                "content": "load test",
+            })
+            response.raise_for_status()
+            message_id = response.json()["message_id"]
+            while True:
+                received, message = await asyncio.wait_for(inbox.get(), timeout=10)
+                if message["message_id"] == message_id:
+                    latencies.append((received - sent) * 1000)
+                    break
+
+    for ws in sockets:
+        await ws.close()
+    for task in readers:
+        task.cancel()
+
+    latencies.sort()
+    report = {
+        "sockets": len(sockets),
+        "connect_seconds": round(connect_seconds, 2),
+        "server_rss_mb_before": rss_before,
+        "server_rss_mb_after": rss_after,
+        "server_kb_per_socket": (
+            round((rss_after - rss_before) * 1024 / len(sockets), 2)
+            if rss_before is not None else None
+        ),
+        "delivery_ms_p50": round(statistics.median(latencies), 2) if latencies else None,
+        "delivery_ms_p99": round(latencies[int(len(latencies) * 0.99) - 1], 2) if latencies else None,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--sockets", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=1000, help="sockets are spread over this many user IDs")
+    parser.add_argument("--first-user-id", type=int, default=2)
+    parser.add_argument("--sender-id", type=int, default=1)
+    parser.add_argument("--messages", type=int, default=200, help="messages sent to measure delivery latency")
+    parser.add_argument("--idle-seconds", type=float, default=5.0)
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--server-pid", type=int)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import threading
+
+from starlette.datastructures import Headers
+from starlette.routing import Match
+
+# Comma separated route names to coalesce, "*" means every route decorated with @single_flight
+COALESCE_ROUTES = os.getenv("COALESCE_ROUTES", "*")
+
+_enabled = {name.strip() for name in COALESCE_ROUTES.split(",") if name.strip()}
+
+# Request headers the response depends on (negotiation.py and compression.py)
+VARY_HEADERS = ("accept", "accept-encoding")
+
+_lock = threading.Lock()
+# Only touched from the event loop, the lock is for the stats snapshot
+_in_flight = {}
+_stats = {}
+# endpoint function -> coalescing name, filled by @single_flight
+_endpoints = {}
+
+
+class _Call:
+    """One in-flight request that identical requests can wait on."""
+
+    def __init__(self):
+        self.done = asyncio.get_running_loop().create_future()
+        self.messages = []
+
+
+def is_enabled(name):
+    return "*" in _enabled or name in _enabled
+
+
+def _count(name, key):
+    with _lock:
+        entry = _stats.setdefault(name, {"executed": 0, "collapsed": 0})
+        entry[key] += 1
+
+
+def single_flight(name):
+    """
+    Mark a route so that concurrent identical requests share one execution.
+
+    The endpoint itself is left alone, the work is done by
+    CoalesceMiddleware: the first GET for a given path, query string and
+    Accept/Accept-Encoding runs normally, every request that arrives while
+    it is still running waits for it and gets a copy of the same response.
+
+    Only use this on read-only routes.
+    """
+    def decorator(func):
+        _endpoints[func] = name
+        return func
+    return decorator
+
+
+def _copy(message):
+    # Outer middlewares add headers in place, every request needs its own list
+    if "headers" in message:
+        return {**message, "headers": list(message["headers"])}
+    return message
+
+
+class CoalesceMiddleware:
+    """
+    ASGI middleware that collapses identical concurrent requests to @single_flight routes.
+
+    Sits outside AdmissionMiddleware, so only the leader takes an admission
+    slot and a threadpool thread. Followers wait on the event loop and get
+    the leader's response replayed, a burst of identical requests therefore
+    costs one slot instead of filling the queue. If the leader fails
+    without producing a response, its followers run on their own.
+    """
+
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+        self._routes = None
+
+    def _coalesced_routes(self):
+        # Routes are registered after the middleware is added, so look them up on first use
+        if self._routes is None:
+            self._routes = [
+                (route, _endpoints[route.endpoint])
+                for route in self.router.routes
+                if getattr(route, "endpoint", None) in _endpoints
+            ]
+        return self._routes
+
+    def _match(self, scope):
+        for route, name in self._coalesced_routes():
+            if not is_enabled(name):
+                continue
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                return route, name, child_scope["path_params"]
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        matched = self._match(scope)
+        if matched is None:
+            await self.app(scope, receive, send)
+            return
+
+        route, name, path_params = matched
+        headers = Headers(scope=scope)
+        key = (
+            name,
+            frozenset(path_params.items()),
+            scope.get("query_string", b""),
+            *(headers.get(header, "") for header in VARY_HEADERS),
+        )
+
+        call = _in_flight.get(key)
+        if call is not None:
+            if await call.done:
+                scope["route"] = route
+                _count(name, "collapsed")
+                for message in call.messages:
+                    await send(_copy(message))
+                return
+            # The leader failed before it had a response, run this one normally
+            await self.app(scope, receive, send)
+            return
+
+        call = _in_flight[key] = _Call()
+        completed = False
+
+        async def send_wrapper(message):
+            call.messages.append(_copy(message))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+            completed = True
+        finally:
+            del _in_flight[key]
+            call.done.set_result(completed and bool(call.messages))
+            _count(name, "executed")
+
+
+def coalescing_stats():
+    """Per route: how many calls really ran and how many were collapsed into them."""
+    with _lock:
+        return {
+            name: {**entry, "enabled": is_enabled(name), "in_flight": sum(1 for key in list(_in_flight) if key[0] == name)}
+            for name, entry in _stats.items()
+        }
@@ -0,0 +1,241 @@
+import gzip
+import os
+import threading
+import time
+import zlib
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+from server_timing import route_label
+
+# Brotli is optional, without it we only offer gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this are sent as-is, compressing them costs more than it saves
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Bodies larger than this are compressed in a worker thread so the event loop isn't blocked
+COMPRESSION_THREAD_THRESHOLD = int(os.getenv("COMPRESSION_THREAD_THRESHOLD", "262144"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "text/",
+    "application/x-msgpack",
+    "application/vnd.apache.arrow.stream",
+)
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def supported_encodings():
+    """Encodings this server can produce, in order of preference."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding):
+    """
+    Pick the best encoding from an Accept-Encoding header.
+
+    Honors q-values, treats `*` as "anything we support" and prefers
+    brotli over gzip when the client weighs them equally. Returns None
+    when the response should be sent uncompressed.
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+
+    best = None
+    best_q = 0.0
+    for encoding in supported_encodings():
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class StreamCompressor:
+    """
+    Compresses a streamed body chunk by chunk.
+
+    Every chunk is flushed, so the client can decode each one as soon as it
+    arrives instead of waiting for the end of the stream.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            # wbits 16 + MAX_WBITS writes a gzip header and trailer
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk):
+        if self.encoding == "br":
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def _record(route, encoding, size_in, size_out, seconds):
+    with _stats_lock:
+        entry = _stats.setdefault(route, {
+            "responses": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "seconds": 0.0,
+            "encodings": {},
+        })
+        entry["responses"] += 1
+        entry["bytes_in"] += size_in
+        entry["bytes_out"] += size_out
+        entry["seconds"] += seconds
+        entry["encodings"][encoding] = entry["encodings"].get(encoding, 0) + 1
+
+
+def compression_stats():
+    """Per-route compression ratio and time spent compressing."""
+    with _stats_lock:
+        result = {}
+        for route, entry in _stats.items():
+            result[route] = {
+                "responses": entry["responses"],
+                "bytes_in": entry["bytes_in"],
+                "bytes_out": entry["bytes_out"],
+                "ratio": entry["bytes_out"] / entry["bytes_in"] if entry["bytes_in"] else None,
+                "seconds_total": entry["seconds"],
+                "seconds_avg": entry["seconds"] / entry["responses"],
+                "encodings": dict(entry["encodings"]),
+            }
+        return result
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses response bodies.
+
+    Bodies sent in one piece are compressed whole when they reach the
+    minimum size. Streaming responses (the Arrow and CSV exports) are
+    compressed chunk by chunk with StreamCompressor, so they keep flowing
+    to the client; their size isn't known up front, so the minimum size
+    doesn't apply to them.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE, thread_threshold=COMPRESSION_THREAD_THRESHOLD):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.thread_threshold = thread_threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+        stream = None
+        stream_in = stream_out = 0
+        stream_seconds = 0.0
+
+        async def compress_chunk(chunk):
+            if len(chunk) >= self.thread_threshold:
+                return await run_in_threadpool(stream.compress, chunk)
+            return stream.compress(chunk)
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough, stream, stream_in, stream_out, stream_seconds
+
+            if passthrough:
+                await send(message)
+                return
+
+            if stream is not None:
+                body = message.get("body", b"")
+                more_body = message.get("more_body", False)
+                started = time.perf_counter()
+                compressed = await compress_chunk(body) if body else b""
+                if not more_body:
+                    compressed += stream.finish()
+                stream_seconds += time.perf_counter() - started
+                stream_in += len(body)
+                stream_out += len(compressed)
+                if not more_body:
+                    _record(route_label(scope), encoding, stream_in, stream_out, stream_seconds)
+                await send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+                return
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                if "content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers.add_vary_header("Accept-Encoding")
+
+            # First body message decides: a streaming response is compressed chunk by chunk
+            if message.get("more_body", False):
+                stream = StreamCompressor(encoding)
+                headers["Content-Encoding"] = encoding
+                if "content-length" in headers:
+                    del headers["content-length"]
+                await send(start_message)
+                await send_wrapper(message)
+                return
+
+            if len(body) < self.minimum_size:
+                await send(start_message)
+                await send(message)
+                return
+
+            started = time.perf_counter()
+            if len(body) >= self.thread_threshold:
+                compressed = await run_in_threadpool(compress, body, encoding)
+            else:
+                compressed = compress(body, encoding)
+            elapsed = time.perf_counter() - started
+
+            _record(route_label(scope), encoding, len(body), len(compressed), elapsed)
+
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,159 @@
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import Counter
+from itertools import count
+
+import psycopg2.extensions
+
+from server_timing import current_route
+
+# Set to 1 to track every connection handed out by get_connection()
+CONNECTION_DIAGNOSTICS = os.getenv("CONNECTION_DIAGNOSTICS", "0") == "1"
+# Connections checked out for longer than this many seconds are flagged
+CONNECTION_HOLD_WARNING = float(os.getenv("CONNECTION_HOLD_WARNING", "5.0"))
+# How many frames of the acquiring stack to keep
+CONNECTION_STACK_DEPTH = int(os.getenv("CONNECTION_STACK_DEPTH", "8"))
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_STATES = {
+    psycopg2.extensions.TRANSACTION_STATUS_IDLE: "idle",
+    psycopg2.extensions.TRANSACTION_STATUS_ACTIVE: "active",
+    psycopg2.extensions.TRANSACTION_STATUS_INTRANS: "in_transaction",
+    psycopg2.extensions.TRANSACTION_STATUS_INERROR: "in_failed_transaction",
+    psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN: "unknown",
+}
+
+_ids = count(1)
+_lock = threading.Lock()
+_live = {}
+_leaks_by_route = Counter()
+_stats = {"checked_out": 0, "closed": 0, "leaked": 0, "flagged": 0, "max_live": 0}
+_watchdog = None
+
+
+class _Checkout:
+    __slots__ = ("id", "ref", "route", "thread", "started", "acquired_at", "stack", "flagged")
+
+    def __init__(self, connection_id, connection, stack):
+        self.id = connection_id
+        self.ref = weakref.ref(connection)
+        self.route = current_route()
+        self.thread = threading.current_thread().name
+        self.started = time.monotonic()
+        self.acquired_at = time.time()
+        self.stack = stack
+        self.flagged = False
+
+    def age(self):
+        return time.monotonic() - self.started
+
+
+def track(connection):
+    """
+    Register a freshly opened connection.
+
+    Remembers the route and stack that opened it. Connections that get
+    garbage collected without close() being called are counted as leaks.
+    """
+    # Skip track() and get_connection() themselves
+    frames = traceback.extract_stack(sys._getframe(2), limit=CONNECTION_STACK_DEPTH)
+    stack = [f"{frame.filename}:{frame.lineno} in {frame.name}" for frame in frames]
+    checkout = _Checkout(next(_ids), connection, stack)
+    with _lock:
+        _live[checkout.id] = checkout
+        _stats["checked_out"] += 1
+        _stats["max_live"] = max(_stats["max_live"], len(_live))
+    connection._checkout_id = checkout.id
+    weakref.finalize(connection, _collected, checkout.id)
+    _ensure_watchdog()
+
+
+def release(connection):
+    """Called from close(), the connection was handed back properly."""
+    checkout_id = getattr(connection, "_checkout_id", None)
+    if checkout_id is None:
+        return
+    with _lock:
+        if _live.pop(checkout_id, None) is not None:
+            _stats["closed"] += 1
+
+
+def _collected(checkout_id):
+    with _lock:
+        checkout = _live.pop(checkout_id, None)
+        if checkout is None:
+            return
+        _stats["leaked"] += 1
+        _leaks_by_route[checkout.route or "outside a request"] += 1
+    logger.warning(
+        "Connection %s opened by %s was never closed, the garbage collector closed it after %.3fs",
+        checkout_id, checkout.route or "code outside a request", checkout.age(),
+    )
+
+
+def _ensure_watchdog():
+    global _watchdog
+    if _watchdog is not None:
+        return
+    with _lock:
+        if _watchdog is None:
+            _watchdog = threading.Thread(target=_run_watchdog, name="connection-watchdog", daemon=True)
+            _watchdog.start()
+
+
+def _run_watchdog():
+    interval = max(CONNECTION_HOLD_WARNING / 2, 0.1)
+    while True:
+        time.sleep(interval)
+        with _lock:
+            overdue = [c for c in _live.values() if not c.flagged and c.age() > CONNECTION_HOLD_WARNING]
+            for checkout in overdue:
+                checkout.flagged = True
+                _stats["flagged"] += 1
+        for checkout in overdue:
+            logger.warning(
+                "Connection %s held for %.1fs by %s, acquired at:\n%s",
+                checkout.id, checkout.age(), checkout.route or "code outside a request",
+                "\n".join(checkout.stack),
+            )
+
+
+def _describe(checkout):
+    connection = checkout.ref()
+    if connection is None:
+        state = "collected"
+    elif connection.closed:
+        state = "closed"
+    else:
+        state = TRANSACTION_STATES.get(connection.info.transaction_status, "unknown")
+    age = checkout.age()
+    return {
+        "id": checkout.id,
+        "route": checkout.route,
+        "thread": checkout.thread,
+        "acquired_at": checkout.acquired_at,
+        "age_seconds": round(age, 3),
+        "transaction_state": state,
+        "held_too_long": age > CONNECTION_HOLD_WARNING,
+        "stack": checkout.stack,
+    }
+
+
+def connection_stats():
+    """Open connections with their age, state and acquiring stack, plus leak counters."""
+    with _lock:
+        live = sorted(_live.values(), key=lambda c: c.started)
+        stats = dict(_stats)
+        leaks_by_route = dict(_leaks_by_route.most_common())
+    stats["enabled"] = CONNECTION_DIAGNOSTICS
+    stats["hold_warning_seconds"] = CONNECTION_HOLD_WARNING
+    stats["live"] = len(live)
+    stats["leaks_by_route"] = leaks_by_route
+    stats["connections"] = [_describe(checkout) for checkout in live]
+    return stats
@@ -1,11 +1,23 @@
+import json
+import re
+
 import psycopg2
 # RealDictCursor makes query results come back as Python dictionaries instead of tuples
 # It makes JSON‑like responses easier
 from psycopg2.extras import RealDictCursor
 
+# Every data-access function is wrapped with @timed (@timed_stream for the
+# batch generators), the numbers end up on /metrics
+from metrics import timed, timed_stream
+
+
+class ExtensionMissing(Exception):
+    """A query needs a Postgres extension that isn't installed."""
+
 # -----------------------------------------------------
 # USERS
 # -----------------------------------------------------
+@timed
 def create_user(con, username, email, role, password):
     try:
         with con:
@@ -21,6 +33,7 @@ def create_user(con, username, email, role, password):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def get_user_by_id(con, user_id):
     try:
         with con:
@@ -30,6 +43,7 @@ def get_user_by_id(con, user_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def get_all_users(con):
     try:
         with con:
@@ -39,6 +53,68 @@ def get_all_users(con):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+def _like_pattern(text):
+    # Substring pattern for ILIKE, with the input's own wildcards escaped
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+# Must match the expression of users_search_trgm_idx in db_setup.py
+USER_SEARCH_TEXT = "(username || ' ' || email)"
+# Matches looked at per branch of search_users before ranking
+USER_SEARCH_CANDIDATES = 200
+
+@timed
+def search_users(con, text, limit=20):
+    """
+    Users whose username or email contains `text` or resembles it, best
+    match first. Needs the pg_trgm extension, whose GIN index serves both
+    the ILIKE and the word-similarity (<%) conditions.
+
+    Ranking every match of a common term ("gmail") means reading all of
+    them, so each branch only ranks its first USER_SEARCH_CANDIDATES
+    matches. Similar-only matches are looked up when there aren't
+    enough substring matches.
+    """
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(f"""
+                    SELECT * FROM (
+                        (SELECT * FROM (
+                            SELECT user_id, username, email, role,
+                                   word_similarity(%(text)s, {USER_SEARCH_TEXT}) AS score
+                            FROM users
+                            WHERE {USER_SEARCH_TEXT} ILIKE %(pattern)s
+                            LIMIT %(candidates)s
+                         ) AS contains
+                         ORDER BY score DESC, user_id
+                         LIMIT %(limit)s)
+                        UNION ALL
+                        (SELECT * FROM (
+                            SELECT user_id, username, email, role,
+                                   word_similarity(%(text)s, {USER_SEARCH_TEXT}) AS score
+                            FROM users
+                            WHERE %(text)s <%% {USER_SEARCH_TEXT}
+                              AND NOT {USER_SEARCH_TEXT} ILIKE %(pattern)s
+                            LIMIT %(candidates)s
+                         ) AS resembles
+                         ORDER BY score DESC, user_id
+                         LIMIT %(limit)s)
+                    ) AS found
+                    LIMIT %(limit)s;
+                """, {
+                    "text": text,
+                    "pattern": _like_pattern(text),
+                    "candidates": USER_SEARCH_CANDIDATES,
+                    "limit": limit,
+                })
+                return cursor.fetchall()
+    except psycopg2.errors.UndefinedFunction as e:
+        raise ExtensionMissing("User search needs the pg_trgm extension, run db_setup.py once it is installed") from e
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+@timed
 def update_user(con, user_id, username, email, role):
     try:
         with con:
@@ -60,6 +136,7 @@ def update_user(con, user_id, username, email, role):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def delete_user(con, user_id):
     try:
         with con:
@@ -75,14 +152,18 @@ def delete_user(con, user_id):
 # -----------------------------------------------------
 # COURSES
 # -----------------------------------------------------
+# Every column but search_vector, which is only used by search_content
+COURSE_COLUMNS = "course_id, title, description, teacher_id, start_date, end_date"
+
+@timed
 def create_course(con, title, description, teacher_id, start_date, end_date):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("""
+                cursor.execute(f"""
                     INSERT INTO courses (title, description, teacher_id, start_date, end_date)
                     VALUES (%s, %s, %s, %s, %s)
-                    RETURNING *;
+                    RETURNING {COURSE_COLUMNS};
                 """, (title, description, teacher_id, start_date, end_date))
                 return cursor.fetchone()
 
@@ -91,12 +172,13 @@ def create_course(con, title, description, teacher_id, start_date, end_date):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def get_course(con, course_id):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(
-                    "SELECT * FROM courses WHERE course_id = %s;",
+                    f"SELECT {COURSE_COLUMNS} FROM courses WHERE course_id = %s;",
                     (course_id,)
                 )
                 return cursor.fetchone()
@@ -104,12 +186,13 @@ def get_course(con, course_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def get_courses_by_teacher(con, teacher_id):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(
-                    "SELECT * FROM courses WHERE teacher_id = %s;",
+                    f"SELECT {COURSE_COLUMNS} FROM courses WHERE teacher_id = %s;",
                     (teacher_id,)
                 )
                 return cursor.fetchall()
@@ -117,11 +200,49 @@ def get_courses_by_teacher(con, teacher_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+# Counts from course_stats (see db_setup.py), summed over the course's
+# shards. Courses nothing was added to yet have no rows there
+COURSE_STATS_QUERY = """
+    SELECT c.course_id, c.title,
+           coalesce(sum(s.enrollments), 0) AS enrollments,
+           coalesce(sum(s.lessons), 0) AS lessons,
+           coalesce(sum(s.assignments), 0) AS assignments,
+           coalesce(sum(s.resources), 0) AS resources
+    FROM courses c
+    LEFT JOIN course_stats s ON s.course_id = c.course_id
+    WHERE {where}
+    GROUP BY c.course_id
+    ORDER BY c.course_id;
+"""
+
+@timed
+def get_course_stats(con, course_id):
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(COURSE_STATS_QUERY.format(where="c.course_id = %s"), (course_id,))
+                return cursor.fetchone()
+
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+@timed
+def get_course_stats_by_teacher(con, teacher_id):
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(COURSE_STATS_QUERY.format(where="c.teacher_id = %s"), (teacher_id,))
+                return cursor.fetchall()
+
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+@timed
 def update_course(con, course_id, title, description, teacher_id, start_date, end_date):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("""
+                cursor.execute(f"""
                     UPDATE courses
                     SET title = %s,
                         description = %s,
@@ -129,7 +250,7 @@ def update_course(con, course_id, title, description, teacher_id, start_date, en
                         start_date = %s,
                         end_date = %s
                     WHERE course_id = %s
-                    RETURNING *;
+                    RETURNING {COURSE_COLUMNS};
                 """, (title, description, teacher_id, start_date, end_date, course_id))
 
                 course = cursor.fetchone()
@@ -140,12 +261,13 @@ def update_course(con, course_id, title, description, teacher_id, start_date, en
     except psycopg2.Error as e:
         raise Exception(f"Course update failed: {e.pgerror}") from e
 
+@timed
 def delete_course(con, course_id):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(
-                    "DELETE FROM courses WHERE course_id = %s RETURNING *;",
+                    f"DELETE FROM courses WHERE course_id = %s RETURNING {COURSE_COLUMNS};",
                     (course_id,)
                 )
                 course = cursor.fetchone()
@@ -159,6 +281,7 @@ def delete_course(con, course_id):
 #---------------------------------------------
 # Enrollment
 # --------------------------------------------
+@timed
 def create_enrollment(con, user_id, course_id):
     try:
         with con:
@@ -175,6 +298,7 @@ def create_enrollment(con, user_id, course_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def get_enrollment(con, enrollment_id):
     try:
         with con:
@@ -188,6 +312,7 @@ def get_enrollment(con, enrollment_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def get_enrollments_by_user(con, user_id):
     try:
         with con:
@@ -204,6 +329,7 @@ def get_enrollments_by_user(con, user_id):
 # -------------------------------------------
 # Assigment
 # -------------------------------------------
+@timed
 def create_assignment(con, course_id, title, description, due_date):
     try:
         with con:
@@ -220,6 +346,7 @@ def create_assignment(con, course_id, title, description, due_date):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
     
+@timed
 def get_assignment(con, assignment_id):
     try:
         with con:
@@ -233,6 +360,7 @@ def get_assignment(con, assignment_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def get_assignments_by_course(con, course_id):
     try:
         with con:
@@ -246,6 +374,7 @@ def get_assignments_by_course(con, course_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def update_assignment(con, assignment_id, course_id, title, description, due_date):
     try:
         with con:
@@ -268,6 +397,7 @@ def update_assignment(con, assignment_id, course_id, title, description, due_dat
     except psycopg2.Error as e:
         raise Exception(f"Assignment update failed: {e.pgerror}") from e
     
+@timed
 def patch_assignment(con, assignment_id, data: dict):
     try:
         fields = []
@@ -302,6 +432,7 @@ def patch_assignment(con, assignment_id, data: dict):
     except psycopg2.Error as e:
         raise Exception(f"Assignment update failed: {e.pgerror}") from e
 
+@timed
 def delete_assignment(con, assignment_id):
     try:
         with con:
@@ -321,28 +452,147 @@ def delete_assignment(con, assignment_id):
 # -------------------------------------------
 # MESSAGES
 # -------------------------------------------
+# Channel that create_message notifies on, realtime.py listens to it
+MESSAGE_CHANNEL = "new_message"
+# NOTIFY payloads must stay below 8000 bytes, longer messages are sent without content
+MAX_NOTIFY_PAYLOAD = 7900
+
+# Every column but search_vector, which is only used inside search queries
+MESSAGE_COLUMNS = "message_id, sender_id, receiver_id, course_id, content, sent_at"
+
+def message_payload(message):
+    """JSON-friendly copy of a message row, as pushed to realtime clients."""
+    return {
+        "message_id": message["message_id"],
+        "sender_id": message["sender_id"],
+        "receiver_id": message["receiver_id"],
+        "course_id": message["course_id"],
+        "content": message["content"],
+        "sent_at": message["sent_at"].isoformat(),
+    }
+
+def message_notification_payload(message):
+    payload = message_payload(message)
+    text = json.dumps(payload)
+    if len(text.encode()) > MAX_NOTIFY_PAYLOAD:
+        del payload["content"]
+        text = json.dumps(payload)
+    return text
+
+@timed
 def create_message(con, sender_id, receiver_id, course_id, content):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("""
+                cursor.execute(f"""
                     INSERT INTO messages (sender_id, receiver_id, course_id, content)
                     VALUES (%s, %s, %s, %s)
-                    RETURNING *;
+                    RETURNING {MESSAGE_COLUMNS};
                 """, (sender_id, receiver_id, course_id, content))
-                return cursor.fetchone()
+                message = cursor.fetchone()
+                if sender_id != receiver_id:
+                    cursor.execute("""
+                        INSERT INTO conversation_reads (user_id, partner_id, unread_count)
+                        VALUES (%s, %s, 1)
+                        ON CONFLICT (user_id, partner_id)
+                        DO UPDATE SET unread_count = conversation_reads.unread_count + 1;
+                    """, (receiver_id, sender_id))
+                # The sender's side of the pair, so get_conversations finds it from both ends
+                cursor.execute("""
+                    INSERT INTO conversation_reads (user_id, partner_id)
+                    VALUES (%s, %s)
+                    ON CONFLICT (user_id, partner_id) DO NOTHING;
+                """, (sender_id, receiver_id))
+                # Sent in the same transaction, so listeners only hear about committed messages
+                cursor.execute(
+                    "SELECT pg_notify(%s, %s);",
+                    (MESSAGE_CHANNEL, message_notification_payload(message))
+                )
+                return message
 
     except psycopg2.IntegrityError:
         raise Exception("Message creation failed: invalid sender_id, receiver_id, or course_id.")
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
     
-def get_messages_between_users(con, user1_id, user2_id):
+@timed
+def create_course_broadcast(con, course_id, sender_id, content):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                # One round trip: a message row per enrollee, their unread counters,
+                # the sender's side of each pair and one notification per message
+                # for realtime.py
                 cursor.execute("""
-                    SELECT * FROM messages
+                    WITH inserted AS (
+                        INSERT INTO messages (sender_id, receiver_id, course_id, content)
+                        SELECT %(sender_id)s, enrollments.user_id, enrollments.course_id, %(content)s
+                        FROM enrollments
+                        WHERE enrollments.course_id = %(course_id)s
+                          AND enrollments.user_id <> %(sender_id)s
+                        RETURNING message_id, sender_id, receiver_id, course_id, content, sent_at
+                    ),
+                    counters AS (
+                        INSERT INTO conversation_reads (user_id, partner_id, unread_count)
+                        SELECT receiver_id, sender_id, 1 FROM inserted
+                        ON CONFLICT (user_id, partner_id)
+                        DO UPDATE SET unread_count = conversation_reads.unread_count + 1
+                    ),
+                    partners AS (
+                        INSERT INTO conversation_reads (user_id, partner_id)
+                        SELECT sender_id, receiver_id FROM inserted
+                        ON CONFLICT (user_id, partner_id) DO NOTHING
+                    ),
+                    notified AS (
+                        -- Measured after JSON escaping, quotes and control characters grow
+                        SELECT message_id, pg_notify(%(channel)s,
+                            CASE WHEN octet_length(payload::text) > %(max_payload)s
+                                 THEN (payload - 'content')::text
+                                 ELSE payload::text
+                            END)
+                        FROM (SELECT message_id, to_jsonb(inserted) AS payload FROM inserted) AS payloads
+                    )
+                    SELECT COUNT(*) AS recipients,
+                           MIN(message_id) AS first_message_id,
+                           MAX(message_id) AS last_message_id
+                    FROM notified;
+                """, {
+                    "course_id": course_id,
+                    "sender_id": sender_id,
+                    "content": content,
+                    "channel": MESSAGE_CHANNEL,
+                    "max_payload": MAX_NOTIFY_PAYLOAD,
+                })
+                result = cursor.fetchone()
+                result["course_id"] = course_id
+                return result
+
+    except psycopg2.IntegrityError:
+        raise Exception("Broadcast failed: invalid sender_id.")
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+@timed
+def get_message(con, message_id):
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE message_id = %s;",
+                    (message_id,)
+                )
+                return cursor.fetchone()
+
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+@timed
+def get_messages_between_users(con, user1_id, user2_id):
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(f"""
+                    SELECT {MESSAGE_COLUMNS} FROM messages
                     WHERE (sender_id = %s AND receiver_id = %s)
                        OR (sender_id = %s AND receiver_id = %s)
                     ORDER BY sent_at ASC;
@@ -352,9 +602,182 @@ def get_messages_between_users(con, user1_id, user2_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
     
+@timed
+def get_messages_between_users_since(con, user1_id, user2_id, after_message_id):
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(f"""
+                    SELECT {MESSAGE_COLUMNS} FROM messages
+                    WHERE ((sender_id = %s AND receiver_id = %s)
+                        OR (sender_id = %s AND receiver_id = %s))
+                      AND message_id > %s
+                    ORDER BY message_id ASC;
+                """, (user1_id, user2_id, user2_id, user1_id, after_message_id))
+                return cursor.fetchall()
+
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+@timed
+def search_messages(con, user_id, text, partner_id=None, limit=20, offset=0):
+    """
+    Messages `user_id` sent or received that match `text`, optionally only
+    those exchanged with `partner_id`. Best match first, then newest.
+    `text` is read by websearch_to_tsquery() like the course search.
+    """
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                # One half per direction, like the inbox, so each can use the
+                # (participant, search_vector) GIN index; messages to oneself
+                # only count in the first half
+                cursor.execute(f"""
+                    SELECT {MESSAGE_COLUMNS}, partner_id, ts_rank(search_vector, query) AS rank
+                    FROM (
+                        SELECT *, receiver_id AS partner_id
+                        FROM messages
+                        WHERE sender_id = %(user_id)s
+                          AND search_vector @@ websearch_to_tsquery('english', %(text)s)
+                          AND (%(partner_id)s::int IS NULL OR receiver_id = %(partner_id)s)
+                        UNION ALL
+                        SELECT *, sender_id AS partner_id
+                        FROM messages
+                        WHERE receiver_id = %(user_id)s
+                          AND sender_id <> %(user_id)s
+                          AND search_vector @@ websearch_to_tsquery('english', %(text)s)
+                          AND (%(partner_id)s::int IS NULL OR sender_id = %(partner_id)s)
+                    ) AS mine,
+                    websearch_to_tsquery('english', %(text)s) AS query
+                    ORDER BY rank DESC, sent_at DESC, message_id DESC
+                    LIMIT %(limit)s OFFSET %(offset)s;
+                """, {"user_id": user_id, "text": text, "partner_id": partner_id, "limit": limit, "offset": offset})
+                return cursor.fetchall()
+
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+@timed
+def get_conversations(con, user_id, limit, offset):
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                # One row per partner in conversation_reads (create_message adds
+                # both directions), the newest message of each pair is a LIMIT 1
+                # probe per direction on the (sender, receiver, sent_at) indexes.
+                # Cost grows with the number of partners, not messages, and users
+                # is only joined for the page
+                cursor.execute("""
+                    SELECT page.partner_id,
+                           users.username AS partner_username,
+                           page.message_id,
+                           page.sender_id,
+                           page.receiver_id,
+                           page.course_id,
+                           page.content,
+                           page.sent_at,
+                           page.unread_count
+                    FROM (
+                        SELECT reads.partner_id, reads.unread_count, latest.*
+                        FROM conversation_reads AS reads
+                        CROSS JOIN LATERAL (
+                            SELECT * FROM (
+                                (SELECT message_id, sender_id, receiver_id, course_id, content, sent_at
+                                 FROM messages
+                                 WHERE sender_id = reads.user_id AND receiver_id = reads.partner_id
+                                 ORDER BY sent_at DESC, message_id DESC
+                                 LIMIT 1)
+                                UNION ALL
+                                (SELECT message_id, sender_id, receiver_id, course_id, content, sent_at
+                                 FROM messages
+                                 WHERE sender_id = reads.partner_id AND receiver_id = reads.user_id
+                                 ORDER BY sent_at DESC, message_id DESC
+                                 LIMIT 1)
+                            ) AS both_directions
+                            ORDER BY sent_at DESC, message_id DESC
+                            LIMIT 1
+                        ) AS latest
+                        WHERE reads.user_id = %s
+                        ORDER BY latest.sent_at DESC, latest.message_id DESC
+                        LIMIT %s OFFSET %s
+                    ) AS page
+                    JOIN users ON users.user_id = page.partner_id
+                    ORDER BY page.sent_at DESC, page.message_id DESC;
+                """, (user_id, limit, offset))
+                return cursor.fetchall()
+
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+@timed
+def mark_conversation_read(con, user_id, partner_id):
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                # Lock the counter row first. A create_message still holding it has
+                # committed by the time the lock is granted, so the MAX below (a new
+                # snapshot) sees its message; later ones wait and add 1 after us.
+                cursor.execute("""
+                    INSERT INTO conversation_reads (user_id, partner_id)
+                    VALUES (%s, %s)
+                    ON CONFLICT (user_id, partner_id) DO NOTHING;
+                """, (user_id, partner_id))
+                cursor.execute("""
+                    SELECT 1 FROM conversation_reads
+                    WHERE user_id = %s AND partner_id = %s
+                    FOR UPDATE;
+                """, (user_id, partner_id))
+                cursor.execute("""
+                    UPDATE conversation_reads
+                    SET unread_count = 0,
+                        last_read_message_id = (
+                            SELECT MAX(message_id) FROM messages
+                            WHERE sender_id = %s AND receiver_id = %s
+                        ),
+                        read_at = CURRENT_TIMESTAMP
+                    WHERE user_id = %s AND partner_id = %s
+                    RETURNING *;
+                """, (partner_id, user_id, user_id, partner_id))
+                return cursor.fetchone()
+
+    except psycopg2.IntegrityError:
+        raise Exception("Mark as read failed: invalid user_id or partner_id.")
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+@timed
+def get_conversation_read(con, user_id, partner_id):
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    "SELECT * FROM conversation_reads WHERE user_id = %s AND partner_id = %s;",
+                    (user_id, partner_id)
+                )
+                return cursor.fetchone()
+
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+@timed
+def get_unread_counts(con, user_id):
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT * FROM conversation_reads
+                    WHERE user_id = %s AND unread_count > 0
+                    ORDER BY partner_id;
+                """, (user_id,))
+                return cursor.fetchall()
+
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
 # -------------------------------------------
 # SUBMISSION
 # -------------------------------------------
+@timed
 def create_submission(con, assignment_id, student_id, url):
     try:
         with con:
@@ -371,6 +794,7 @@ def create_submission(con, assignment_id, student_id, url):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def get_submission(con, submission_id):
     try:
         with con:
@@ -384,6 +808,7 @@ def get_submission(con, submission_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def get_submissions_by_assignment(con, assignment_id):
     try:
         with con:
@@ -397,6 +822,7 @@ def get_submissions_by_assignment(con, assignment_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def get_submissions_by_student(con, student_id):
     try:
         with con:
@@ -411,17 +837,19 @@ def get_submissions_by_student(con, student_id):
         raise Exception(f"Database error: {e.pgerror}") from e
 
 # Grade / Update Submission
+@timed
 def update_submission_grade(con, submission_id, grade, feedback):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute("""
                     UPDATE submissions
-                    SET grade = %s,
-                        feedback = %s
-                    WHERE submission_id = %s
+                    SET grade = %(grade)s,
+                        score = grade_to_score(%(grade)s),
+                        feedback = %(feedback)s
+                    WHERE submission_id = %(submission_id)s
                     RETURNING *;
-                """, (grade, feedback, submission_id))
+                """, {"grade": grade, "feedback": feedback, "submission_id": submission_id})
 
                 submission = cursor.fetchone()
                 if not submission:
@@ -431,6 +859,7 @@ def update_submission_grade(con, submission_id, grade, feedback):
     except psycopg2.Error as e:
         raise Exception(f"Submission update failed: {e.pgerror}") from e
     
+@timed
 def delete_submission(con, submission_id):
     try:
         with con:
@@ -447,17 +876,173 @@ def delete_submission(con, submission_id):
     except psycopg2.Error as e:
         raise Exception(f"Submission delete failed: {e.pgerror}") from e
 
+# Grade statistics
+# Shared by the assignment and course statistics: `scores` is a CTE with one
+# score column. Everything, including the histogram, comes back in one row
+GRADE_STATS_QUERY = """
+    WITH scores AS ({scores}),
+    buckets AS (
+        SELECT greatest(1, least(%(buckets)s, width_bucket(score, %(low)s, %(high)s, %(buckets)s))) AS bucket,
+               count(*) AS count
+        FROM scores
+        WHERE score IS NOT NULL
+        GROUP BY 1
+    )
+    SELECT count(*) AS submissions,
+           count(score) AS graded,
+           round(avg(score), 2) AS mean,
+           round(stddev_samp(score), 2) AS stddev,
+           min(score) AS min,
+           max(score) AS max,
+           percentile_cont(ARRAY[0.25, 0.5, 0.75, 0.9]) WITHIN GROUP (ORDER BY score) AS percentiles,
+           (
+               SELECT json_agg(json_build_object(
+                   'low', %(low)s + (n - 1) * (%(high)s - %(low)s) / %(buckets)s::numeric,
+                   'high', %(low)s + n * (%(high)s - %(low)s) / %(buckets)s::numeric,
+                   'count', coalesce(buckets.count, 0)
+               ) ORDER BY n)
+               FROM generate_series(1, %(buckets)s) AS n
+               LEFT JOIN buckets ON buckets.bucket = n
+           ) AS histogram
+    FROM scores
+    HAVING EXISTS ({exists});
+"""
+
+def _grade_stats(con, scores, exists, params, low, high, buckets):
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    GRADE_STATS_QUERY.format(scores=scores, exists=exists),
+                    {**params, "low": low, "high": high, "buckets": buckets},
+                )
+                stats = cursor.fetchone()
+                if stats is None:
+                    return None
+                percentiles = stats.pop("percentiles") or [None] * 4
+                stats["p25"], stats["median"], stats["p75"], stats["p90"] = percentiles
+                return stats
+
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+@timed
+def get_assignment_grade_stats(con, assignment_id, low=0, high=100, buckets=10):
+    """Score statistics of one assignment, None if the assignment doesn't exist."""
+    stats = _grade_stats(
+        con,
+        "SELECT score FROM submissions WHERE assignment_id = %(assignment_id)s",
+        "SELECT 1 FROM assignments WHERE assignment_id = %(assignment_id)s",
+        {"assignment_id": assignment_id},
+        low, high, buckets,
+    )
+    if stats is not None:
+        stats["assignment_id"] = assignment_id
+    return stats
+
+@timed
+def get_course_grade_stats(con, course_id, low=0, high=100, buckets=10):
+    """Score statistics over every assignment of a course, None if the course doesn't exist."""
+    stats = _grade_stats(
+        con,
+        """
+        SELECT submissions.score
+        FROM assignments
+        JOIN submissions ON submissions.assignment_id = assignments.assignment_id
+        WHERE assignments.course_id = %(course_id)s
+        """,
+        "SELECT 1 FROM courses WHERE course_id = %(course_id)s",
+        {"course_id": course_id},
+        low, high, buckets,
+    )
+    if stats is not None:
+        stats["course_id"] = course_id
+    return stats
+
+# Enrolled students who haven't submitted an assignment whose due date has
+# passed, or whose first submission came in after it. The LATERAL probe
+# reads at most one row from submissions_assignment_student_idx per
+# (assignment, student); missing is the anti-join side where it finds none
+SUBMISSION_REPORT_QUERY = """
+    SELECT a.assignment_id,
+           a.title AS assignment_title,
+           a.due_date,
+           e.user_id AS student_id,
+           u.username,
+           u.email,
+           CASE WHEN first.submission_id IS NULL THEN 'missing' ELSE 'late' END AS status,
+           first.submission_id,
+           first.submitted_at
+    FROM assignments a
+    JOIN enrollments e ON e.course_id = a.course_id
+    JOIN users u ON u.user_id = e.user_id
+    LEFT JOIN LATERAL (
+        SELECT s.submission_id, s.submitted_at
+        FROM submissions s
+        WHERE s.assignment_id = a.assignment_id AND s.student_id = e.user_id
+        ORDER BY s.submitted_at
+        LIMIT 1
+    ) first ON true
+    WHERE {where}
+      AND a.due_date IS NOT NULL
+      AND CASE WHEN first.submission_id IS NULL THEN %(missing)s AND a.due_date < now()
+               ELSE %(late)s AND first.submitted_at > a.due_date
+          END
+    ORDER BY a.due_date, a.assignment_id, e.user_id
+    LIMIT %(limit)s OFFSET %(offset)s;
+"""
+
+def _submission_report_params(status, limit, offset, **params):
+    # status None reports both; a None limit is LIMIT NULL, i.e. no limit
+    return {
+        **params,
+        "missing": status in (None, "missing"),
+        "late": status in (None, "late"),
+        "limit": limit,
+        "offset": offset,
+    }
+
+def _submission_report(con, where, params):
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(SUBMISSION_REPORT_QUERY.format(where=where), params)
+                return cursor.fetchall()
+
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+@timed
+def get_course_submission_report(con, course_id, status=None, limit=100, offset=0):
+    """Missing and late submissions over all assignments of a course, oldest due date first."""
+    return _submission_report(
+        con, "a.course_id = %(course_id)s",
+        _submission_report_params(status, limit, offset, course_id=course_id),
+    )
+
+@timed
+def get_assignment_submission_report(con, assignment_id, status=None, limit=100, offset=0):
+    """Missing and late submissions of one assignment."""
+    return _submission_report(
+        con, "a.assignment_id = %(assignment_id)s",
+        _submission_report_params(status, limit, offset, assignment_id=assignment_id),
+    )
+
 # -------------------------------------------
 # LESSONS
 # -------------------------------------------
+# Every column but search_vector, which is only used by search_content
+LESSON_COLUMNS = "lesson_id, course_id, title, description, scheduled_at, duration_minutes, location"
+
+@timed
 def create_lesson(con, course_id, title, description, scheduled_at, duration_minutes, location):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("""
+                cursor.execute(f"""
                     INSERT INTO lessons (course_id, title, description, scheduled_at, duration_minutes, location)
                     VALUES (%s, %s, %s, %s, %s, %s)
-                    RETURNING *;
+                    RETURNING {LESSON_COLUMNS};
                 """, (course_id, title, description, scheduled_at, duration_minutes, location))
                 return cursor.fetchone()
 
@@ -466,12 +1051,13 @@ def create_lesson(con, course_id, title, description, scheduled_at, duration_min
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def get_lesson(con, lesson_id):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(
-                    "SELECT * FROM lessons WHERE lesson_id = %s;",
+                    f"SELECT {LESSON_COLUMNS} FROM lessons WHERE lesson_id = %s;",
                     (lesson_id,)
                 )
                 return cursor.fetchone()
@@ -479,12 +1065,13 @@ def get_lesson(con, lesson_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def get_lessons_by_course(con, course_id):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(
-                    "SELECT * FROM lessons WHERE course_id = %s ORDER BY scheduled_at ASC;",
+                    f"SELECT {LESSON_COLUMNS} FROM lessons WHERE course_id = %s ORDER BY scheduled_at ASC;",
                     (course_id,)
                 )
                 return cursor.fetchall()
@@ -492,11 +1079,12 @@ def get_lessons_by_course(con, course_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def update_lesson(con, lesson_id, course_id, title, description, scheduled_at, duration_minutes, location):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("""
+                cursor.execute(f"""
                     UPDATE lessons
                     SET course_id = %s,
                         title = %s,
@@ -505,7 +1093,7 @@ def update_lesson(con, lesson_id, course_id, title, description, scheduled_at, d
                         duration_minutes = %s,
                         location = %s
                     WHERE lesson_id = %s
-                    RETURNING *;
+                    RETURNING {LESSON_COLUMNS};
                 """, (course_id, title, description, scheduled_at, duration_minutes, location, lesson_id))
 
                 lesson = cursor.fetchone()
@@ -516,12 +1104,13 @@ def update_lesson(con, lesson_id, course_id, title, description, scheduled_at, d
     except psycopg2.Error as e:
         raise Exception(f"Lesson update failed: {e.pgerror}") from e
 
+@timed
 def delete_lesson(con, lesson_id):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(
-                    "DELETE FROM lessons WHERE lesson_id = %s RETURNING *;",
+                    f"DELETE FROM lessons WHERE lesson_id = %s RETURNING {LESSON_COLUMNS};",
                     (lesson_id,)
                 )
                 lesson = cursor.fetchone()
@@ -535,14 +1124,18 @@ def delete_lesson(con, lesson_id):
 # -------------------------------------------
 # RESOURCES
 # -------------------------------------------
+# Every column but search_vector, which is only used by search_content
+RESOURCE_COLUMNS = "resource_id, course_id, lesson_id, title, type, url, uploaded_at"
+
+@timed
 def create_resource(con, course_id, lesson_id, title, type, url):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("""
+                cursor.execute(f"""
                     INSERT INTO resources (course_id, lesson_id, title, type, url)
                     VALUES (%s, %s, %s, %s, %s)
-                    RETURNING *;
+                    RETURNING {RESOURCE_COLUMNS};
                 """, (course_id, lesson_id, title, type, url))
                 return cursor.fetchone()
 
@@ -551,12 +1144,13 @@ def create_resource(con, course_id, lesson_id, title, type, url):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def get_resource(con, resource_id):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(
-                    "SELECT * FROM resources WHERE resource_id = %s;",
+                    f"SELECT {RESOURCE_COLUMNS} FROM resources WHERE resource_id = %s;",
                     (resource_id,)
                 )
                 return cursor.fetchone()
@@ -564,12 +1158,13 @@ def get_resource(con, resource_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
 
+@timed
 def get_resources_by_course(con, course_id):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(
-                    "SELECT * FROM resources WHERE course_id = %s ORDER BY uploaded_at DESC;",
+                    f"SELECT {RESOURCE_COLUMNS} FROM resources WHERE course_id = %s ORDER BY uploaded_at DESC;",
                     (course_id,)
                 )
                 return cursor.fetchall()
@@ -577,12 +1172,13 @@ def get_resources_by_course(con, course_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
     
+@timed
 def get_resources_by_lesson(con, lesson_id):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(
-                    "SELECT * FROM resources WHERE lesson_id = %s ORDER BY uploaded_at DESC;",
+                    f"SELECT {RESOURCE_COLUMNS} FROM resources WHERE lesson_id = %s ORDER BY uploaded_at DESC;",
                     (lesson_id,)
                 )
                 return cursor.fetchall()
@@ -590,11 +1186,12 @@ def get_resources_by_lesson(con, lesson_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
     
+@timed
 def update_resource(con, resource_id, course_id, lesson_id, title, type, url, uploaded_at):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("""
+                cursor.execute(f"""
                     UPDATE resources
                     SET course_id = %s,
                         lesson_id = %s,
@@ -603,7 +1200,7 @@ def update_resource(con, resource_id, course_id, lesson_id, title, type, url, up
                         url = %s,
                         uploaded_at = %s
                     WHERE resource_id = %s
-                    RETURNING *;
+                    RETURNING {RESOURCE_COLUMNS};
                 """, (course_id, lesson_id, title, type, url, uploaded_at, resource_id))
 
                 resource = cursor.fetchone()
@@ -614,12 +1211,13 @@ def update_resource(con, resource_id, course_id, lesson_id, title, type, url, up
     except psycopg2.Error as e:
         raise Exception(f"Resource update failed: {e.pgerror}") from e
     
+@timed
 def delete_resource(con, resource_id):
     try:
         with con:
             with con.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(
-                    "DELETE FROM resources WHERE resource_id = %s RETURNING *;",
+                    f"DELETE FROM resources WHERE resource_id = %s RETURNING {RESOURCE_COLUMNS};",
                     (resource_id,)
                 )
                 resource = cursor.fetchone()
@@ -633,6 +1231,7 @@ def delete_resource(con, resource_id):
 # -------------------------------------------
 # ATTENDANCE
 # -------------------------------------------
+@timed
 def create_attendance(con, lesson_id, student_id, status, url):
     try:
         with con:
@@ -649,6 +1248,7 @@ def create_attendance(con, lesson_id, student_id, status, url):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
     
+@timed
 def get_attendance(con, attendance_id):
     try:
         with con:
@@ -662,6 +1262,7 @@ def get_attendance(con, attendance_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
     
+@timed
 def get_attendance_by_lesson(con, lesson_id):
     try:
         with con:
@@ -675,6 +1276,7 @@ def get_attendance_by_lesson(con, lesson_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
     
+@timed
 def get_attendance_by_student(con, student_id):
     try:
         with con:
@@ -688,6 +1290,7 @@ def get_attendance_by_student(con, student_id):
     except psycopg2.Error as e:
         raise Exception(f"Database error: {e.pgerror}") from e
     
+@timed
 def update_attendance(con, attendance_id, lesson_id, student_id, status, url, recorded_at, uploaded_at):
     try:
         with con:
@@ -712,6 +1315,7 @@ def update_attendance(con, attendance_id, lesson_id, student_id, status, url, re
     except psycopg2.Error as e:
         raise Exception(f"Attendance update failed: {e.pgerror}") from e
     
+@timed
 def delete_attendance(con, attendance_id):
     try:
         with con:
@@ -726,4 +1330,230 @@ def delete_attendance(con, attendance_id):
                 return attendance
 
     except psycopg2.Error as e:
-        raise Exception(f"Attendance delete failed: {e.pgerror}") from e
\ No newline at end of file
+        raise Exception(f"Attendance delete failed: {e.pgerror}") from e
+
+# Attendance rates come from attendance_rollup (see db_setup.py), which the
+# attendance triggers keep current. Late counts as attended.
+def _attendance_rate(present, absent, late):
+    total = present + absent + late
+    return {
+        "present": present,
+        "absent": absent,
+        "late": late,
+        "total": total,
+        "rate": round((present + late) / total, 4) if total else None,
+    }
+
+def _attendance_rates(con, query, owner_id, key):
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(query, (owner_id,))
+                rows = cursor.fetchall()
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+    # No row at all: the student or course doesn't exist. One row with a
+    # NULL key: it exists but has no attendance yet
+    if not rows:
+        return None
+    rows = [row for row in rows if row[key] is not None]
+    summary = _attendance_rate(
+        sum(row["present"] for row in rows),
+        sum(row["absent"] for row in rows),
+        sum(row["late"] for row in rows),
+    )
+    summary["items"] = [
+        {key: row[key], **_attendance_rate(row["present"], row["absent"], row["late"])}
+        for row in rows
+    ]
+    return summary
+
+@timed
+def get_student_attendance_rates(con, student_id):
+    """Attendance rate of a student overall and per course, None if the user doesn't exist."""
+    rates = _attendance_rates(con, """
+        SELECT r.course_id, r.present, r.absent, r.late
+        FROM users u
+        LEFT JOIN attendance_rollup r ON r.student_id = u.user_id
+        WHERE u.user_id = %s
+        ORDER BY r.course_id;
+    """, student_id, "course_id")
+    if rates is not None:
+        rates["student_id"] = student_id
+        rates["courses"] = rates.pop("items")
+    return rates
+
+@timed
+def get_course_attendance_rates(con, course_id):
+    """Attendance rate of a course overall and per student, None if the course doesn't exist."""
+    rates = _attendance_rates(con, """
+        SELECT r.student_id, r.present, r.absent, r.late
+        FROM courses c
+        LEFT JOIN attendance_rollup r ON r.course_id = c.course_id
+        WHERE c.course_id = %s
+        ORDER BY r.student_id;
+    """, course_id, "student_id")
+    if rates is not None:
+        rates["course_id"] = course_id
+        rates["students"] = rates.pop("items")
+    return rates
+
+# -------------------------------------------
+# SEARCH
+# -------------------------------------------
+# One SELECT per searchable table over its generated search_vector column
+# (GIN-indexed, see db_setup.py). {query} is the tsquery expression
+SEARCH_SOURCES = {
+    "course": """
+        SELECT 'course' AS kind, course_id AS id, course_id, title,
+               ts_rank(search_vector, {query}) AS rank
+        FROM courses
+        WHERE search_vector @@ {query}
+    """,
+    "lesson": """
+        SELECT 'lesson' AS kind, lesson_id AS id, course_id, title,
+               ts_rank(search_vector, {query}) AS rank
+        FROM lessons
+        WHERE search_vector @@ {query}
+    """,
+    "resource": """
+        SELECT 'resource' AS kind, resource_id AS id, course_id, title,
+               ts_rank(search_vector, {query}) AS rank
+        FROM resources
+        WHERE search_vector @@ {query}
+    """,
+}
+
+_SEARCH_WORD = re.compile(r"\w+")
+
+# Every word but the last must match; the last one is a prefix for search
+# as you type. It's also looked up unstemmed with the 'simple' config,
+# because 'english' drops stop words, so typing "no" would not find "notes"
+PREFIX_QUERY = (
+    "(to_tsquery('english', %(words)s)"
+    " && (to_tsquery('english', %(last)s) || to_tsquery('simple', %(last)s)))"
+)
+
+def prefix_tsquery(text):
+    """
+    to_tsquery() input for the complete words of `text` and for its last
+    word as a prefix ('intro' finds 'introduction'). Only word characters
+    are kept, so tsquery operators in the input can't cause syntax
+    errors. None if there are no words.
+    """
+    words = _SEARCH_WORD.findall(text)
+    if not words:
+        return None
+    return " & ".join(words[:-1]), words[-1] + ":*"
+
+@timed
+def search_content(con, text, kinds=None, prefix=False, limit=20, offset=0):
+    """
+    Courses, lessons and resources matching `text`, best match first.
+
+    Without `prefix` the text is read by websearch_to_tsquery(), so "quoted
+    phrases", `or` and `-word` work. `kinds` limits the search to some of
+    "course", "lesson" and "resource".
+    """
+    params = {"text": text, "limit": limit, "offset": offset}
+    if prefix:
+        terms = prefix_tsquery(text)
+        if terms is None:
+            return []
+        params["words"], params["last"] = terms
+        query = PREFIX_QUERY
+    else:
+        query = "websearch_to_tsquery('english', %(text)s)"
+    # dict.fromkeys drops repeated kinds, which would return every hit twice
+    sources = " UNION ALL ".join(
+        SEARCH_SOURCES[kind].format(query=query) for kind in dict.fromkeys(kinds or SEARCH_SOURCES)
+    )
+    try:
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(f"""
+                    SELECT kind, id, course_id, title, rank
+                    FROM ({sources}) AS hits
+                    ORDER BY rank DESC, kind, id
+                    LIMIT %(limit)s OFFSET %(offset)s;
+                """, params)
+                return cursor.fetchall()
+
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+# -------------------------------------------
+# BULK READS
+# -------------------------------------------
+# These use a server-side cursor and hand out plain tuples in batches, so
+# large exports never build one dict per row. Every generator yields at least
+# one (description, rows) pair, which lets callers build a schema even when
+# there are no rows.
+BULK_BATCH_SIZE = 10000
+
+def _stream_batches(con, query, params, batch_size=BULK_BATCH_SIZE):
+    try:
+        with con:
+            with con.cursor(name="bulk_read") as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(query, params)
+                rows = cursor.fetchmany(batch_size)
+                yield cursor.description, rows
+                while len(rows) == batch_size:
+                    rows = cursor.fetchmany(batch_size)
+                    if rows:
+                        yield cursor.description, rows
+
+    except psycopg2.Error as e:
+        raise Exception(f"Database error: {e.pgerror}") from e
+
+@timed_stream
+def stream_submissions_by_assignment(con, assignment_id, batch_size=BULK_BATCH_SIZE):
+    return _stream_batches(con, """
+        SELECT submission_id, assignment_id, student_id, submitted_at, url, grade, score, feedback
+        FROM submissions
+        WHERE assignment_id = %s
+        ORDER BY submission_id;
+    """, (assignment_id,), batch_size)
+
+@timed_stream
+def stream_course_submission_report(con, course_id, status=None, limit=None, offset=0, batch_size=BULK_BATCH_SIZE):
+    return _stream_batches(
+        con, SUBMISSION_REPORT_QUERY.format(where="a.course_id = %(course_id)s"),
+        _submission_report_params(status, limit, offset, course_id=course_id), batch_size,
+    )
+
+@timed_stream
+def stream_assignment_submission_report(con, assignment_id, status=None, limit=None, offset=0, batch_size=BULK_BATCH_SIZE):
+    return _stream_batches(
+        con, SUBMISSION_REPORT_QUERY.format(where="a.assignment_id = %(assignment_id)s"),
+        _submission_report_params(status, limit, offset, assignment_id=assignment_id), batch_size,
+    )
+
+@timed_stream
+def stream_submissions_by_student(con, student_id, batch_size=BULK_BATCH_SIZE):
+    return _stream_batches(con, """
+        SELECT submission_id, assignment_id, student_id, submitted_at, url, grade, score, feedback
+        FROM submissions
+        WHERE student_id = %s
+        ORDER BY submission_id;
+    """, (student_id,), batch_size)
+
+@timed_stream
+def stream_attendance_by_lesson(con, lesson_id, batch_size=BULK_BATCH_SIZE):
+    return _stream_batches(con, """
+        SELECT attendance_id, lesson_id, student_id, status, recorded_at, url, uploaded_at
+        FROM attendance
+        WHERE lesson_id = %s
+        ORDER BY recorded_at ASC;
+    """, (lesson_id,), batch_size)
+
+@timed_stream
+def stream_attendance_by_student(con, student_id, batch_size=BULK_BATCH_SIZE):
+    return _stream_batches(con, """
+        SELECT attendance_id, lesson_id, student_id, status, recorded_at, url, uploaded_at
+        FROM attendance
+        WHERE student_id = %s
+        ORDER BY recorded_at ASC;
+    """, (student_id,), batch_size)
@@ -1,28 +1,140 @@
+import argparse
+import json
+import logging
 import os
+import sys
+from time import perf_counter
 
 import psycopg2
 from dotenv import load_dotenv
 
+from conntrack import CONNECTION_DIAGNOSTICS, track
+from querylog import QueryLogConnection
+from server_timing import record_connect
+
 load_dotenv(override=True)
 
+logger = logging.getLogger(__name__)
+
 # Passing pasword and database url into variables
 DATABASE_NAME = os.getenv("DATABASE_NAME") 
 PASSWORD = os.getenv("PASSWORD")
 
-def get_connection():
+# How many connections the API may have open at the same time.
+# Keep this well below Postgres' max_connections (100 by default)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+
+# Rows per course in course_stats. Every enrollment, lesson, assignment or
+# resource write bumps one of them, so with 1 all writers of a course queue
+# on the same row. More shards spread popular courses over several rows,
+# reads add them up. Run `python db_setup.py` again after changing it
+COURSE_STATS_SHARDS = int(os.getenv("COURSE_STATS_SHARDS", "1"))
+
+def get_connection(connection_factory=QueryLogConnection):
     """
     Function that returns a single connection
     In reality, we might use a connection pool, since
     this way we'll start a new connection each time
     someone hits one of our endpoints, which isn't great for performance
+
+    By default the connection reports slow statements to the slow-query
+    log (see querylog.py), pass another connection_factory to opt out.
+    With CONNECTION_DIAGNOSTICS=1 such connections are also tracked until
+    they are closed (see conntrack.py).
     """
-    return psycopg2.connect(
+    started = perf_counter()
+    connection = psycopg2.connect(
         dbname=DATABASE_NAME,
         user="postgres",  
         password=PASSWORD,
         host="localhost",  
         port="5432",  
+        connection_factory=connection_factory,
+    )
+    record_connect(perf_counter() - started)
+    if CONNECTION_DIAGNOSTICS and isinstance(connection, QueryLogConnection):
+        track(connection)
+    return connection
+
+# Adds ({sign}) the attendance rows in the transition table {rows} to the
+# rollup. Sorted, so concurrent statements lock rollup rows in the same order
+ATTENDANCE_ROLLUP_UPSERT = """
+            INSERT INTO attendance_rollup AS r (course_id, student_id, present, absent, late)
+            SELECT l.course_id, a.student_id,
+                   {sign}count(*) FILTER (WHERE a.status = 'present'),
+                   {sign}count(*) FILTER (WHERE a.status = 'absent'),
+                   {sign}count(*) FILTER (WHERE a.status = 'late')
+            FROM {rows} a
+            JOIN lessons l ON l.lesson_id = a.lesson_id
+            GROUP BY l.course_id, a.student_id
+            ORDER BY l.course_id, a.student_id
+            ON CONFLICT (course_id, student_id) DO UPDATE SET
+                present = r.present + EXCLUDED.present,
+                absent = r.absent + EXCLUDED.absent,
+                late = r.late + EXCLUDED.late;"""
+
+ATTENDANCE_ROLLUP_REBUILD = """
+    DELETE FROM attendance_rollup;
+    INSERT INTO attendance_rollup (course_id, student_id, present, absent, late)
+    SELECT l.course_id, a.student_id,
+           count(*) FILTER (WHERE a.status = 'present'),
+           count(*) FILTER (WHERE a.status = 'absent'),
+           count(*) FILTER (WHERE a.status = 'late')
+    FROM attendance a
+    JOIN lessons l ON l.lesson_id = a.lesson_id
+    GROUP BY l.course_id, a.student_id;
+"""
+
+# The counters in course_stats, each named after the table it counts
+COURSE_STATS_COUNTERS = ("enrollments", "lessons", "assignments", "resources")
+
+# Adds ({sign}) the rows of the transition table {rows} to {counter}, on a
+# random one of the course's shards
+COURSE_STATS_UPSERT = """
+            INSERT INTO course_stats AS s (course_id, shard, {counter})
+            SELECT course_id, floor(random() * %d)::SMALLINT, {sign}count(*)
+            FROM {rows}
+            GROUP BY course_id
+            ORDER BY course_id
+            ON CONFLICT (course_id, shard) DO UPDATE SET {counter} = s.{counter} + EXCLUDED.{counter};""" % COURSE_STATS_SHARDS
+
+COURSE_STATS_REBUILD = """
+    DELETE FROM course_stats;
+    INSERT INTO course_stats (course_id, shard, enrollments, lessons, assignments, resources)
+    SELECT c.course_id, 0,
+           (SELECT count(*) FROM enrollments WHERE enrollments.course_id = c.course_id),
+           (SELECT count(*) FROM lessons WHERE lessons.course_id = c.course_id),
+           (SELECT count(*) FROM assignments WHERE assignments.course_id = c.course_id),
+           (SELECT count(*) FROM resources WHERE resources.course_id = c.course_id)
+    FROM courses c;
+"""
+
+# Courses whose summed counters differ from the real row counts
+COURSE_STATS_VERIFY = """
+    WITH stored AS (
+        SELECT course_id, sum(enrollments) AS enrollments, sum(lessons) AS lessons,
+               sum(assignments) AS assignments, sum(resources) AS resources
+        FROM course_stats
+        GROUP BY course_id
+    ), actual AS (
+        SELECT c.course_id,
+               (SELECT count(*) FROM enrollments WHERE enrollments.course_id = c.course_id) AS enrollments,
+               (SELECT count(*) FROM lessons WHERE lessons.course_id = c.course_id) AS lessons,
+               (SELECT count(*) FROM assignments WHERE assignments.course_id = c.course_id) AS assignments,
+               (SELECT count(*) FROM resources WHERE resources.course_id = c.course_id) AS resources
+        FROM courses c
     )
+    SELECT a.course_id,
+           json_build_object('enrollments', s.enrollments, 'lessons', s.lessons,
+                             'assignments', s.assignments, 'resources', s.resources) AS stored,
+           json_build_object('enrollments', a.enrollments, 'lessons', a.lessons,
+                             'assignments', a.assignments, 'resources', a.resources) AS actual
+    FROM actual a
+    LEFT JOIN stored s ON s.course_id = a.course_id
+    WHERE (coalesce(s.enrollments, 0), coalesce(s.lessons, 0), coalesce(s.assignments, 0), coalesce(s.resources, 0))
+       <> (a.enrollments, a.lessons, a.assignments, a.resources)
+    ORDER BY a.course_id;
+"""
 
 # Table structure
 def create_tables():
@@ -82,6 +194,28 @@ def create_tables():
     );
     """
 
+    # Read state per (user, conversation partner). unread_count is kept up to
+    # date by create_message and reset when the user marks the conversation read
+    conversation_reads_table ="""
+    CREATE TABLE IF NOT EXISTS conversation_reads(
+        user_id INT NOT NULL REFERENCES users(user_id),
+        partner_id INT NOT NULL REFERENCES users(user_id),
+        unread_count INT NOT NULL DEFAULT 0,
+        last_read_message_id INT,
+        read_at TIMESTAMPTZ,
+        PRIMARY KEY (user_id, partner_id)
+    );
+    """
+
+    # create_message keeps a row for both sides of every pair, which
+    # get_conversations uses as the partner list. Adds the sender side for
+    # messages written before that, a no-op once it has run
+    conversation_reads_backfill = """
+    INSERT INTO conversation_reads (user_id, partner_id)
+    SELECT DISTINCT sender_id, receiver_id FROM messages
+    ON CONFLICT (user_id, partner_id) DO NOTHING;
+    """
+
     submissions_table ="""
     CREATE TABLE IF NOT EXISTS submissions(
         submission_id SERIAL PRIMARY KEY,
@@ -94,6 +228,44 @@ def create_tables():
     );
     """
 
+    # Numeric form of submissions.grade, so grade statistics can be computed
+    # in SQL. Kept in sync by update_submission_grade via grade_to_score()
+    submissions_score_column = """
+    ALTER TABLE submissions ADD COLUMN IF NOT EXISTS score NUMERIC(5,2);
+    """
+
+    # Letter grades and the score they count as. Numeric grades such as "87"
+    # or "87.5%" are used as they are. Edit the rows to use another scale
+    grade_scale_table ="""
+    CREATE TABLE IF NOT EXISTS grade_scale(
+        grade VARCHAR(20) PRIMARY KEY,
+        score NUMERIC(5,2) NOT NULL
+    );
+    INSERT INTO grade_scale (grade, score) VALUES
+        ('A+', 98), ('A', 95), ('A-', 91),
+        ('B+', 88), ('B', 85), ('B-', 81),
+        ('C+', 78), ('C', 75), ('C-', 71),
+        ('D+', 68), ('D', 65), ('D-', 61),
+        ('F', 50)
+    ON CONFLICT (grade) DO NOTHING;
+    """
+
+    grade_to_score_function = r"""
+    CREATE OR REPLACE FUNCTION grade_to_score(grade TEXT) RETURNS NUMERIC AS $$
+        SELECT CASE
+            WHEN grade ~ '^\s*\d{1,3}(\.\d{1,2})?\s*%?\s*$'
+                THEN rtrim(btrim(grade), '% ')::NUMERIC
+            ELSE (SELECT score FROM grade_scale WHERE grade_scale.grade = upper(btrim(grade_to_score.grade)))
+        END;
+    $$ LANGUAGE sql STABLE;
+    """
+
+    # Fills in scores for submissions graded before the column existed
+    submissions_score_backfill = """
+    UPDATE submissions SET score = grade_to_score(grade)
+    WHERE score IS NULL AND grade IS NOT NULL;
+    """
+
     resources_table ="""
     CREATE TABLE IF NOT EXISTS resources(
         resource_id SERIAL PRIMARY KEY,
@@ -130,6 +302,240 @@ def create_tables():
     );
     """
 
+    # Attendance counts per (course, student), kept up to date by the
+    # triggers below so attendance rates don't have to scan attendance
+    attendance_rollup_table = """
+    CREATE TABLE IF NOT EXISTS attendance_rollup(
+        course_id INT NOT NULL,
+        student_id INT NOT NULL,
+        present INT NOT NULL DEFAULT 0,
+        absent INT NOT NULL DEFAULT 0,
+        late INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (course_id, student_id)
+    );
+    CREATE INDEX IF NOT EXISTS attendance_rollup_student_id_idx ON attendance_rollup (student_id);
+    """
+
+    # Statement-level, so a bulk insert adds one aggregated row per
+    # (course, student) instead of one upsert per attendance row
+    attendance_rollup_triggers = f"""
+    CREATE OR REPLACE FUNCTION attendance_rollup_apply() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            {ATTENDANCE_ROLLUP_UPSERT.format(rows="old_rows", sign="-")}
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            {ATTENDANCE_ROLLUP_UPSERT.format(rows="new_rows", sign="+")}
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS attendance_rollup_insert ON attendance;
+    CREATE TRIGGER attendance_rollup_insert AFTER INSERT ON attendance
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION attendance_rollup_apply();
+    DROP TRIGGER IF EXISTS attendance_rollup_update ON attendance;
+    CREATE TRIGGER attendance_rollup_update AFTER UPDATE ON attendance
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION attendance_rollup_apply();
+    DROP TRIGGER IF EXISTS attendance_rollup_delete ON attendance;
+    CREATE TRIGGER attendance_rollup_delete AFTER DELETE ON attendance
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION attendance_rollup_apply();
+
+    -- A lesson moved to another course takes its attendance with it
+    CREATE OR REPLACE FUNCTION attendance_rollup_move_lessons() RETURNS trigger AS $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM old_rows o JOIN new_rows n ON n.lesson_id = o.lesson_id
+            WHERE n.course_id <> o.course_id
+        ) THEN
+            RETURN NULL;
+        END IF;
+        INSERT INTO attendance_rollup AS r (course_id, student_id, present, absent, late)
+        SELECT moved.course_id, a.student_id,
+               coalesce(sum(moved.sign) FILTER (WHERE a.status = 'present'), 0),
+               coalesce(sum(moved.sign) FILTER (WHERE a.status = 'absent'), 0),
+               coalesce(sum(moved.sign) FILTER (WHERE a.status = 'late'), 0)
+        FROM (
+            SELECT o.lesson_id, o.course_id, -1 AS sign
+            FROM old_rows o JOIN new_rows n ON n.lesson_id = o.lesson_id
+            WHERE n.course_id <> o.course_id
+            UNION ALL
+            SELECT n.lesson_id, n.course_id, 1
+            FROM old_rows o JOIN new_rows n ON n.lesson_id = o.lesson_id
+            WHERE n.course_id <> o.course_id
+        ) moved
+        JOIN attendance a ON a.lesson_id = moved.lesson_id
+        GROUP BY moved.course_id, a.student_id
+        ORDER BY moved.course_id, a.student_id
+        ON CONFLICT (course_id, student_id) DO UPDATE SET
+            present = r.present + EXCLUDED.present,
+            absent = r.absent + EXCLUDED.absent,
+            late = r.late + EXCLUDED.late;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS attendance_rollup_lessons_update ON lessons;
+    CREATE TRIGGER attendance_rollup_lessons_update AFTER UPDATE ON lessons
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION attendance_rollup_move_lessons();
+    """
+
+    # Enrollment, lesson, assignment and resource counts per course, split
+    # over COURSE_STATS_SHARDS rows. A course's counts are the sum of its rows
+    course_stats_table = """
+    CREATE TABLE IF NOT EXISTS course_stats(
+        course_id INT NOT NULL REFERENCES courses(course_id) ON DELETE CASCADE,
+        shard SMALLINT NOT NULL DEFAULT 0,
+        enrollments BIGINT NOT NULL DEFAULT 0,
+        lessons BIGINT NOT NULL DEFAULT 0,
+        assignments BIGINT NOT NULL DEFAULT 0,
+        resources BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (course_id, shard)
+    );
+    """
+
+    # One function per counted table, each runs once per statement like the
+    # attendance rollup
+    course_stats_triggers = "".join(f"""
+    CREATE OR REPLACE FUNCTION course_stats_{table}() RETURNS trigger AS $$
+    BEGIN
+        -- Updates that moved no row to another course change no count
+        IF TG_OP = 'UPDATE' THEN
+            IF NOT EXISTS (SELECT course_id FROM new_rows EXCEPT ALL SELECT course_id FROM old_rows) THEN
+                RETURN NULL;
+            END IF;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            {COURSE_STATS_UPSERT.format(counter=table, sign="-", rows="old_rows")}
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            {COURSE_STATS_UPSERT.format(counter=table, sign="", rows="new_rows")}
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS course_stats_insert ON {table};
+    CREATE TRIGGER course_stats_insert AFTER INSERT ON {table}
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION course_stats_{table}();
+    DROP TRIGGER IF EXISTS course_stats_update ON {table};
+    CREATE TRIGGER course_stats_update AFTER UPDATE ON {table}
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION course_stats_{table}();
+    DROP TRIGGER IF EXISTS course_stats_delete ON {table};
+    CREATE TRIGGER course_stats_delete AFTER DELETE ON {table}
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION course_stats_{table}();
+    """ for table in COURSE_STATS_COUNTERS)
+
+    # Full-text search. The tsvectors are generated columns, so every write
+    # keeps them current; title words weigh more (A) than descriptions (B)
+    # and lesson locations or resource types (C)
+    search_columns = """
+    ALTER TABLE courses ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED;
+    ALTER TABLE lessons ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(location, '')), 'C')
+    ) STORED;
+    ALTER TABLE resources ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(type, '')), 'C')
+    ) STORED;
+    """
+
+    search_indexes = """
+    CREATE INDEX IF NOT EXISTS courses_search_idx ON courses USING GIN (search_vector);
+    CREATE INDEX IF NOT EXISTS lessons_search_idx ON lessons USING GIN (search_vector);
+    CREATE INDEX IF NOT EXISTS resources_search_idx ON resources USING GIN (search_vector);
+    """
+
+    # Full-text search over a user's own messages. With btree_gin a GIN index
+    # can hold the participant column next to the tsvector, so a search for
+    # one user's messages is a single index scan per direction. Without it
+    # the plain GIN index is combined with the btree participant indexes
+    messages_search_column = """
+    ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        to_tsvector('english', coalesce(content, ''))
+    ) STORED;
+    """
+
+    messages_search_indexes = """
+    CREATE EXTENSION IF NOT EXISTS btree_gin;
+    CREATE INDEX IF NOT EXISTS messages_sender_search_idx ON messages USING GIN (sender_id, search_vector);
+    CREATE INDEX IF NOT EXISTS messages_receiver_search_idx ON messages USING GIN (receiver_id, search_vector);
+    DROP INDEX IF EXISTS messages_search_idx;
+    """
+
+    messages_search_fallback_index = """
+    CREATE INDEX IF NOT EXISTS messages_search_idx ON messages USING GIN (search_vector);
+    """
+
+    # Trigram index for partial username/email lookups (GET /users/search).
+    # It serves both ILIKE '%...%' and the word-similarity operator. The
+    # expression must match USER_SEARCH_TEXT in db.py. Replaces the older
+    # per-column indexes.
+    # pg_trgm declares the <% operator as cheap as an integer comparison, but
+    # a call takes microseconds. With that cost a LIMITed seq scan looked
+    # cheaper than the index for rare terms and ran word_similarity() over
+    # most of the table
+    users_search_indexes = """
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS users_search_trgm_idx ON users USING GIN ((username || ' ' || email) gin_trgm_ops);
+    DROP INDEX IF EXISTS users_username_trgm_idx, users_email_trgm_idx;
+    ALTER FUNCTION word_similarity_op(text, text) COST 100;
+    ALTER FUNCTION word_similarity_commutator_op(text, text) COST 100;
+    """
+
+    # Indexes
+    # Both directions of a conversation, newest first. Used by the message
+    # history and to find the latest message per conversation for the inbox
+    messages_indexes = """
+    CREATE INDEX IF NOT EXISTS messages_sender_receiver_sent_at_idx
+        ON messages (sender_id, receiver_id, sent_at DESC);
+    CREATE INDEX IF NOT EXISTS messages_receiver_sender_sent_at_idx
+        ON messages (receiver_id, sender_id, sent_at DESC);
+    """
+
+    # Submissions per assignment, for the submission lists and grade
+    # statistics, and a student's first submission for the late/missing report.
+    # It replaces the earlier assignment_id-only index
+    submissions_indexes = """
+    CREATE INDEX IF NOT EXISTS submissions_assignment_student_idx
+        ON submissions (assignment_id, student_id, submitted_at);
+    DROP INDEX IF EXISTS submissions_assignment_id_idx;
+    """
+
+    # A course's assignments, for the assignment lists and reports
+    assignments_indexes = """
+    CREATE INDEX IF NOT EXISTS assignments_course_id_idx ON assignments (course_id);
+    """
+
+    # UNIQUE (user_id, course_id) can't be used to find a course's enrollees
+    enrollments_indexes = """
+    CREATE INDEX IF NOT EXISTS enrollments_course_id_idx ON enrollments (course_id);
+    """
+
+    # Foreign key lookups behind the per-student, per-lesson and per-course
+    # lists, in the order those lists are returned. They also serve the
+    # foreign key checks when a lesson, course or user is deleted
+    foreign_key_indexes = """
+    CREATE INDEX IF NOT EXISTS attendance_student_recorded_at_idx ON attendance (student_id, recorded_at);
+    CREATE INDEX IF NOT EXISTS attendance_lesson_recorded_at_idx ON attendance (lesson_id, recorded_at);
+    CREATE INDEX IF NOT EXISTS lessons_course_scheduled_at_idx ON lessons (course_id, scheduled_at);
+    CREATE INDEX IF NOT EXISTS resources_course_uploaded_at_idx ON resources (course_id, uploaded_at);
+    CREATE INDEX IF NOT EXISTS resources_lesson_uploaded_at_idx ON resources (lesson_id, uploaded_at);
+    CREATE INDEX IF NOT EXISTS courses_teacher_id_idx ON courses (teacher_id);
+    """
+
     # Creating the tables 
     with connection:
         with connection.cursor() as cursor:
@@ -139,13 +545,131 @@ def create_tables():
             cursor.execute(enrollments_table)
             cursor.execute(assignments_table)
             cursor.execute(messages_table)
+            cursor.execute(conversation_reads_table)
             cursor.execute(submissions_table)
+            cursor.execute(submissions_score_column)
+            cursor.execute(grade_scale_table)
+            cursor.execute(grade_to_score_function)
+            cursor.execute(submissions_score_backfill)
             cursor.execute(resources_table)
             cursor.execute(attendance_table)
+            cursor.execute(attendance_rollup_table)
+            cursor.execute(attendance_rollup_triggers)
+            # First run against existing attendance, fill the rollup once
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM attendance_rollup);")
+            if not cursor.fetchone()[0]:
+                cursor.execute(ATTENDANCE_ROLLUP_REBUILD)
+            cursor.execute(course_stats_table)
+            cursor.execute(course_stats_triggers)
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM course_stats);")
+            if not cursor.fetchone()[0]:
+                cursor.execute(COURSE_STATS_REBUILD)
+            cursor.execute(messages_indexes)
+            cursor.execute(conversation_reads_backfill)
+            cursor.execute(enrollments_indexes)
+            cursor.execute(submissions_indexes)
+            cursor.execute(assignments_indexes)
+            cursor.execute(foreign_key_indexes)
+            cursor.execute(search_columns)
+            cursor.execute(search_indexes)
+            cursor.execute(messages_search_column)
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'btree_gin');")
+            if cursor.fetchone()[0]:
+                cursor.execute(messages_search_indexes)
+            else:
+                cursor.execute(messages_search_fallback_index)
+            # pg_trgm and btree_gin ship with the Postgres contrib package,
+            # which not every install has. Everything but user search works
+            # without it
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm');")
+            if cursor.fetchone()[0]:
+                cursor.execute(users_search_indexes)
+            else:
+                logger.warning("pg_trgm is not available, GET /users/search won't work until it is installed")
 
     if connection:
         connection.close()
 
+def rebuild_attendance_rollup():
+    """
+    Recomputes attendance_rollup from the attendance table.
+
+    Needed after attendance was loaded with the triggers disabled (COPY
+    with session_replication_role = replica) or after lessons moved to
+    another course. Writes to attendance wait until the rebuild commits.
+    Returns the number of rollup rows.
+    """
+    connection = get_connection()
+    try:
+        with connection:
+            with connection.cursor() as cursor:
+                cursor.execute("LOCK TABLE attendance IN SHARE MODE;")
+                cursor.execute(ATTENDANCE_ROLLUP_REBUILD)
+                cursor.execute("SELECT count(*) FROM attendance_rollup;")
+                return cursor.fetchone()[0]
+    finally:
+        connection.close()
+
+def rebuild_course_stats():
+    """
+    Recomputes course_stats from the enrollment, lesson, assignment and
+    resource tables, one row per course. Writes to those tables wait until
+    the rebuild commits. Returns the number of courses.
+    """
+    connection = get_connection()
+    try:
+        with connection:
+            with connection.cursor() as cursor:
+                cursor.execute(f"LOCK TABLE {', '.join(COURSE_STATS_COUNTERS)} IN SHARE MODE;")
+                cursor.execute(COURSE_STATS_REBUILD)
+                cursor.execute("SELECT count(*) FROM course_stats;")
+                return cursor.fetchone()[0]
+    finally:
+        connection.close()
+
+def verify_course_stats():
+    """
+    Compares course_stats with real counts. Returns the courses that
+    differ, each with the stored and the actual counts.
+    """
+    connection = get_connection()
+    try:
+        with connection:
+            with connection.cursor() as cursor:
+                # One snapshot for the counters and the counted tables
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+                cursor.execute(COURSE_STATS_VERIFY)
+                return [
+                    {"course_id": course_id, "stored": stored, "actual": actual}
+                    for course_id, stored, actual in cursor.fetchall()
+                ]
+    finally:
+        connection.close()
+
 if __name__ == "__main__":
-    create_tables()
-    print("Tables created successfully.")
+    parser = argparse.ArgumentParser(description="Creates the tables, or runs one of the maintenance commands.")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("create", help="create the tables (the default)")
+    commands.add_parser("rebuild-attendance", help="recompute attendance_rollup from attendance")
+    commands.add_parser("rebuild-course-stats", help="recompute the course_stats counters")
+    verify = commands.add_parser("verify-course-stats", help="compare course_stats with real counts, exit 1 on a mismatch")
+    verify.add_argument("--fix", action="store_true", help="rebuild course_stats when they differ")
+    args = parser.parse_args()
+
+    if args.command == "rebuild-attendance":
+        rows = rebuild_attendance_rollup()
+        print(f"Attendance rollup rebuilt, {rows} rows.")
+    elif args.command == "rebuild-course-stats":
+        courses = rebuild_course_stats()
+        print(f"Course stats rebuilt, {courses} courses.")
+    elif args.command == "verify-course-stats":
+        mismatches = verify_course_stats()
+        print(json.dumps(mismatches, indent=2))
+        if mismatches and args.fix:
+            courses = rebuild_course_stats()
+            print(f"Course stats rebuilt, {courses} courses.")
+        elif mismatches:
+            sys.exit(1)
+    else:
+        create_tables()
+        print("Tables created successfully.")
@@ -0,0 +1,232 @@
+import functools
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+# Upper bounds of the histogram buckets
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 100000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class Histogram:
+    """One histogram series. observe() is safe to call from any thread."""
+
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class Counter:
+    """One counter series."""
+
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _Family:
+    """A named metric with one series per combination of label values."""
+
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, self._new_series())
+        return series
+
+    def _items(self):
+        with self._lock:
+            return sorted(self._series.items())
+
+
+class HistogramFamily(_Family):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames, buckets):
+        self.buckets = buckets
+        super().__init__(name, help, labelnames)
+
+    def _new_series(self):
+        return Histogram(self.buckets)
+
+    def render(self):
+        for key, series in self._items():
+            labels = list(zip(self.labelnames, key))
+            counts, total, count = series.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(labels + [('le', repr(float(bound)))])} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {count}"
+            yield f"{self.name}_sum{_format_labels(labels)} {total!r}"
+            yield f"{self.name}_count{_format_labels(labels)} {count}"
+
+
+class CounterFamily(_Family):
+    type = "counter"
+
+    def _new_series(self):
+        return Counter()
+
+    def render(self):
+        for key, series in self._items():
+            yield f"{self.name}{_format_labels(zip(self.labelnames, key))} {series.value}"
+
+
+REGISTRY = []
+
+DB_QUERY_SECONDS = HistogramFamily(
+    "db_query_duration_seconds",
+    "Time spent in db.py data-access functions.",
+    ["function"],
+    DURATION_BUCKETS,
+)
+DB_QUERY_ROWS = HistogramFamily(
+    "db_query_rows",
+    "Rows returned by db.py data-access functions.",
+    ["function"],
+    ROW_BUCKETS,
+)
+DB_QUERY_ERRORS = CounterFamily(
+    "db_query_errors_total",
+    "Errors raised by db.py data-access functions, by underlying error type.",
+    ["function", "error"],
+)
+
+
+def _row_count(result):
+    if result is None:
+        return 0
+    if isinstance(result, dict):
+        return 1
+    if isinstance(result, list):
+        return len(result)
+    return 1
+
+
+def _error_name(error):
+    # db.py wraps psycopg2 errors in a plain Exception, the original one is more useful
+    return type(error.__cause__ or error.__context__ or error).__name__
+
+
+def timed(func):
+    """
+    Decorator for db.py functions: records duration, row count and errors.
+
+    The series are looked up once when the function is decorated, so a call
+    only pays for two perf_counter() calls and two histogram updates (see
+    bench/metrics_overhead.py).
+    """
+    name = func.__name__
+    duration = DB_QUERY_SECONDS.labels(function=name)
+    rows = DB_QUERY_ROWS.labels(function=name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            duration.observe(perf_counter() - started)
+            DB_QUERY_ERRORS.labels(function=name, error=_error_name(e)).inc()
+            raise
+        duration.observe(perf_counter() - started)
+        rows.observe(_row_count(result))
+        return result
+
+    return wrapper
+
+
+def timed_stream(func):
+    """
+    Decorator for db.py functions that return a generator of
+    (description, rows) batches, like @timed for a regular function.
+
+    Duration and row count are recorded once, when the generator is
+    exhausted, fails or is closed early. The duration only covers the time
+    spent fetching batches, not the time the caller spends between them,
+    and the row count is the sum of the batch lengths.
+    """
+    name = func.__name__
+    duration = DB_QUERY_SECONDS.labels(function=name)
+    rows = DB_QUERY_ROWS.labels(function=name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        batches = func(*args, **kwargs)
+        spent = 0.0
+        count = 0
+        failed = False
+        try:
+            while True:
+                started = perf_counter()
+                try:
+                    batch = next(batches)
+                except StopIteration:
+                    return
+                finally:
+                    spent += perf_counter() - started
+                count += len(batch[1])
+                yield batch
+        except Exception as e:
+            failed = True
+            DB_QUERY_ERRORS.labels(function=name, error=_error_name(e)).inc()
+            raise
+        finally:
+            batches.close()
+            duration.observe(spent)
+            if not failed:
+                rows.observe(count)
+
+    return wrapper
+
+
+def render_prometheus():
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for family in REGISTRY:
+        lines.append(f"# HELP {family.name} {family.help}")
+        lines.append(f"# TYPE {family.name} {family.type}")
+        lines.extend(family.render())
+    return "\n".join(lines) + "\n"
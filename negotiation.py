@@ -0,0 +1,203 @@
+import csv
+import datetime
+import decimal
+import io
+
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+# Both binary formats are optional, the list routes fall back to JSON without them
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPE = "application/x-msgpack"
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+CSV_TYPE = "text/csv"
+
+# Media types clients use for each format
+_ALIASES = {
+    "application/json": JSON_TYPE,
+    "application/x-msgpack": MSGPACK_TYPE,
+    "application/msgpack": MSGPACK_TYPE,
+    "application/vnd.msgpack": MSGPACK_TYPE,
+    "application/vnd.apache.arrow.stream": ARROW_TYPE,
+    "text/csv": CSV_TYPE,
+}
+
+# Extra OpenAPI documentation for routes that support the binary formats
+BULK_RESPONSES = {
+    200: {
+        "description": "JSON by default, MessagePack, an Arrow IPC stream or CSV when requested in the Accept header",
+        "content": {MSGPACK_TYPE: {}, ARROW_TYPE: {}, CSV_TYPE: {}},
+    },
+}
+
+
+def _available(media_type):
+    if media_type == MSGPACK_TYPE:
+        return msgpack is not None
+    if media_type == ARROW_TYPE:
+        return pa is not None
+    return True
+
+
+def negotiate(accept):
+    """
+    Pick the response format from an Accept header.
+
+    Returns JSON_TYPE, MSGPACK_TYPE, ARROW_TYPE or CSV_TYPE. Wildcards and a missing
+    header mean JSON. Raises a 406 HTTPException when the client only accepts
+    a binary format whose library isn't installed.
+    """
+    if not accept:
+        return JSON_TYPE
+
+    ranges = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            ranges.append((-q, position, media_type.lower()))
+
+    unavailable = None
+    for _, _, media_type in sorted(ranges):
+        if media_type in ("*/*", "application/*"):
+            return JSON_TYPE
+        wanted = _ALIASES.get(media_type)
+        if wanted is None:
+            continue
+        if _available(wanted):
+            return wanted
+        unavailable = unavailable or wanted
+
+    if unavailable is not None:
+        raise HTTPException(status_code=406, detail=f"{unavailable} is not supported by this server")
+    return JSON_TYPE
+
+
+def _msgpack_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _msgpack_body(batches):
+    # Rows are packed as arrays next to one list of column names, which is
+    # much smaller (and faster to decode) than repeating the keys per row
+    columns = None
+    rows = []
+    for description, batch in batches:
+        if columns is None:
+            columns = [column.name for column in description]
+        rows.extend(batch)
+    return msgpack.packb({"columns": columns, "rows": rows}, default=_msgpack_default)
+
+
+NUMERIC_OID = 1700
+# Largest precision an Arrow decimal128 holds
+DECIMAL128_MAX_PRECISION = 38
+
+
+# Postgres type OIDs -> Arrow types, everything else is sent as a string.
+# NUMERIC depends on the column's precision, see _arrow_type()
+def _arrow_types():
+    return {
+        16: pa.bool_(),
+        20: pa.int64(),
+        21: pa.int16(),
+        23: pa.int32(),
+        700: pa.float32(),
+        701: pa.float64(),
+        1082: pa.date32(),
+        1114: pa.timestamp("us"),
+        1184: pa.timestamp("us", tz="UTC"),
+    }
+
+
+def _arrow_type(column, types):
+    if column.type_code == NUMERIC_OID:
+        # NUMERIC(p, s) columns keep their exact values. Unconstrained ones
+        # (AVG and other computed values) have no fixed scale, they become doubles
+        if column.precision is not None and 0 < column.precision <= DECIMAL128_MAX_PRECISION:
+            return pa.decimal128(column.precision, column.scale or 0)
+        return pa.float64()
+    return types.get(column.type_code, pa.string())
+
+
+def _arrow_schema(description):
+    types = _arrow_types()
+    return pa.schema([pa.field(column.name, _arrow_type(column, types)) for column in description])
+
+
+def _arrow_array(values, field, column):
+    if column.type_code == NUMERIC_OID and pa.types.is_floating(field.type):
+        # pyarrow doesn't convert Decimal to double by itself
+        values = [None if value is None else float(value) for value in values]
+    return pa.array(values, type=field.type)
+
+
+def _arrow_stream(batches):
+    sink = io.BytesIO()
+    writer = None
+    schema = None
+    for description, rows in batches:
+        if writer is None:
+            schema = _arrow_schema(description)
+            writer = pa.ipc.new_stream(sink, schema)
+        # zip(*rows) turns the fetched tuples straight into columns
+        columns = list(zip(*rows)) if rows else [()] * len(schema)
+        arrays = [
+            _arrow_array(values, field, column)
+            for values, field, column in zip(columns, schema, description)
+        ]
+        writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    writer.close()
+    yield sink.getvalue()
+
+
+def _csv_stream(batches):
+    # Header from the first batch, then one chunk per batch. None becomes an
+    # empty field, dates and numbers are written with str()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header = False
+    for description, rows in batches:
+        if not header:
+            writer.writerow([column.name for column in description])
+            header = True
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def bulk_response(media_type, batches):
+    """
+    Build a MessagePack, Arrow IPC or CSV response from (description, rows) batches.
+
+    `batches` is one of the `stream_*` generators from db.py.
+    """
+    if media_type == ARROW_TYPE:
+        return StreamingResponse(_arrow_stream(batches), media_type=ARROW_TYPE)
+    if media_type == CSV_TYPE:
+        return StreamingResponse(_csv_stream(batches), media_type=f"{CSV_TYPE}; charset=utf-8")
+    return Response(_msgpack_body(batches), media_type=MSGPACK_TYPE)
@@ -0,0 +1,172 @@
+import hmac
+import inspect
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from time import perf_counter
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+from server_timing import current_timing, route_label
+
+# Requests sending `X-Profile: <PROFILE_SECRET>` are profiled, unset turns profiling off
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+PROFILE_HEADER = "x-profile"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Seconds between two stack samples
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+
+logger = logging.getLogger(__name__)
+
+_SLUG = re.compile(r"[^A-Za-z0-9]+")
+
+
+def profiling_requested(scope):
+    """True when the request carries the profile header with the right secret."""
+    if not PROFILE_SECRET:
+        return False
+    value = Headers(scope=scope).get(PROFILE_HEADER)
+    return value is not None and hmac.compare_digest(value.encode(), PROFILE_SECRET.encode())
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RequestProfiler:
+    """
+    Samples the stacks that run one request's endpoint.
+
+    A background thread looks at every thread's current stack each
+    `interval` seconds and keeps the ones that are inside the route's
+    endpoint function, from the endpoint down. Sync routes run on the
+    threadpool, so this is the only way to follow them without a tracing
+    hook. Concurrent requests to the same route are sampled as well, so
+    profile on a quiet server.
+    """
+
+    def __init__(self, scope, interval=PROFILE_INTERVAL):
+        self.scope = scope
+        self.interval = interval
+        self.samples = Counter()
+        self.ticks = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self.started = perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.seconds = perf_counter() - self.started
+
+    def _endpoint_code(self):
+        # The router fills in scope["route"] once the request has been matched
+        endpoint = getattr(self.scope.get("route"), "endpoint", None)
+        if endpoint is None:
+            return None
+        # Look through functools.wraps decorators such as single_flight
+        return getattr(inspect.unwrap(endpoint), "__code__", None)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.ticks += 1
+            code = self._endpoint_code()
+            if code is None:
+                continue
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame)
+                    if frame.f_code is code:
+                        self.samples[";".join(_frame_label(f) for f in reversed(stack))] += 1
+                        break
+                    frame = frame.f_back
+
+    def collapsed(self):
+        """Samples in the collapsed-stack format read by flamegraph.pl and speedscope."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def _write_profile(directory, name, collapsed, summary):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{name}.collapsed"), "w") as f:
+        f.write(collapsed)
+    with open(os.path.join(directory, f"{name}.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware that profiles single requests on demand.
+
+    Requests with the profile header get sampled while they run. The
+    collapsed stacks and a JSON summary (route, status, sample count and the
+    request's Server-Timing numbers) are written to PROFILE_DIR, and the
+    response carries the file name in an X-Profile-File header.
+    """
+
+    def __init__(self, app, directory=PROFILE_DIR):
+        self.app = app
+        self.directory = directory
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiling_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        now = datetime.now(timezone.utc)
+        name = f"{now.strftime('%Y%m%dT%H%M%S%f')}-{scope['method'].lower()}{_SLUG.sub('-', scope['path']).rstrip('-')}"
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append("X-Profile-File", name)
+            await send(message)
+
+        profiler = RequestProfiler(scope)
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            timing = current_timing()
+            summary = {
+                "time": now.isoformat(),
+                "method": scope["method"],
+                "route": route_label(scope),
+                "path": scope["path"],
+                "query_string": scope.get("query_string", b"").decode("latin-1"),
+                "status": status,
+                "total_ms": round(profiler.seconds * 1000, 3),
+                "interval_ms": profiler.interval * 1000,
+                "ticks": profiler.ticks,
+                "samples": sum(profiler.samples.values()),
+            }
+            if timing is not None:
+                summary.update({
+                    "queries": timing.queries,
+                    "commits": timing.commits,
+                    "db_ms": round(timing.db_seconds * 1000, 3),
+                    "connect_ms": round(timing.connect_seconds * 1000, 3),
+                    "queue_ms": round(timing.queue_seconds * 1000, 3),
+                    "serialize_ms": round(timing.serialize_seconds * 1000, 3),
+                })
+            try:
+                await run_in_threadpool(_write_profile, self.directory, name, profiler.collapsed(), summary)
+            except OSError as e:
+                logger.warning("Could not write profile %s: %s", name, e)
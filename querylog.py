@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from time import perf_counter
+
+import psycopg2
+import psycopg2.extensions
+
+from conntrack import release
+from server_timing import record_commit, record_query
+
+# Statements slower than this are written to the slow-query log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# Share of slow statements that also get an EXPLAIN, 0 turns it off. Plain SELECTs
+# are re-run with ANALYZE and BUFFERS, data-changing statements are only planned
+EXPLAIN_SAMPLE_RATE = float(os.getenv("EXPLAIN_SAMPLE_RATE", "0.1"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "slow_queries.log")
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "5"))
+# Upper bound for the EXPLAIN re-run, so a bad query doesn't run forever twice
+EXPLAIN_TIMEOUT_MS = int(os.getenv("EXPLAIN_TIMEOUT_MS", "30000"))
+
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+# Re-running anything else would take the writers' row locks again, use sequence
+# values and fire the rollup and counter triggers, so those only get a plain EXPLAIN
+_READ_ONLY = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+_ROW_LOCKING = re.compile(r"\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+logger = logging.getLogger(__name__)
+
+_queue = queue.Queue(maxsize=1000)
+_worker = None
+_worker_lock = threading.Lock()
+_recent = deque(maxlen=50)
+_stats_lock = threading.Lock()
+_stats = {"slow_queries": 0, "explained": 0, "explain_errors": 0, "dropped": 0}
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def redact(params):
+    """Replace parameter values with their type, so no user data ends up in the log."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: redact_value(value) for key, value in params.items()}
+    return [redact_value(value) for value in params]
+
+
+def redact_value(value):
+    if value is None:
+        return None
+    if isinstance(value, (str, bytes)):
+        return f"<{type(value).__name__} len={len(value)}>"
+    if isinstance(value, (list, tuple)):
+        return f"<{type(value).__name__} len={len(value)}>"
+    return f"<{type(value).__name__}>"
+
+
+def _query_text(query):
+    if isinstance(query, bytes):
+        query = query.decode()
+    elif not isinstance(query, str):
+        # psycopg2.sql.Composed and friends
+        query = str(query)
+    return query
+
+
+def log_slow_query(query, params, seconds, function):
+    """Hand a slow statement to the worker thread, which writes it and maybe EXPLAINs it."""
+    _count("slow_queries")
+    query = _query_text(query)
+    entry = {
+        "time": datetime.now(timezone.utc).isoformat(),
+        "function": function,
+        "duration_ms": round(seconds * 1000, 3),
+        # Whitespace is collapsed for the log only, the EXPLAIN runs the original text
+        "query": _WHITESPACE.sub(" ", query).strip(),
+        "params": redact(params),
+    }
+    explain = EXPLAIN_SAMPLE_RATE > 0 and random.random() < EXPLAIN_SAMPLE_RATE
+    _ensure_worker()
+    try:
+        # The real parameters are only kept in memory, for the EXPLAIN re-run
+        _queue.put_nowait((entry, query, params if explain else None, explain))
+    except queue.Full:
+        _count("dropped")
+
+
+def _ensure_worker():
+    global _worker
+    if _worker is not None:
+        return
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_run_worker, name="slow-query-log", daemon=True)
+            _worker.start()
+
+
+def _file_logger():
+    file_logger = logging.getLogger(f"{__name__}.file")
+    file_logger.propagate = False
+    file_logger.setLevel(logging.INFO)
+    if not file_logger.handlers:
+        handler = RotatingFileHandler(
+            SLOW_QUERY_LOG,
+            maxBytes=SLOW_QUERY_LOG_MAX_BYTES,
+            backupCount=SLOW_QUERY_LOG_BACKUPS,
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        file_logger.addHandler(handler)
+    return file_logger
+
+
+def _analyzable(query):
+    return _READ_ONLY.match(query) is not None and _ROW_LOCKING.search(query) is None
+
+
+def _explain(con, query, params):
+    # ANALYZE really runs the statement, so always roll back; NOTIFYs from a
+    # rolled back transaction are never delivered either
+    explain = "EXPLAIN (ANALYZE, BUFFERS) " if _analyzable(query) else "EXPLAIN "
+    with con.cursor() as cursor:
+        try:
+            cursor.execute("SET LOCAL statement_timeout = %s;", (EXPLAIN_TIMEOUT_MS,))
+            cursor.execute(explain + query, params)
+            return "\n".join(row[0] for row in cursor.fetchall())
+        finally:
+            con.rollback()
+
+
+def _run_worker():
+    # Imported here, db_setup imports this module for QueryLogConnection
+    from db_setup import get_connection
+
+    file_logger = _file_logger()
+    explain_con = None
+
+    while True:
+        entry, query, params, explain = _queue.get()
+
+        if explain and _EXPLAINABLE.match(query):
+            try:
+                if explain_con is None or explain_con.closed:
+                    # A plain connection, its statements must not end up in this log
+                    explain_con = get_connection(connection_factory=psycopg2.extensions.connection)
+                entry["plan"] = _explain(explain_con, query, params)
+                _count("explained")
+            except psycopg2.Error as e:
+                entry["explain_error"] = str(e).strip()
+                _count("explain_errors")
+                if explain_con is not None and explain_con.closed:
+                    explain_con = None
+
+        try:
+            file_logger.info(json.dumps(entry, default=str))
+        except Exception as e:
+            logger.warning("Could not write to the slow-query log: %s", e)
+        _recent.append(entry)
+
+
+def slow_query_stats():
+    """Counters plus the most recent slow statements (parameters redacted)."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["threshold_ms"] = SLOW_QUERY_MS
+    stats["explain_sample_rate"] = EXPLAIN_SAMPLE_RATE
+    stats["log_file"] = os.path.abspath(SLOW_QUERY_LOG)
+    stats["recent"] = list(_recent)
+    return stats
+
+
+_cursor_classes = {}
+
+
+def _timed_cursor_class(base):
+    cls = _cursor_classes.get(base)
+    if cls is None:
+        class TimedCursor(base):
+            def execute(self, query, vars=None):
+                started = perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    elapsed = perf_counter() - started
+                    record_query(elapsed)
+                    if elapsed * 1000 >= SLOW_QUERY_MS:
+                        # The caller is the db.py function that ran the statement
+                        log_slow_query(query, vars, elapsed, sys._getframe(1).f_code.co_name)
+
+        TimedCursor.__name__ = f"Timed{base.__name__}"
+        cls = _cursor_classes[base] = TimedCursor
+    return cls
+
+
+class QueryLogConnection(psycopg2.extensions.connection):
+    """
+    Connection whose cursors time every execute().
+
+    Works with any cursor_factory (RealDictCursor in db.py, plain and named
+    cursors elsewhere) by wrapping it in a subclass that reports slow
+    statements to the slow-query log. Statements and the commits done by
+    `with con:` are also counted for the current request (server_timing.py).
+    """
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        started = perf_counter()
+        try:
+            return super().__exit__(exc_type, exc_value, traceback)
+        finally:
+            if exc_type is None:
+                record_commit(perf_counter() - started)
+
+    def close(self):
+        release(self)
+        super().close()
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = _timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
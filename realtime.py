@@ -0,0 +1,166 @@
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+
+import psycopg2
+from starlette.concurrency import run_in_threadpool
+
+from db import MESSAGE_CHANNEL, get_message, message_payload
+from db_setup import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Messages buffered per subscriber before the oldest ones are dropped (slow clients)
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("SUBSCRIBER_QUEUE_SIZE", "100"))
+# Seconds between attempts to (re)connect the listener
+LISTENER_RETRY_SECONDS = float(os.getenv("LISTENER_RETRY_SECONDS", "2.0"))
+
+
+class MessageHub:
+    """
+    Fans new messages out to everyone waiting for them in this process.
+
+    One LISTEN connection per process receives the notifications sent by
+    db.create_message, and every subscriber (a WebSocket, a long-poll
+    request, ...) gets its own asyncio.Queue keyed on user_id. Both the
+    sender and the receiver of a message are notified.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._connection = None
+        self._task = None
+        self._loop = None
+        self._fetches = set()
+        self.notifications = 0
+
+    # --- subscribers ---
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self._subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+
+    def subscriber_count(self):
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def publish(self, message, text):
+        """
+        Deliver a message to the sender's and receiver's subscribers.
+
+        `text` is the message already encoded as JSON, so it is serialized
+        once no matter how many sockets it goes out on.
+        """
+        for user_id in {message["sender_id"], message["receiver_id"]}:
+            for queue in self._subscribers.get(user_id, ()):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait((message, text))
+
+    # --- listener ---
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._listen_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._disconnect()
+
+    def _connect(self):
+        connection = get_connection()
+        connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {MESSAGE_CHANNEL};")
+        return connection
+
+    def _disconnect(self):
+        if self._connection is None:
+            return
+        try:
+            self._loop.remove_reader(self._connection.fileno())
+        except (ValueError, OSError):
+            pass
+        self._connection.close()
+        self._connection = None
+
+    async def _listen_forever(self):
+        while True:
+            try:
+                self._connection = await run_in_threadpool(self._connect)
+            except psycopg2.Error as e:
+                logger.warning("Message listener could not connect: %s", e)
+                await asyncio.sleep(LISTENER_RETRY_SECONDS)
+                continue
+
+            lost = asyncio.Event()
+            self._loop.add_reader(self._connection.fileno(), self._on_readable, lost)
+            logger.info("Message listener is listening on %r", MESSAGE_CHANNEL)
+            await lost.wait()
+            self._disconnect()
+            await asyncio.sleep(LISTENER_RETRY_SECONDS)
+
+    def _on_readable(self, lost):
+        try:
+            self._connection.poll()
+        except psycopg2.Error as e:
+            logger.warning("Message listener lost its connection: %s", e)
+            self._loop.remove_reader(self._connection.fileno())
+            lost.set()
+            return
+
+        while self._connection.notifies:
+            notify = self._connection.notifies.pop(0)
+            self.notifications += 1
+            message = json.loads(notify.payload)
+            if "content" in message:
+                self.publish(message, notify.payload)
+            else:
+                # Too large for a NOTIFY payload, read the full row once for all subscribers
+                task = asyncio.create_task(self._publish_full(message["message_id"]))
+                self._fetches.add(task)
+                task.add_done_callback(self._fetches.discard)
+
+    async def _publish_full(self, message_id):
+        def fetch():
+            con = get_connection()
+            try:
+                return get_message(con, message_id)
+            finally:
+                con.close()
+
+        try:
+            message = await run_in_threadpool(fetch)
+        except Exception as e:
+            logger.warning("Could not load message %s: %s", message_id, e)
+            return
+        if message is None:
+            return
+        message = message_payload(message)
+        self.publish(message, json.dumps(message))
+
+    def stats(self):
+        return {
+            "listening": self._connection is not None,
+            "users": len(self._subscribers),
+            "subscribers": self.subscriber_count(),
+            "notifications": self.notifications,
+        }
+
+
+message_hub = MessageHub()
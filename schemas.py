@@ -17,6 +17,10 @@ class UserGet(BaseModel):
     email: EmailStr
     role: str
 
+# User search hit | score is the trigram word similarity, 0 to 1
+class UserSearchGet(UserGet):
+    score: float
+
 # PATCH user
 class UserPatch(BaseModel):
     username: str | None = Field(None, max_length=50)
@@ -74,6 +78,15 @@ class CoursePut(BaseModel):
 class CourseDelete(BaseModel):
     id: int
 
+# Course counters | kept up to date by triggers, see course_stats in db_setup.py
+class CourseStatsGet(BaseModel):
+    course_id: int
+    title: str
+    enrollments: int
+    lessons: int
+    assignments: int
+    resources: int
+
 # --- ENROLLMENT ---
 
 # Create Enrollment
@@ -121,6 +134,18 @@ class MessageCreate(BaseModel):
     course_id: int | None = None
     content: str
 
+# Create Broadcast | one message to every student enrolled in a course
+class BroadcastCreate(BaseModel):
+    sender_id: int
+    content: str
+
+# Result of a broadcast
+class BroadcastGet(BaseModel):
+    course_id: int
+    recipients: int
+    first_message_id: int | None = None
+    last_message_id: int | None = None
+
 # GET Messages
 class MessageGet(BaseModel):
     message_id: int
@@ -130,6 +155,42 @@ class MessageGet(BaseModel):
     content: str
     sent_at: datetime
 
+# GET Conversations | the latest message with each conversation partner
+class ConversationGet(BaseModel):
+    partner_id: int
+    partner_username: str
+    message_id: int
+    sender_id: int
+    receiver_id: int
+    course_id: int | None = None
+    content: str
+    sent_at: datetime
+    unread_count: int = 0
+
+# Message search hit | partner_id is the other participant, rank the text match
+class MessageSearchGet(BaseModel):
+    message_id: int
+    sender_id: int
+    receiver_id: int
+    partner_id: int
+    course_id: int | None = None
+    content: str
+    sent_at: datetime
+    rank: float
+
+# GET Read state | how far a user has read a conversation (read receipt)
+class ConversationReadGet(BaseModel):
+    user_id: int
+    partner_id: int
+    unread_count: int
+    last_read_message_id: int | None = None
+    read_at: datetime | None = None
+
+# GET Unread counters for a user
+class UnreadCountsGet(BaseModel):
+    total: int
+    conversations: list[ConversationReadGet]
+
 # --- SUBMISSION ---
 
 # Create Submission
@@ -146,6 +207,7 @@ class SubmissionGet(BaseModel):
     submitted_at: datetime
     url: str | None = None
     grade: str | None = None
+    score: float | None = None # grade as a number, from the grade itself or the grade_scale table
     feedback: str | None = None
 
 # Updating Grades 
@@ -154,6 +216,44 @@ class GradeUpdate(BaseModel):
     grade: str | None = None
     feedback: str | None = None
 
+# One histogram bucket, scores from low (inclusive) to high
+class GradeBucket(BaseModel):
+    low: float
+    high: float
+    count: int
+
+# Grade statistics | submissions counts every submission, graded only those with a score
+class GradeStatsGet(BaseModel):
+    submissions: int
+    graded: int
+    mean: float | None = None
+    stddev: float | None = None
+    min: float | None = None
+    max: float | None = None
+    p25: float | None = None
+    median: float | None = None
+    p75: float | None = None
+    p90: float | None = None
+    histogram: list[GradeBucket]
+
+class AssignmentGradeStatsGet(GradeStatsGet):
+    assignment_id: int
+
+class CourseGradeStatsGet(GradeStatsGet):
+    course_id: int
+
+# Late/missing report | one row per enrolled student who is missing or late on an assignment
+class SubmissionReportGet(BaseModel):
+    assignment_id: int
+    assignment_title: str
+    due_date: datetime
+    student_id: int
+    username: str
+    email: str
+    status: str  # missing or late
+    submission_id: int | None = None  # first submission, for late ones
+    submitted_at: datetime | None = None
+
 # --- LESSON ---
 
 # Create Lesson
@@ -254,4 +354,38 @@ class AttendancePut(BaseModel):
 
 # DELETE Attendance
 class AttendanceDelete(BaseModel):
-    id: int
\ No newline at end of file
+    id: int
+
+# Attendance rate | rate is (present + late) / total, None without any attendance
+class AttendanceRate(BaseModel):
+    present: int
+    absent: int
+    late: int
+    total: int
+    rate: float | None = None
+
+class CourseAttendanceRate(AttendanceRate):
+    course_id: int
+
+class StudentAttendanceRate(AttendanceRate):
+    student_id: int
+
+# A student's rate over all courses, and per course
+class StudentAttendanceRatesGet(AttendanceRate):
+    student_id: int
+    courses: list[CourseAttendanceRate]
+
+# A course's rate over all students, and per student
+class CourseAttendanceRatesGet(AttendanceRate):
+    course_id: int
+    students: list[StudentAttendanceRate]
+
+# --- SEARCH ---
+
+# Search hit | kind is course, lesson or resource and id is that row's ID
+class SearchResultGet(BaseModel):
+    kind: str
+    id: int
+    course_id: int
+    title: str
+    rank: float
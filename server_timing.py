@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import sys
+from contextvars import ContextVar
+from time import perf_counter
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
+
+# Set to 0 to stop writing one JSON log line per request
+REQUEST_LOG = os.getenv("REQUEST_LOG", "1") == "1"
+
+logger = logging.getLogger("request_timing")
+if REQUEST_LOG and not logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def route_label(scope):
+    """
+    The route template of a request, e.g. "/courses/{course_id}/resources".
+
+    FastAPI puts the matched route into the scope, so this only works once
+    the request has been routed; before that the raw path is returned.
+    """
+    route = scope.get("route")
+    return getattr(route, "path", None) or scope.get("path", "unknown")
+
+
+class RequestTiming:
+    """Database and serialization accounting for one request."""
+
+    __slots__ = (
+        "scope", "started", "queries", "db_seconds", "commits", "connections",
+        "connect_seconds", "queue_seconds", "serialize_seconds",
+    )
+
+    def __init__(self, scope=None):
+        self.scope = scope
+        self.started = perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.commits = 0
+        self.connections = 0
+        self.connect_seconds = 0.0
+        self.queue_seconds = 0.0
+        self.serialize_seconds = 0.0
+
+
+# The middleware puts a RequestTiming here; sync routes run in the threadpool
+# with a copy of the context, which still points at the same object
+_current = ContextVar("request_timing", default=None)
+
+
+def current_timing():
+    return _current.get()
+
+
+def current_route():
+    """Route template of the request being handled, None outside of a request."""
+    timing = _current.get()
+    if timing is None or timing.scope is None:
+        return None
+    return f"{timing.scope['method']} {route_label(timing.scope)}"
+
+
+def record_query(seconds):
+    timing = _current.get()
+    if timing is not None:
+        timing.queries += 1
+        timing.db_seconds += seconds
+
+
+def record_commit(seconds):
+    timing = _current.get()
+    if timing is not None:
+        timing.commits += 1
+        timing.db_seconds += seconds
+
+
+def record_connect(seconds):
+    timing = _current.get()
+    if timing is not None:
+        timing.connections += 1
+        timing.connect_seconds += seconds
+
+
+def record_queue_wait(seconds):
+    timing = _current.get()
+    if timing is not None:
+        timing.queue_seconds += seconds
+
+
+def record_serialize(seconds):
+    timing = _current.get()
+    if timing is not None:
+        timing.serialize_seconds += seconds
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that reports how long rendering the body took."""
+
+    def render(self, content):
+        started = perf_counter()
+        try:
+            return super().render(content)
+        finally:
+            record_serialize(perf_counter() - started)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def server_timing_header(timing, total_seconds):
+    return ", ".join([
+        f'db;dur={_ms(timing.db_seconds)};desc="{timing.queries} queries, {timing.commits} commits"',
+        f'conn;dur={_ms(timing.connect_seconds)};desc="{timing.connections} connections"',
+        f"queue;dur={_ms(timing.queue_seconds)}",
+        f"ser;dur={_ms(timing.serialize_seconds)}",
+        f"total;dur={_ms(total_seconds)}",
+    ])
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that accounts database work per request.
+
+    Counts queries, commits, total DB time, connection setup and admission
+    queue wait, and JSON rendering time. They are sent back in a
+    Server-Timing header and written as one JSON log line per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming(scope)
+        token = _current.set(timing)
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing_header(timing, perf_counter() - timing.started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            if REQUEST_LOG:
+                logger.info(json.dumps({
+                    "method": scope["method"],
+                    "route": route_label(scope),
+                    "path": scope["path"],
+                    "status": status,
+                    "total_ms": _ms(perf_counter() - timing.started),
+                    "queries": timing.queries,
+                    "commits": timing.commits,
+                    "db_ms": _ms(timing.db_seconds),
+                    "connections": timing.connections,
+                    "connect_ms": _ms(timing.connect_seconds),
+                    "queue_ms": _ms(timing.queue_seconds),
+                    "serialize_ms": _ms(timing.serialize_seconds),
+                }))